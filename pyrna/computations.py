@@ -200,7 +200,7 @@ class Bcheck(Tool):
                         if tokens[-1] == '+':
                             hit['sequence'] = target_molecule.sequence[start-1:end]
                         else:
-                            hit['sequence'] = target_molecule.get_complement()[start-1:end][::-1]
+                            hit['sequence'] = target_molecule.reverse_complement(start-1, end)
                 hits.append(hit)
 
         return DataFrame(hits)
@@ -281,7 +281,7 @@ class Blast(Tool):
                             if subject_plus_strand:
                                 sequence = m.sequence[subject_positions[0][0]-1:subject_positions[-1][1]]
                             else:
-                                sequence = m.get_complement()[subject_positions[0][0]-1:subject_positions[-1][1]][::-1]
+                                sequence = m.reverse_complement(subject_positions[0][0]-1, subject_positions[-1][1])
                             hits.append({
                                 "name": query_name,
                                 "target_name":sequence_name,
@@ -330,7 +330,7 @@ class Blast(Tool):
                     if subject_plus_strand:
                         sequence = m.sequence[subject_positions[0][0]-1:subject_positions[-1][1]]
                     else:
-                        sequence = m.get_complement()[subject_positions[0][0]-1:subject_positions[-1][1]][::-1]
+                        sequence = m.reverse_complement(subject_positions[0][0]-1, subject_positions[-1][1])
                     hits.append({
                         "name": query_name,
                         "target_name":sequence_name,
@@ -916,7 +916,7 @@ class Cmsearch(Tool):
                                 sequence = m.sequence[target_positions[0][0]-1:target_positions[-1][1]]
                             else:
                                 target_positions = target_positions[::-1]
-                                sequence = m.get_complement()[target_positions[0][0]-1:target_positions[-1][1]][::-1]
+                                sequence = m.reverse_complement(target_positions[0][0]-1, target_positions[-1][1])
                             hit = {
                                 "cm_file": cm_file,
                                 "RFAM_family": rfam_family_id,
@@ -1412,7 +1412,7 @@ class Gotohscan(Tool):
                         if tokens[-1] == '+':
                             hit['sequence'] = target_molecule.sequence[start-1:end]
                         else:
-                            hit['sequence'] = target_molecule.get_complement()[end-1:start][::-1]
+                            hit['sequence'] = target_molecule.reverse_complement(end-1, start)
                 hits.append(hit)
 
         return DataFrame(hits)
@@ -1669,7 +1669,7 @@ class RNAMotif(Tool):
                         hit['target_strand'] = '-'
                         hit['target_positions'] = [int(tokens[3])-(int(tokens[4])-1), int(tokens[3])]
                         if target_molecule:
-                            hit['sequence'] = target_molecule.get_complement()[hit['target_positions'][0]-1:hit['target_positions'][1]][::-1]
+                            hit['sequence'] = target_molecule.reverse_complement(hit['target_positions'][0]-1, hit['target_positions'][1])
                     length_list = []
                     for sequence in tokens[5:]:
                         length_list.append(len(sequence))
@@ -1849,13 +1849,14 @@ class Rnasubopt(Tool):
         if not self.rest_server:
             check_docker_image('fjossinet/assemble2')
 
-    def fold(self, molecule, range = None, random_sample = None):
+    def fold(self, molecule, range = None, random_sample = None, pair_table = False):
         """
         Parameters:
         ---------
         - molecule: a Molecule object (see pyrna.features)
         - range (default: None): calculate suboptimal structures within range kcal/mol of the mfe.
         - random_sample (default: None): instead of producing all suboptimals in an energy range, produce a random sample of n suboptimal structures.
+        - pair_table (default: False): if True, the structures are returned as a single pair table (see pyrna.parsers.parse_bn_many()) and no pandas DataFrame is created.
 
         Returns:
         --------
@@ -1867,12 +1868,14 @@ class Rnasubopt(Tool):
             fasta_file.write(parsers.to_fasta([molecule], single_line=True))
 
         output = commands.getoutput("docker run -v %s:/data fjossinet/assemble2 bash -c 'RNAsubopt %s %s < /data/%s'"%(self.cache_dir, "-e %i"%range if range else "" ,  "-p %i"%random_sample if random_sample else "", fileName)).strip()
-        secondary_structures = []
+        bns = []
         for line in output.split('\n'):
             tokens = line.split(' ')
             if not line.startswith('>') and re.match("^[.()]+$", tokens[0]):
-                secondary_structures.append(parse_bn(tokens[0]))
-        return secondary_structures
+                bns.append(tokens[0])
+        if pair_table:
+            return parsers.parse_bn_many(bns)
+        return [parse_bn(bn) for bn in bns]
 
 class Rnaview(Tool):
     """
@@ -2174,7 +2177,7 @@ class SnoGPS(Tool):
                         else:
                             hit['target_strand'] = "-"
                             if target_molecule:
-                                hit['sequence'] = target_molecule.get_complement()[hit['target_positions'][0]-1:hit['target_positions'][1]][::-1]
+                                hit['sequence'] = target_molecule.reverse_complement(hit['target_positions'][0]-1, hit['target_positions'][1])
             if target_molecule:
                 if line.startswith('#stem1'):
                     chain1 = lines[j+2]
@@ -2192,10 +2195,10 @@ class SnoGPS(Tool):
                         jl = hit['target_positions'][0]+chain.rfind('L') if hit['target_strand'] is "+" else hit['target_positions'][1]-chain.rfind('L')
                         ir = hit['target_positions'][0]+chain.find('R') if hit['target_strand'] is "+" else hit['target_positions'][1]-chain.find('R')
                         jr = hit['target_positions'][0]+chain.rfind('R') if hit['target_strand'] is "+" else hit['target_positions'][1]-chain.rfind('R')
-                        hit['H-box'] = {'genomicPositions': [ih, ih+5], 'sequence': target_molecule[ih-1:ih+5]} if hit['target_strand'] is "+" else {'genomicPositions': [ih-5, ih], 'sequence': target_molecule.get_complement()[ih-6:ih][::-1]}
-                        hit['ACA-box'] = {'genomicPositions': [ic, ic+2], 'sequence': target_molecule[ic-1:ic+2]} if hit['target_strand'] is "+" else {'genomicPositions': [ic-2, ic], 'sequence': target_molecule.get_complement()[ic-3:ic][::-1]}
-                        hit['L-guide'] = {'genomicPositions': [il, jl], 'sequence': target_molecule[il-1:jl]} if hit['target_strand'] is "+" else {'genomicPositions': [jl, il], 'sequence': target_molecule.get_complement()[jl-1:il][::-1]}
-                        hit['R-guide'] = {'genomicPositions': [ir, jr], 'sequence': target_molecule[ir-1:jr]} if hit['target_strand'] is "+" else {'genomicPositions': [jr, ir], 'sequence': target_molecule.get_complement()[jr-1:ir][::-1]}
+                        hit['H-box'] = {'genomicPositions': [ih, ih+5], 'sequence': target_molecule[ih-1:ih+5]} if hit['target_strand'] is "+" else {'genomicPositions': [ih-5, ih], 'sequence': target_molecule.reverse_complement(ih-6, ih)}
+                        hit['ACA-box'] = {'genomicPositions': [ic, ic+2], 'sequence': target_molecule[ic-1:ic+2]} if hit['target_strand'] is "+" else {'genomicPositions': [ic-2, ic], 'sequence': target_molecule.reverse_complement(ic-3, ic)}
+                        hit['L-guide'] = {'genomicPositions': [il, jl], 'sequence': target_molecule[il-1:jl]} if hit['target_strand'] is "+" else {'genomicPositions': [jl, il], 'sequence': target_molecule.reverse_complement(jl-1, il)}
+                        hit['R-guide'] = {'genomicPositions': [ir, jr], 'sequence': target_molecule[ir-1:jr]} if hit['target_strand'] is "+" else {'genomicPositions': [jr, ir], 'sequence': target_molecule.reverse_complement(jr-1, ir)}
                         trantab = maketrans("HLR ", "....")
                         chars = chain.translate(trantab)
                         x = 0
@@ -2302,18 +2305,18 @@ class Snoreport(Tool):
                     i2 = len(molecule) - (int(words[-3].split(':')[-1])+1)
                     j2 = len(molecule) - int(words[-4].split(':')[-1])
                     hit['target_positions'] = [i2+1, j2]
-                    hit['sequence'] = molecule.get_complement()[i2:j2][::-1]
+                    hit['sequence'] = molecule.reverse_complement(i2, j2)
                 #hit['bracket_notation'] = parsers.parse_bn(lines[i-1]) #Panda DataFrame object cannot be encoded by pymongo
                 hit['bracket_notation'] = lines[i-1]
                 cross_notation = lines[i-2]
                 i3 = cross_notation.find('x')
                 j3 = cross_notation.rfind('x')
                 if line.startswith('CD'):
-                    hit['C-box'] = {'genomicPositions': [hit['target_positions'][0]+i3, hit['target_positions'][0]+i3+6], 'sequence': molecule[hit['target_positions'][0]+i3-1:hit['target_positions'][0]+i3+6]} if hit['target_strand'] is "+" else {'genomicPositions': [j2-(i3+6), j2-i3], 'sequence': molecule.get_complement()[j2-(i3+7):j2-i3][::-1]}
-                    hit['D-box'] = {'genomicPositions': [hit['target_positions'][0]+j3-3, hit['target_positions'][0]+j3], 'sequence': molecule[hit['target_positions'][0]+j3-4:hit['target_positions'][0]+j3]} if hit['target_strand'] is "+" else {'genomicPositions': [j2-j3, j2-(j3-3)], 'sequence': molecule.get_complement()[j2-j3-1:j2-(j3-3)][::-1]}
+                    hit['C-box'] = {'genomicPositions': [hit['target_positions'][0]+i3, hit['target_positions'][0]+i3+6], 'sequence': molecule[hit['target_positions'][0]+i3-1:hit['target_positions'][0]+i3+6]} if hit['target_strand'] is "+" else {'genomicPositions': [j2-(i3+6), j2-i3], 'sequence': molecule.reverse_complement(j2-(i3+7), j2-i3)}
+                    hit['D-box'] = {'genomicPositions': [hit['target_positions'][0]+j3-3, hit['target_positions'][0]+j3], 'sequence': molecule[hit['target_positions'][0]+j3-4:hit['target_positions'][0]+j3]} if hit['target_strand'] is "+" else {'genomicPositions': [j2-j3, j2-(j3-3)], 'sequence': molecule.reverse_complement(j2-j3-1, j2-(j3-3))}
                 else:
-                    hit['H-box'] = {'genomicPositions': [hit['target_positions'][0]+i3, hit['target_positions'][0]+i3+5], 'sequence': molecule[hit['target_positions'][0]+i3-1:hit['target_positions'][0]+i3+5]} if hit['target_strand'] is "+" else {'genomicPositions': [j2-(i3+5), j2-i3], 'sequence': molecule.get_complement()[j2-(i3+6):j2-i3][::-1]}
-                    hit['ACA-box'] = {'genomicPositions': [hit['target_positions'][0]+j3-2, hit['target_positions'][0]+j3], 'sequence': molecule[hit['target_positions'][0]+j3-3:hit['target_positions'][0]+j3]} if hit['target_strand'] is "+" else {'genomicPositions': [j2-j3, j2-(j3-2)], 'sequence': molecule.get_complement()[j2-j3-1:j2-(j3-2)][::-1]}
+                    hit['H-box'] = {'genomicPositions': [hit['target_positions'][0]+i3, hit['target_positions'][0]+i3+5], 'sequence': molecule[hit['target_positions'][0]+i3-1:hit['target_positions'][0]+i3+5]} if hit['target_strand'] is "+" else {'genomicPositions': [j2-(i3+5), j2-i3], 'sequence': molecule.reverse_complement(j2-(i3+6), j2-i3)}
+                    hit['ACA-box'] = {'genomicPositions': [hit['target_positions'][0]+j3-2, hit['target_positions'][0]+j3], 'sequence': molecule[hit['target_positions'][0]+j3-3:hit['target_positions'][0]+j3]} if hit['target_strand'] is "+" else {'genomicPositions': [j2-j3, j2-(j3-2)], 'sequence': molecule.reverse_complement(j2-j3-1, j2-(j3-2))}
                 hits.append(hit)
         if len(hits):
             return DataFrame(hits, columns = ['source', 'score',  'target_strand', 'target_name', 'class', 'name', 'target_positions', 'sequence', 'bracket_notation', 'C-box', 'D-box', 'H-box', 'ACA-box'])
@@ -2391,7 +2394,7 @@ class Snoscan(Tool):
                     hit['target_strand'] = "-"
                     hit['target_positions'] = target_positions[::-1]
                     if target_molecule:
-                        hit['sequence'] = target_molecule.get_complement()[hit['target_positions'][0]-1:hit['target_positions'][1]][::-1]
+                        hit['sequence'] = target_molecule.reverse_complement(hit['target_positions'][0]-1, hit['target_positions'][1])
                 else:
                     raise Exception("Hit with incorrect target positions")
                 hit['target_rRNA'] = tokens[5]
@@ -2406,15 +2409,15 @@ class Snoscan(Tool):
                     i = int(match.group(1))
                     j = int(match.group(2))
                     dist_cd = int(match.group(3))
-                    hit['C-box'] = {'genomicPositions': [i, j], 'sequence': target_molecule[i-1:j]} if hit['target_strand'] is "+" else {'genomicPositions': [j, i], 'sequence': target_molecule.get_complement()[j-1:i][::-1]}
-                    hit['D-box'] = {'genomicPositions': [j+dist_cd+1, j+dist_cd+4], 'sequence': target_molecule[j+dist_cd:j+dist_cd+4]} if hit['target_strand'] is "+" else {'genomicPositions': [j-dist_cd-4, j-dist_cd-1], 'sequence': target_molecule.get_complement()[j-dist_cd-5:j-dist_cd-1][::-1]}
+                    hit['C-box'] = {'genomicPositions': [i, j], 'sequence': target_molecule[i-1:j]} if hit['target_strand'] is "+" else {'genomicPositions': [j, i], 'sequence': target_molecule.reverse_complement(j-1, i)}
+                    hit['D-box'] = {'genomicPositions': [j+dist_cd+1, j+dist_cd+4], 'sequence': target_molecule[j+dist_cd:j+dist_cd+4]} if hit['target_strand'] is "+" else {'genomicPositions': [j-dist_cd-4, j-dist_cd-1], 'sequence': target_molecule.reverse_complement(j-dist_cd-5, j-dist_cd-1)}
             elif target_molecule and line.startswith('Qry seq:'):
                 pattern = re.compile('\((\d+)-(\d+)\)')
                 match = pattern.search(line)
                 if match:
                     i = int(match.group(1))
                     j = int(match.group(2))
-                    hit['guide_sequence'] = {'genomicPositions': [j, i], 'sequence': target_molecule[j-1:i]} if hit['target_strand'] is "+" else {'genomicPositions': [i, j], 'sequence': target_molecule.get_complement()[i-1:j][::-1]}
+                    hit['guide_sequence'] = {'genomicPositions': [j, i], 'sequence': target_molecule[j-1:i]} if hit['target_strand'] is "+" else {'genomicPositions': [i, j], 'sequence': target_molecule.reverse_complement(i-1, j)}
                 hits.append(hit)
                 target_molecule = None
         if not flag:
@@ -2483,7 +2486,7 @@ class TrnaScanSE(Tool):
                     elif target_positions[0] > target_positions[1]:
                         hit['target_strand'] = "-"
                         hit['target_positions'] = target_positions[::-1]
-                        hit['sequence'] = target_molecule.get_complement()[hit['target_positions'][0]:hit['target_positions'][1]][::-1]
+                        hit['sequence'] = target_molecule.reverse_complement(hit['target_positions'][0], hit['target_positions'][1])
                     else:
                         print "Error: hit with incorrect target positions"
                         print "##########\n" + line + "\n##########"
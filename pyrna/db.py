@@ -451,6 +451,8 @@ class Rfam:
         self.version = version
         if not os.path.exists(self.cache_dir):
             shutil.os.mkdir(self.cache_dir)
+        self.__indexes = {} #the offsets of the entries in the flat files Rfam.seed, Rfam.full and Rfam.cm (see get_index())
+        self.__flat_files = {}
 
     """
     This method returns the contents for an Rfam Entry
@@ -481,10 +483,11 @@ class Rfam:
                 raise Exception("Rfam family %s not found!!"%rfam_id)
         else:
             path = os.path.join(self.cache_dir, aln_type, "%s.sto"%rfam_id)
+            content = self.__read_entry(aln_type, rfam_id) #first from the flat file Rfam.seed or Rfam.full
 
-            if not os.path.exists(path):
+            if content is None and not os.path.exists(path):
                 raise Exception("file %s not found!!"%path)
-            else:
+            elif content is None:
                 with open(path) as h:
                     content = h.read()
                 if not content.strip().split('\n')[-1].strip() == '//': #incomplete file
@@ -502,8 +505,8 @@ class Rfam:
         """
         Return the content for a covariance model
         """
-        content = None
-        if os.path.exists(self.cache_dir+'/CMs/'+rfam_id+".cm"):
+        content = self.__read_entry('CMs', rfam_id) #first from the flat file Rfam.cm
+        if content is None and os.path.exists(self.cache_dir+'/CMs/'+rfam_id+".cm"):
             with open(self.cache_dir+'/CMs/'+rfam_id+".cm") as h:
                 content = ''.join(h.readlines())
         return content
@@ -633,59 +636,158 @@ class Rfam:
 
     def generate_seed_alignments(self):
         """
-        This method has to be called if the Rfam wrapper uses data from the FTP. Seed alignments will be downloaded and stored locally.
+        This method has to be called if the Rfam wrapper uses data from the FTP. Seed alignments will be downloaded and indexed locally (see get_index()).
         """
         if not os.path.exists(self.cache_dir+'/seed/Rfam.seed'):
             if not os.path.exists(self.cache_dir+'/seed/'):
                 shutil.os.mkdir(self.cache_dir+'/seed/')
             subprocess.call([os.path.dirname(os.path.realpath(__file__))+"/../scripts/shell/getRfam_data.sh "+self.cache_dir+"/seed/ ftp://ftp.ebi.ac.uk/pub/databases/Rfam/"+self.version+"/ Rfam.seed.gz"], shell=True)
 
-        with open(self.cache_dir+'/seed/Rfam.seed') as h:
-            currentAccession = None
-            currentContent = None
-
-            for line in h:
-                if re.match('^#=GF AC', line):
-                    if currentContent and currentAccession:
-                        with open(self.cache_dir+'/seed/'+currentAccession+'.sto', 'w') as output:
-                            output.write(currentContent)
-                    currentContent = "# STOCKHOLM 1.0\n"
-                    currentContent += line
-                    currentAccession = re.split("\s+", line)[-2]
-                elif currentContent and not re.match('^# STOCKHOLM 1.0', line):
-                    currentContent += line
-
-            if currentContent and currentAccession:
-                with open(self.cache_dir+'/seed/'+currentAccession+'.sto', 'w') as output:
-                    output.write(currentContent)
+        self.get_index('seed')
 
     def generate_full_alignments(self):
         """
-        This method has to be called if the Rfam wrapper uses data from the FTP. Full alignments will be downloaded and stored locally.
+        This method has to be called if the Rfam wrapper uses data from the FTP. Full alignments will be downloaded and indexed locally (see get_index()).
         """
         if not os.path.exists(self.cache_dir+'/full/Rfam.full'):
             if not os.path.exists(self.cache_dir+'/full/'):
                 shutil.os.mkdir(self.cache_dir+'/full/')
             subprocess.call([os.path.dirname(os.path.realpath(__file__))+"/../scripts/shell/getRfam_data.sh "+self.cache_dir+"/full/ ftp://ftp.ebi.ac.uk/pub/databases/Rfam/"+self.version+"/ Rfam.full.gz"], shell=True)
 
-        with open(self.cache_dir+'/full/Rfam.full') as h:
-            currentAccession = None
-            currentContent = None
+        self.get_index('full')
 
-            for line in h:
-                if re.match('^#=GF AC', line):
-                    if currentContent and currentAccession:
-                        with open(self.cache_dir+'/full/'+currentAccession+'.sto', 'w') as output:
-                            output.write(currentContent)
-                    currentContent = "# STOCKHOLM 1.0\n"
-                    currentContent += line
-                    currentAccession = re.split("\s+", line)[-2]
-                elif currentContent and not re.match('^# STOCKHOLM 1.0', line):
-                    currentContent += line
+    def get_index(self, aln_type = 'seed'):
+        """
+        This method returns the offsets of the entries in a flat file downloaded from the FTP of Rfam. The offsets are saved in an index file named after the Rfam version. This file is completed incrementally: only the bytes added to the flat file since the last call are scanned.
+
+        Parameters:
+        -----------
+        - aln_type (default: 'seed'): can be equal to 'seed' (Rfam.seed), 'full' (Rfam.full) or 'CMs' (Rfam.cm)
+
+        Returns:
+        --------
+        a dict whose keys are the accession numbers of the families and values the tuples (byte offset, length) of their entries. Returns None if the flat file doesn't exist.
+        """
+        flat_file = self.__get_flat_file(aln_type)
+        if not os.path.exists(flat_file):
+            return None
+        size = os.path.getsize(flat_file)
+        index = self.__indexes.get(aln_type)
+        if index and index[1] == size:
+            return index[0]
+
+        index_file = "%s.%s.index"%(flat_file, self.version)
+        entries = {}
+        scanned = 0
+        if os.path.exists(index_file):
+            with open(index_file) as h:
+                for line in h:
+                    tokens = line.split('\t')
+                    if tokens[0] == '#': #a checkpoint: all the entries before this offset are indexed
+                        scanned = int(tokens[1])
+                    else:
+                        entries[tokens[0]] = (int(tokens[1]), int(tokens[2]))
+        if scanned > size: #the flat file has been replaced
+            entries = {}
+            scanned = 0
+            os.remove(index_file)
+
+        with open(flat_file) as h:
+            h.seek(scanned)
+            new_entries, new_scanned, last_entry = self.__scan_flat_file(h, scanned, aln_type)
+        if new_scanned > scanned:
+            with open(index_file, 'a') as h:
+                for accession, offset, length in new_entries:
+                    h.write("%s\t%i\t%i\n"%(accession, offset, length))
+                h.write("#\t%i\n"%new_scanned)
+        for accession, offset, length in new_entries:
+            entries[accession] = (offset, length)
+        if last_entry: #the last entry of the file is complete but it will be scanned again next time, since the file could be still growing
+            entries[last_entry[0]] = last_entry[1:]
+        self.__indexes[aln_type] = (entries, size)
+        return entries
+
+    def __get_flat_file(self, aln_type):
+        if aln_type == 'CMs':
+            return self.cache_dir+'/CMs/Rfam.cm'
+        return self.cache_dir+'/%s/Rfam.%s'%(aln_type, aln_type)
+
+    def __scan_flat_file(self, h, offset, aln_type):
+        """
+        Scan a flat file from offset. A Stockholm entry goes from its first line to its line '//'. A CM entry goes from its INFERNAL line to the next one (the HMM filter following the covariance model is part of the entry).
 
-            if currentContent and currentAccession:
-                with open(self.cache_dir+'/full/'+currentAccession+'.sto', 'w') as output:
-                    output.write(currentContent)
+        Returns:
+        --------
+        a tuple containing the list of the (accession, offset, length) of the complete entries, the offset after the last of them, and the (accession, offset, length) of the last entry of the file if it ends with a line '//' (None otherwise)
+        """
+        entries = []
+        scanned = offset
+        entry_start = None
+        accession = None
+        line = ''
+        for line in h:
+            if aln_type == 'CMs':
+                if line.startswith('INFERNAL'):
+                    if entry_start is not None and accession:
+                        entries.append((accession, entry_start, offset-entry_start))
+                    if entry_start is not None:
+                        scanned = offset
+                    entry_start = offset
+                    accession = None
+                elif accession is None and line.startswith('ACC'):
+                    accession = line.split()[1]
+            else:
+                if entry_start is None and len(line.strip()):
+                    entry_start = offset
+                if line.startswith('#=GF AC'):
+                    accession = line.split()[2]
+                elif line.startswith('//'):
+                    if entry_start is not None and accession:
+                        entries.append((accession, entry_start, offset+len(line)-entry_start))
+                    scanned = offset+len(line)
+                    entry_start = None
+                    accession = None
+            offset += len(line)
+        last_entry = None
+        if aln_type == 'CMs' and entry_start is not None and accession and line.startswith('//'):
+            last_entry = (accession, entry_start, offset-entry_start)
+        return entries, scanned, last_entry
+
+    def __read_entry(self, aln_type, rfam_id):
+        """
+        Returns:
+        --------
+        the content of an entry read through a memory map of its flat file. Returns None if the flat file or the entry are not available.
+        """
+        import mmap
+        index = self.get_index(aln_type)
+        if not index or not index.has_key(rfam_id):
+            return None
+        offset, length = index[rfam_id]
+        data = self.__flat_files.get(aln_type)
+        if data is None or len(data) < offset+length: #the file has grown since it has been mapped
+            with open(self.__get_flat_file(aln_type)) as h:
+                data = self.__flat_files[aln_type] = mmap.mmap(h.fileno(), 0, access = mmap.ACCESS_READ)
+        return data[offset:offset+length]
+
+    def iter_entries(self, aln_type = 'seed'):
+        """
+        This method reads all the families of the file Rfam.seed or Rfam.full in a single pass, without writing one file per family. The file is downloaded from the FTP if needed.
+
+        Parameters:
+        -----------
+        - aln_type (default: 'seed'): the type of alignment. Can be equal to 'seed' or 'full'.
+
+        Returns:
+        --------
+        a generator of tuples like (accession number of the family, list of aligned sequences, dict of organism names (keys) and accession numbers/start-end (values), pandas Dataframe listing base-pairs).
+        """
+        path = self.cache_dir+'/%s/Rfam.%s'%(aln_type, aln_type)
+        if not os.path.exists(path):
+            if not os.path.exists(self.cache_dir+'/%s/'%aln_type):
+                shutil.os.mkdir(self.cache_dir+'/%s/'%aln_type)
+            subprocess.call([os.path.dirname(os.path.realpath(__file__))+"/../scripts/shell/getRfam_data.sh "+self.cache_dir+"/%s/ ftp://ftp.ebi.ac.uk/pub/databases/Rfam/"%aln_type+self.version+"/ Rfam.%s.gz"%aln_type], shell=True)
+        return parsers.iter_stockholm(path)
 
     def generate_CMs(self):
         """
@@ -732,3 +834,5 @@ class Rfam:
         for key in families:
             with open(self.cache_dir+'/CMs/'+key+'.cm', 'w') as f:
                 f.write(families[key])
+
+        self.get_index('CMs')
@@ -1,8 +1,11 @@
 from pandas import DataFrame
 import re
 from bson.objectid import ObjectId
-from itertools import groupby
+from itertools import groupby, chain
 from operator import itemgetter
+from bisect import bisect_left, bisect_right
+from array import array
+from heapq import heappush, heappop
 
 class Block:
     """
@@ -17,20 +20,35 @@ class Block:
             self.end = start
 
     def is_before(self, block):
-        pass
+        """
+        Test if this Block ends before the start of the Block given as argument (no shared position).
+        """
+        return self.end < block.start
 
     def is_beside(self, block):
-        pass
+        """
+        Test if this Block and the Block given as argument are contiguous (no gap and no shared position between them).
+        """
+        return self.end+1 == block.start or block.end+1 == self.start
 
     def intersects(self, block):
-        pass
+        """
+        Test if this Block shares at least one position with the Block given as argument.
+        """
+        return self.start <= block.end and block.start <= self.end
 
     def merge(self, block):
-        pass
+        """
+        Extend this Block to enclose the Block given as argument.
+        """
+        self.start = min(self.start, block.start)
+        self.end = max(self.end, block.end)
 
 class Location:
     """
     A Location defines a range of molecular positions, continuous or not. A location is made with Block objects.
+
+    The blocks are kept sorted, non-overlapping and non-contiguous. All the operations (membership, union, intersection, difference) are computed on the block boundaries and never on the single positions.
     """
     def __init__(self, start = None, end = None, single_positions = None, nested_lists = None):
         """
@@ -40,63 +58,132 @@ class Location:
         - list the ranges of continuous positions as nested lists: Location(nested_lists=[[34,34], [56,58], [67,69]])
         """
         self.blocks = []
+        self._starts = [] #the start positions of the blocks, used for the binary searches
         if start and end:
             self.add_block(Block(start, end))
         elif single_positions:
-            single_positions.sort()
+            single_positions = sorted(single_positions)
             for k, g in groupby(enumerate(single_positions), lambda (i,x):i-x):
                 _range = map(itemgetter(1), g)
                 self.blocks.append(Block(min(_range), max(_range)))
+            self.__normalize()
         elif nested_lists:
             for nested_list in nested_lists:
                 self.blocks.append(Block(min(nested_list), max(nested_list)))
+            self.__normalize()
+
+    def __normalize(self):
+        """
+        Sort the blocks and merge those that are overlapping or contiguous.
+        """
+        blocks = []
+        for block in sorted(self.blocks, key=lambda block: block.start):
+            if blocks and blocks[-1].end+1 >= block.start:
+                blocks[-1].merge(block)
+            else:
+                blocks.append(block)
+        self.__set_blocks(blocks)
+
+    def __set_blocks(self, blocks):
+        self.blocks = blocks
+        self._starts = [block.start for block in blocks]
+
+    @staticmethod
+    def _from_ranges(ranges):
+        """
+        Build a Location from a list of (start, end) tuples already sorted, non-overlapping and non-contiguous.
+        """
+        location = Location()
+        location.__set_blocks([Block(start, end) for start, end in ranges])
+        return location
+
+    def _ranges(self):
+        return [(block.start, block.end) for block in self.blocks]
 
     def add_block(self, block):
-        blocks_to_remove = []
-
-        for _block in self.blocks:
-            if block.is_before(_block) and not block.is_beside(_block):
-                break
-            elif block.intersects(_block) or block.is_beside(_block):
-                block.merge(_block)
-                blocks_to_remove.append(_block)
-                #its necessary to continue to see if the new Block can merge with other blocks
-                continue
-            elif len(blocks_to_remove):
-                break
+        #the first block that could be merged with the new one (it ends at least just before the new block)
+        i = bisect_left(self._starts, block.start)
+        if i > 0 and (self.blocks[i-1].intersects(block) or self.blocks[i-1].is_beside(block)):
+            i -= 1
+        j = i
+        #its necessary to continue to see if the new Block can merge with other blocks
+        while j < len(self.blocks) and not (block.is_before(self.blocks[j]) and not block.is_beside(self.blocks[j])):
+            block.merge(self.blocks[j])
+            j += 1
+        self.blocks[i:j] = [block]
+        self._starts[i:j] = [block.start]
+
+    def union(self, location):
+        """
+        Return a new Location object containing all the positions found in the current Location or in the Location given as argument.
+        """
+        ranges = []
+        for start, end in sorted(self._ranges() + location._ranges()):
+            if ranges and ranges[-1][1]+1 >= start:
+                if end > ranges[-1][1]:
+                    ranges[-1] = (ranges[-1][0], end)
+            else:
+                ranges.append((start, end))
+        return Location._from_ranges(ranges)
 
-        for block_to_remove in blocks_to_remove:
-            self.blocks.remove(block_to_remove)
+    def intersection(self, location):
+        """
+        Return a new Location object containing all the positions found both in the current Location and in the Location given as argument.
+        """
+        ranges = []
+        blocks_1, blocks_2 = self.blocks, location.blocks
+        i = j = 0
+        while i < len(blocks_1) and j < len(blocks_2):
+            start = max(blocks_1[i].start, blocks_2[j].start)
+            end = min(blocks_1[i].end, blocks_2[j].end)
+            if start <= end:
+                ranges.append((start, end))
+            if blocks_1[i].end < blocks_2[j].end:
+                i += 1
+            else:
+                j += 1
+        return Location._from_ranges(ranges)
 
-        self.blocks.append(block)
-        self.blocks = sorted(self.blocks, key=lambda block: block.start)
+    def difference(self, location):
+        """
+        Return a new Location object containing all the positions of the current Location not found in the Location given as argument.
+        """
+        ranges = []
+        blocks_2 = location.blocks
+        j = 0
+        for block in self.blocks:
+            start = block.start
+            while j < len(blocks_2) and blocks_2[j].end < start:
+                j += 1
+            k = j
+            while k < len(blocks_2) and blocks_2[k].start <= block.end:
+                if blocks_2[k].start > start:
+                    ranges.append((start, blocks_2[k].start-1))
+                start = max(start, blocks_2[k].end+1)
+                k += 1
+            if start <= block.end:
+                ranges.append((start, block.end))
+        return Location._from_ranges(ranges)
 
     def remove_location(self, location):
         """
         Return a new Location object from the difference between the current Location and the Location given as argument.
         Difference means all the positions not found in the Location given as argument
         """
-        single_positions_1 = self.get_single_positions()
-        single_positions_2 = location.get_single_positions()
-
-        diff = list(set(single_positions_1) - set(single_positions_2))
-
-        return Location(single_positions = diff)
+        return self.difference(location)
 
     def remove_locations(self, locations):
         """
         Return a new Location object from the difference between the current Location with all the Locations given in a list as argument.
         Difference means all the positions not found in the Locations given as argument
         """
-        single_positions_1 = self.get_single_positions()
-        single_positions_2 = []
-
+        blocks = []
         for location in locations:
-            single_positions_2 += location.get_single_positions()
-
-        diff = list(set(single_positions_1) - set(single_positions_2))
-
-        return Location(single_positions = diff)
+            blocks += location.blocks
+        to_remove = Location()
+        to_remove.blocks = [Block(block.start, block.end) for block in blocks]
+        to_remove.__normalize()
+        return self.difference(to_remove)
 
 
     def get_single_positions(self):
@@ -117,7 +204,8 @@ class Location:
         ---------
         position: an integer
         """
-        return position in self.get_single_positions()
+        i = bisect_right(self._starts, position)
+        return i > 0 and position <= self.blocks[i-1].end
 
     def start(self):
         return self.blocks[0].start
@@ -195,7 +283,7 @@ class Molecule:
 class DNA(Molecule):
     def __init__(self, sequence, name = 'dna'):
         Molecule.__init__(self, name)
-        self.sequence = sequence
+        self.sequence = str(sequence) if isinstance(sequence, SequenceView) else sequence
 
     def get_complement(self):
         """
@@ -203,18 +291,36 @@ class DNA(Molecule):
         ------
         the complement sequence as a string.
         """
-        basecomplement = {'A': 'T', 'C': 'G', 'G': 'C', 'T': 'A'}
-        letters = list(self.sequence)
-        letters = [basecomplement[base] if basecomplement.has_key(base) else base for base in letters]
-        return ''.join(letters)
+        return self.complement()
+
+    def complement(self):
+        """
+        Returns:
+        ------
+        the complement sequence as a string.
+        """
+        return complement_sequence(self.sequence, dna_complement_table)
+
+    def reverse_complement(self, start = None, end = None):
+        """
+        Compute the reverse complement of the whole sequence or of a window. Only the window is complemented.
+
+        Parameters:
+        ---------
+        - start (default: None): the start of the window, as for a slice of the sequence (0-based)
+        - end (default: None): the end of the window (excluded), as for a slice of the sequence
+
+        Returns:
+        ------
+        the reverse complement as a string, equal to get_complement()[start:end][::-1]
+        """
+        return complement_sequence(self.sequence[start:end], dna_complement_table)[::-1]
 
 
 class RNA(Molecule):
     def __init__(self, sequence, name = 'rna'):
         Molecule.__init__(self, name)
-
-        for residue in list(sequence):
-            self.add_residue(residue)
+        self.sequence, self.modified_residues = normalize_sequence(sequence, ribonucleotides_normalization)
 
     def add_residue(self, residue):
         if modified_ribonucleotides.has_key(residue):
@@ -234,17 +340,35 @@ class RNA(Molecule):
         ------
         the complement sequence as a string.
         """
-        basecomplement = {'A': 'U', 'C': 'G', 'G': 'C', 'U': 'A'}
-        letters = list(self.sequence)
-        letters = [basecomplement[base] if basecomplement.has_key(base) else base for base in letters]
-        return ''.join(letters)
+        return self.complement()
+
+    def complement(self):
+        """
+        Returns:
+        ------
+        the complement sequence as a string.
+        """
+        return complement_sequence(self.sequence, rna_complement_table)
+
+    def reverse_complement(self, start = None, end = None):
+        """
+        Compute the reverse complement of the whole sequence or of a window. Only the window is complemented.
+
+        Parameters:
+        ---------
+        - start (default: None): the start of the window, as for a slice of the sequence (0-based)
+        - end (default: None): the end of the window (excluded), as for a slice of the sequence
+
+        Returns:
+        ------
+        the reverse complement as a string, equal to get_complement()[start:end][::-1]
+        """
+        return complement_sequence(self.sequence[start:end], rna_complement_table)[::-1]
 
 class Protein(Molecule):
     def __init__(self, sequence, name = 'protein'):
         Molecule.__init__(self, name)
-
-        for residue in list(sequence):
-            self.add_residue(residue)
+        self.sequence, self.modified_residues = normalize_sequence(sequence, aminoacids_normalization)
 
     def add_residue(self, residue):
         if modified_aminoacids.has_key(residue):
@@ -252,6 +376,396 @@ class Protein(Molecule):
             residue = modified_aminoacids[residue]
         self.sequence = ''.join([self.sequence, residue])
 
+class SequenceView(object):
+    """
+    A read-only view on a range of a sequence buffer shared by several molecules (see CompactMolecule). Slicing a view produces a new view on the same buffer. The residues are copied only when the view is converted into a String.
+    """
+    __slots__ = ('buffer', 'start', 'end')
+
+    def __init__(self, buffer, start = 0, end = None):
+        self.buffer = buffer
+        self.start = start
+        self.end = len(buffer) if end is None else end
+
+    def __str__(self):
+        return str(self.buffer[self.start:self.end])
+
+    def __repr__(self):
+        return repr(str(self))
+
+    def __len__(self):
+        return self.end-self.start
+
+    def __iter__(self):
+        for i in xrange(self.start, self.end):
+            yield self.buffer[i]
+
+    def __contains__(self, residues):
+        return self.buffer.find(residues, self.start, self.end) != -1
+
+    def __getitem__(self, i):
+        if isinstance(i, slice):
+            start, stop, step = i.indices(len(self))
+            if step == 1:
+                return SequenceView(self.buffer, self.start+start, self.start+max(start, stop))
+            return str(self)[i]
+        if i < 0:
+            i += len(self)
+        if i < 0 or i >= len(self):
+            raise IndexError("sequence index out of range")
+        return self.buffer[self.start+i]
+
+    def __getslice__(self, i, j):
+        #negative indices have already been shifted by the length of the view
+        return self.__getitem__(slice(max(i, 0), max(j, 0)))
+
+    def __eq__(self, other):
+        return str(self) == str(other)
+
+    def __ne__(self, other):
+        return not self.__eq__(other)
+
+    def __hash__(self):
+        return hash(str(self))
+
+    def __add__(self, other):
+        return str(self)+str(other)
+
+    def __radd__(self, other):
+        return str(other)+str(self)
+
+    def count(self, residues):
+        return self.buffer.count(residues, self.start, self.end)
+
+    def find(self, residues):
+        i = self.buffer.find(residues, self.start, self.end)
+        return i-self.start if i != -1 else -1
+
+class CompactMolecule(object):
+    """
+    A Molecule storing its attributes in slots, to be used when millions of molecules (reads, hits, alignment rows,...) have to be kept in memory.
+    - its id is generated only when accessed for the first time,
+    - its sequence is a view on a buffer that can be shared by several molecules (see make_compact_molecules()). Slicing the molecule produces a SequenceView. The molecule gets its own sequence as soon as it is modified.
+    """
+    __slots__ = ('name', 'family', 'organism', 'lineage', 'source', '_oid', '_view', '_modified_residues', '_dbxref')
+
+    def __init__(self, sequence, name, modified_residues = None):
+        self.name = name
+        self.family = None
+        self.organism = None
+        self.lineage = None
+        self.source = 'N.A.:N.A.:N.A.'
+        self._oid = None
+        self._view = sequence if isinstance(sequence, SequenceView) else SequenceView(sequence)
+        self._modified_residues = modified_residues
+        self._dbxref = None
+
+    @property
+    def _id(self):
+        if self._oid is None:
+            self._oid = str(ObjectId())
+        return self._oid
+
+    @_id.setter
+    def _id(self, _id):
+        self._oid = _id
+
+    @property
+    def sequence(self):
+        return str(self._view)
+
+    @sequence.setter
+    def sequence(self, sequence):
+        self._view = SequenceView(str(sequence))
+
+    @property
+    def modified_residues(self):
+        if self._modified_residues is None:
+            self._modified_residues = []
+        return self._modified_residues
+
+    @modified_residues.setter
+    def modified_residues(self, modified_residues):
+        self._modified_residues = modified_residues
+
+    @property
+    def dbxref(self):
+        if self._dbxref is None:
+            self._dbxref = []
+        return self._dbxref
+
+    @dbxref.setter
+    def dbxref(self, dbxref):
+        self._dbxref = dbxref
+
+    #the same behaviour as the Molecule objects
+    get_gaps_positions = Molecule.get_gaps_positions.im_func
+    to_fasta = Molecule.to_fasta.im_func
+    _repr_html_ = Molecule._repr_html_.im_func
+
+    def __add__(self, seq):
+        if seq.__class__ == str:
+            self.sequence = ''.join([str(self._view), seq])
+
+    def __sub__(self, length):
+        if length.__class__ == int and length <= len(self._view):
+            self.sequence = str(self._view[0: len(self._view)-length])
+
+    def __len__(self):
+        return len(self._view)
+
+    def __iter__(self):
+        return iter(self._view)
+
+    def __getslice__(self, i, j):
+        return self._view.__getslice__(i, j)
+
+    def __getitem__(self, i):
+        return self._view.__getitem__(i)
+
+class CompactDNA(CompactMolecule):
+    __slots__ = ()
+
+    _complement_table = None #set after the definition of the tables
+
+    def get_complement(self):
+        return self.complement()
+
+    def complement(self):
+        return complement_sequence(str(self._view), self._complement_table)
+
+    def reverse_complement(self, start = None, end = None):
+        return complement_sequence(str(self._view[slice(start, end)]), self._complement_table)[::-1]
+
+class CompactRNA(CompactMolecule):
+    __slots__ = ()
+
+    _complement_table = None #set after the definition of the tables
+
+    #the same behaviour as the CompactDNA objects
+    get_complement = CompactDNA.get_complement.im_func
+    complement = CompactDNA.complement.im_func
+    reverse_complement = CompactDNA.reverse_complement.im_func
+
+class CompactProtein(CompactMolecule):
+    __slots__ = ()
+
+def make_compact_molecules(names, sequences, type = 'RNA'):
+    """
+    Create CompactMolecule objects whose sequences are views on a single shared buffer. The sequences are normalized like those of the RNA and Protein objects, in a single pass over the buffer.
+
+    Parameters:
+    ---------
+    - names: the names of the molecules
+    - sequences: the sequences of the molecules as Strings
+    - type (default: 'RNA'): can be equal to 'DNA', 'RNA' or 'Protein'
+
+    Returns:
+    ------
+    a list of CompactDNA, CompactRNA or CompactProtein objects (according to the value of the parameter type)
+    """
+    molecule_class, normalization = {
+        'DNA': (CompactDNA, None),
+        'RNA': (CompactRNA, ribonucleotides_normalization),
+        'Protein': (CompactProtein, aminoacids_normalization)
+    }[type]
+    offsets = [0]
+    for sequence in sequences:
+        offsets.append(offsets[-1]+len(sequence))
+    buffer = ''.join(sequences)
+    modified_residues = []
+    if normalization:
+        buffer, modified_residues = normalize_sequence(buffer, normalization)
+    molecules = []
+    j = 0
+    for i, name in enumerate(names):
+        _modified_residues = None
+        while j < len(modified_residues) and modified_residues[j][1] <= offsets[i+1]:
+            if _modified_residues is None:
+                _modified_residues = []
+            _modified_residues.append((modified_residues[j][0], modified_residues[j][1]-offsets[i]))
+            j += 1
+        molecules.append(molecule_class(SequenceView(buffer, offsets[i], offsets[i+1]), name, _modified_residues))
+    return molecules
+
+class StructureTree(object):
+    """
+    The tree of the helices and loops of a secondary structure. The nodes are stored in arrays (their kind, parent, ends) and their index is their id. The node 0 is the external loop. Each helix node has a single child: the loop it closes. The children of a loop node are the helices branching on it, sorted according to their start.
+
+    Each residue is mapped to the node it belongs to: the helix for a paired residue, the innermost loop for an unpaired one.
+
+    The tree is updated in place when a helix is added (see add_helix()). Only the residues and the nodes of the loop where the helix is inserted are visited. The helices crossing or overlapping a helix already in the tree (pseudoknots) are not added.
+    """
+    LOOP = 0
+    HELIX = 1
+
+    def __init__(self, length):
+        """
+        Parameters:
+        ---------
+        - length: the length of the molecule
+        """
+        self.length = length
+        self.kinds = array('b', [StructureTree.LOOP])
+        self.parents = array('i', [-1])
+        self.starts = array('i', [0]) #for a loop, the positions of the closing base pair (excluded from the loop)
+        self.ends = array('i', [length+1])
+        self.children = [[]]
+        self.__children_starts = [[]] #the starts of the children of each node, for binary searches
+        self.helices = [None]
+        self.single_strands = [[]]
+        self.tertiary_interactions = []
+        self.residue_nodes = array('i', [0])*(length+2)
+
+    def __len__(self):
+        return len(self.kinds)
+
+    def __new_node(self, kind, parent, start, end, helix = None):
+        self.kinds.append(kind)
+        self.parents.append(parent)
+        self.starts.append(start)
+        self.ends.append(end)
+        self.children.append([])
+        self.__children_starts.append([])
+        self.helices.append(helix)
+        self.single_strands.append([] if kind == StructureTree.LOOP else None)
+        return len(self.kinds)-1
+
+    def add_helix(self, helix):
+        """
+        Insert a helix in the loop enclosing its residues.
+
+        Returns:
+        ------
+        the node of the helix, or None if the helix was not inserted (it crosses or overlaps a helix already in the tree)
+        """
+        start, inner_start = helix['location'][0][0], helix['location'][0][-1]
+        inner_end, end = helix['location'][-1][0], helix['location'][-1][-1]
+        if start < 1 or end > self.length or inner_start >= inner_end:
+            return None
+        loop = self.residue_nodes[start]
+        if self.kinds[loop] != StructureTree.LOOP:
+            return None
+        for pos in chain(xrange(start, inner_start+1), xrange(inner_end, end+1)):
+            if self.residue_nodes[pos] != loop:
+                return None
+
+        helix_node = self.__new_node(StructureTree.HELIX, loop, start, end, helix)
+        inner_loop = self.__new_node(StructureTree.LOOP, helix_node, inner_start, inner_end)
+        self.children[helix_node].append(inner_loop)
+        self.__children_starts[helix_node].append(inner_start)
+
+        #the children of the loop between the strands of the helix are moved to the new loop
+        children, children_starts = self.children[loop], self.__children_starts[loop]
+        i, j = bisect_right(children_starts, inner_start), bisect_left(children_starts, inner_end)
+        moved_children = children[i:j]
+        self.children[inner_loop] = moved_children
+        self.__children_starts[inner_loop] = children_starts[i:j]
+        children[i:j] = [helix_node]
+        children_starts[i:j] = [start]
+        for child in moved_children:
+            self.parents[child] = inner_loop
+
+        #the residues of the loop between the strands of the helix are moved to the new loop
+        for pos in chain(xrange(start, inner_start+1), xrange(inner_end, end+1)):
+            self.residue_nodes[pos] = helix_node
+        pos = inner_start+1
+        for child in moved_children:
+            for _pos in xrange(pos, self.starts[child]):
+                self.residue_nodes[_pos] = inner_loop
+            pos = self.ends[child]+1
+        for _pos in xrange(pos, inner_end):
+            self.residue_nodes[_pos] = inner_loop
+
+        single_strands = self.single_strands[loop]
+        self.single_strands[inner_loop] = [single_strand for single_strand in single_strands if single_strand['location'][0] > inner_start and single_strand['location'][-1] < inner_end]
+        if self.single_strands[inner_loop]:
+            self.single_strands[loop] = [single_strand for single_strand in single_strands if not (single_strand['location'][0] > inner_start and single_strand['location'][-1] < inner_end)]
+        return helix_node
+
+    def add_single_strand(self, single_strand):
+        """
+        Attach a single-strand to the loop of its first residue.
+
+        Returns:
+        ------
+        the node of this loop, or None if the single-strand starts outside the molecule
+        """
+        start = single_strand['location'][0]
+        if start >= 1 and start <= self.length:
+            node = self.residue_nodes[start]
+            if self.kinds[node] == StructureTree.HELIX:
+                node = self.parents[node]
+            self.single_strands[node].append(single_strand)
+            return node
+
+    def add_tertiary_interaction(self, tertiary_interaction):
+        self.tertiary_interactions.append(tertiary_interaction)
+
+    def get_node(self, position):
+        """
+        Returns:
+        ------
+        the node of a residue: its helix if it is paired in a helix of the tree, its innermost loop otherwise
+        """
+        return self.residue_nodes[position]
+
+    def get_parent(self, node):
+        return self.parents[node]
+
+    def get_children(self, node):
+        return self.children[node]
+
+    def is_helix(self, node):
+        return self.kinds[node] == StructureTree.HELIX
+
+    def get_helix(self, node):
+        return self.helices[node]
+
+    def get_single_strands(self, node):
+        return self.single_strands[node]
+
+    def get_loop_degree(self, node):
+        """
+        Returns:
+        ------
+        the number of helices linked to a loop: 1 for an apical loop, 2 for an inner loop, 3 or more for a multiple-branch loop. The external loop (node 0) is not closed by a helix.
+        """
+        return len(self.children[node])+(1 if node else 0)
+
+    def get_loops(self, degree = None):
+        """
+        Parameters:
+        ---------
+        - degree (default: None): if not None, only the loops linked to this number of helices are returned
+
+        Returns:
+        ------
+        the loop nodes closed by a helix (the external loop is excluded)
+        """
+        return [node for node in xrange(1, len(self.kinds)) if self.kinds[node] == StructureTree.LOOP and (degree is None or self.get_loop_degree(node) == degree)]
+
+    def get_tertiary_links(self):
+        """
+        Returns:
+        ------
+        the tertiary interactions as a list of tuples (node of the first residue, node of the second residue, tertiary interaction)
+        """
+        return [(self.residue_nodes[tertiary_interaction['location'][0][0]], self.residue_nodes[tertiary_interaction['location'][-1][-1]], tertiary_interaction) for tertiary_interaction in self.tertiary_interactions]
+
+def _insert_sorted(items, keys, key, item):
+    #insert an item in a list sorted according to the keys stored in a parallel list (after the items with the same key)
+    i = bisect_right(keys, key)
+    keys.insert(i, key)
+    items.insert(i, item)
+
+def _remove_sorted(items, keys, key, item):
+    i = bisect_left(keys, key)
+    while items[i] is not item:
+        i += 1
+    del keys[i]
+    del items[i]
+
 class SecondaryStructure:
 
     def __init__(self, rna):
@@ -265,6 +779,14 @@ class SecondaryStructure:
         self.source = "N.A:N.A:N.A"
         self._id = str(ObjectId())
         self.__step = None
+        self._pair_table = array('i', [-1])*(len(rna)+1) #kept in sync with the helices (see add_helix())
+        self._helices_by_position = {} #the helix for each position of the 5' strands
+        self._tertiary_interactions_by_location = {} #the tertiary interactions for each couple (pos1, pos2)
+        self._structure_tree = None #built when needed, then kept in sync by add_helix(), add_single_strand() and add_tertiary_interaction() (see get_structure_tree())
+        self._single_strands_by_start = {} #the first single-strand starting at each position
+        self.__loop_junctions = None #computed by the first search for junctions (see find_junctions())
+        self.__dirty_loops = set() #the loops of the tree changed since the last search for junctions
+        self.__dirty_helices = set() #the helices of the tree whose stem-loop has to be searched again
 
     def _repr_html_(self):
         if self.__step:
@@ -272,55 +794,99 @@ class SecondaryStructure:
         else:
             return "No plot available"
 
+    def __index_layout(self):
+        #the helices, junctions and stem-loops are indexed once for the whole layout (see compute_plot())
+        helices_by_start = {}
+        helices_by_end = {}
+        for index, helix in enumerate(self.helices):
+            helices_by_start.setdefault(helix['location'][0][0], []).append(index)
+            helices_by_end.setdefault(helix['location'][-1][-1], []).append(index)
+        junctions_by_start = {}
+        inner_single_strands = []
+        for junction in self.junctions:
+            junction_location = sorted(junction['location'])
+            junctions_by_start.setdefault(junction_location[0][0], []).append((junction, junction_location))
+            if len(junction_location) >= 3:
+                inner_single_strands += [(single_strand_location[0], single_strand_location[1]) for single_strand_location in junction_location[1:-1]] #we only use the single-strands that are not on the left and right "sides"
+        inner_single_strands.sort()
+        stem_loop_indices = {}
+        for index, stem_loop in enumerate(self.stem_loops):
+            stem_loop_indices.setdefault((stem_loop['location'][0][0], stem_loop['location'][-1][-1]), index) #the first one, like list.index()
+        stem_loops = sorted((stem_loop['location'][0][0], stem_loop['location'][-1][-1], index) for index, stem_loop in enumerate(self.stem_loops))
+        max_ends = []
+        for start, end, index in stem_loops:
+            max_ends.append(max(end, max_ends[-1]) if max_ends else end)
+        self.__layout = {
+            'helices_by_start': helices_by_start,
+            'helices_by_end': helices_by_end,
+            'junctions_by_start': junctions_by_start,
+            'inner_single_strands': inner_single_strands,
+            'inner_single_strand_starts': [single_strand[0] for single_strand in inner_single_strands],
+            'stem_loop_indices': stem_loop_indices,
+            'stem_loops': stem_loops,
+            'stem_loop_starts': [stem_loop[0] for stem_loop in stem_loops],
+            'stem_loop_max_ends': max_ends
+        }
+
+    def __get_stem_loops_between(self, start, end):
+        #the stem-loops enclosed between two positions, in the order of self.stem_loops
+        stem_loops = self.__layout['stem_loops']
+        starts = self.__layout['stem_loop_starts']
+        indices = [stem_loops[i][2] for i in xrange(bisect_left(starts, start), bisect_right(starts, end)) if stem_loops[i][1] <= end]
+        return [self.stem_loops[index] for index in sorted(indices)]
+
+    def __get_stem_loops_around(self, start, end):
+        #the stem-loops enclosing two positions, in the order of self.stem_loops
+        stem_loops = self.__layout['stem_loops']
+        max_ends = self.__layout['stem_loop_max_ends']
+        indices = []
+        i = bisect_right(self.__layout['stem_loop_starts'], start)-1
+        while i >= 0 and max_ends[i] >= end: #no stem-loop before i ends after end
+            if stem_loops[i][1] >= end:
+                indices.append(stem_loops[i][2])
+            i -= 1
+        return [self.stem_loops[index] for index in sorted(indices)]
+
     def __walk(self, helix, x_coords, current_y, verbose = False):
+        #a generator yielding the next helices to walk with their y coordinate. The coordinates of the helix and of its junction are computed once all the next helices have been walked (see compute_plot()).
         from numpy import mean
         enclosed_stem_loops = []
         if verbose:
             print "walking helix", helix['location']
+        helices_by_start = self.__layout['helices_by_start']
+        next_y = current_y-(helix['location'][0][-1]-helix['location'][0][0])*self.__residue_occupancy-1.5*self.__junction_diameter
         #do we have a >= 3-way junction linked to this helix?
         next_junction = None
-        for junction in self.junctions:
-            junction_location = sorted(junction['location'])
-            if len(junction_location) >= 3 and helix['location'][0][-1] == junction_location[0][0] :
+        for junction, junction_location in self.__layout['junctions_by_start'].get(helix['location'][0][-1], []):
+            if len(junction_location) >= 3:
                 next_junction = junction
                 if verbose:
                     print "linked to >=3 junction",junction_location
-                #the occupancy will be the number of residues on the largest side
-                junction_occupancy = mean([junction_location[-1][-1]-junction_location[-1][0]+1, junction_location[0][-1]-junction_location[0][0]+1])-1
                 for i in range(len(junction_location)-1):
-                    for h in self.helices: #next helices in junction
-                        if h['location'][0][0] == junction_location[i][-1]:
-                            if verbose:
-                                print "next helix in junction is helix", h['location']
-                            self.__walk(h, x_coords, current_y-(helix['location'][0][-1]-helix['location'][0][0])*self.__residue_occupancy-1.5*self.__junction_diameter, verbose)
-                    for stem_loop in self.stem_loops: #this helix will lead to which stem loops?
-                        if stem_loop['location'][0][0] >= junction_location[i][-1] and stem_loop['location'][-1][-1] <= junction_location[i+1][0]:
-                            enclosed_stem_loops.append(stem_loop)
-            elif len(junction_location) == 2 and helix['location'][0][-1] == junction_location[0][0]:
+                    for index in helices_by_start.get(junction_location[i][-1], []): #next helices in junction
+                        if verbose:
+                            print "next helix in junction is helix", self.helices[index]['location']
+                        yield self.helices[index], next_y
+                    enclosed_stem_loops += self.__get_stem_loops_between(junction_location[i][-1], junction_location[i+1][0]) #this helix will lead to which stem loops?
+            elif len(junction_location) == 2:
                 next_junction = junction
                 if verbose:
                     print "linked to 2-way junction", junction_location
-                #the occupancy will be the number of residues on the largest side
-                junction_occupancy = mean([junction_location[-1][-1]-junction_location[-1][0]+1, junction_location[0][-1]-junction_location[0][0]+1])-1
-                for h in self.helices:
-                    if h['location'][0][0] == junction_location[0][-1]:
-                        if verbose:
-                            print "next helix in junction is helix", h['location']
-                        self.__walk(h, x_coords, current_y-(helix['location'][0][-1]-helix['location'][0][0])*self.__residue_occupancy-1.5*self.__junction_diameter, verbose)
-                for stem_loop in self.stem_loops: #this helix will lead to which stem loops?
-                    if stem_loop['location'][0][0] >= junction_location[0][0] and stem_loop['location'][-1][-1] <= junction_location[-1][-1]:
-                        enclosed_stem_loops.append(stem_loop)
-            elif len(junction_location) == 1 and helix['location'][0][-1] == junction_location[0][0]:
+                for index in helices_by_start.get(junction_location[0][-1], []):
+                    if verbose:
+                        print "next helix in junction is helix", self.helices[index]['location']
+                    yield self.helices[index], next_y
+                enclosed_stem_loops += self.__get_stem_loops_between(junction_location[0][0], junction_location[-1][-1]) #this helix will lead to which stem loops?
+            elif len(junction_location) == 1:
                 next_junction = junction
                 if verbose:
                     print "linked to apical loop", junction_location
         if not len(enclosed_stem_loops): #there was no junction linked to this helix, so it should be in a stem-loop
-            for stem_loop in self.stem_loops:
-                if helix['location'][0][0] >= stem_loop['location'][0][0] and helix['location'][-1][-1] <= stem_loop['location'][-1][-1]:
-                    enclosed_stem_loops.append(stem_loop)
+            enclosed_stem_loops = self.__get_stem_loops_around(helix['location'][0][0], helix['location'][-1][-1])
+        stem_loop_indices = self.__layout['stem_loop_indices']
         _x_coords = []
         for enclosed_stem_loop in enclosed_stem_loops:
-            _x_coords.append(x_coords[self.stem_loops.index(enclosed_stem_loop)])
+            _x_coords.append(x_coords[stem_loop_indices[(enclosed_stem_loop['location'][0][0], enclosed_stem_loop['location'][-1][-1])]])
         m = mean(_x_coords)
         helix['coords'] = [[m, current_y], [m, current_y-(helix['location'][0][-1]-helix['location'][0][0])*self.__residue_occupancy]]
         if verbose:
@@ -331,6 +897,16 @@ class SecondaryStructure:
             print "junction", next_junction['location']
             print "coords", next_junction['coords']
 
+    def __walk_from(self, helix, x_coords, current_y, verbose = False):
+        #the helices are walked depth-first with an explicit stack (no recursion limit for large molecules)
+        walks = [self.__walk(helix, x_coords, current_y, verbose)]
+        while walks:
+            try:
+                next_helix, next_y = walks[-1].next()
+                walks.append(self.__walk(next_helix, x_coords, next_y, verbose))
+            except StopIteration:
+                walks.pop()
+
     def compute_plot(self, step = 25, residue_occupancy = 5, junction_diameter = 15, verbose = False):
         if not self.stem_loops:
             self.find_stem_loops()
@@ -345,6 +921,7 @@ class SecondaryStructure:
         self.__junction_diameter = junction_diameter
         if not len(self.helices):
             raise Exception("Your secondary structure contains no helices!!")
+        self.__index_layout()
         x = 0
         if verbose:
             print "\nStem-loops placement\n"
@@ -353,17 +930,19 @@ class SecondaryStructure:
             print "stem loop", self.stem_loops[0]['location']
             print "x:", x
         x_coords.append(x)
+        inner_single_strands = self.__layout['inner_single_strands']
+        inner_single_strand_starts = self.__layout['inner_single_strand_starts']
         for i in range(0, len(self.stem_loops)-1):
             before = self.stem_loops[i]['location'][-1][-1]
             after = self.stem_loops[i+1]['location'][0][0]
             total_residues = 0
             total_junctions = 0
-            for junction in self.junctions:
-                if len(junction['location']) >=3:
-                    for single_strand_location in sorted(junction['location'])[1:-1]: #we only use the single-strands that are not on the left and right "sides"
-                        if before <= single_strand_location[0] and after >= single_strand_location[1]:
-                            total_residues += single_strand_location[1]-single_strand_location[0]+1
-                            total_junctions += 1
+            j = bisect_left(inner_single_strand_starts, before)
+            while j < len(inner_single_strands) and inner_single_strands[j][0] <= after:
+                if after >= inner_single_strands[j][1]:
+                    total_residues += inner_single_strands[j][1]-inner_single_strands[j][0]+1
+                    total_junctions += 1
+                j += 1
             if verbose:
                 print "total residues", total_residues
                 print "total junctions", total_junctions
@@ -381,58 +960,64 @@ class SecondaryStructure:
 
         if verbose:
             print "\nHelices placement\n"
+        helices_by_start = self.__layout['helices_by_start']
+        helices_by_end = self.__layout['helices_by_end']
         helix = self.helices[0]
         currentPos = helix['location'][-1][-1]
         current_y = 200
-        self.__walk(helix, x_coords, current_y, verbose)
+        self.__walk_from(helix, x_coords, current_y, verbose)
         while currentPos <= len(self.rna):
             currentPos +=1
             if verbose:
                 print "currentPos", currentPos
-            for helix in self.helices:
-                if currentPos == helix['location'][0][0]:
-                    current_y = 200
-                    self.__walk(helix, x_coords, current_y, verbose)
-                    currentPos = helix['location'][-1][-1]
-                    break
-
-        single_strands_not_in_junctions = self.single_strands[:]
+            if helices_by_start.has_key(currentPos):
+                helix = self.helices[helices_by_start[currentPos][0]]
+                current_y = 200
+                self.__walk_from(helix, x_coords, current_y, verbose)
+                currentPos = helix['location'][-1][-1]
+
+        #the single-strands in junctions are removed like with list.remove(), i.e. the first equal single-strand
+        single_strands_by_location = {}
+        for index, single_strand in enumerate(self.single_strands):
+            single_strands_by_location.setdefault((single_strand['location'][0], single_strand['location'][-1]), []).append(index)
+        in_junctions = set()
         for junction in self.junctions:
             for single_strand in junction['single_strands']:
-                single_strands_not_in_junctions.remove(single_strand)
+                for index in single_strands_by_location.get((single_strand['location'][0], single_strand['location'][-1]), []):
+                    if not index in in_junctions and self.single_strands[index] == single_strand:
+                        in_junctions.add(index)
+                        break
+                else:
+                    raise ValueError("The single-strand %s of the junction at %s is not a single-strand of this secondary structure (the junctions have to be searched again after changing the single-strands)"%(single_strand['location'], junction['location']))
 
-        single_strands_not_in_junctions = sorted(single_strands_not_in_junctions)
+        single_strands_not_in_junctions = sorted([single_strand for index, single_strand in enumerate(self.single_strands) if not index in in_junctions])
 
         for single_strand in single_strands_not_in_junctions:
             if verbose:
                 print "single strand not in a junction", single_strand['location']
             if single_strand['location'][0] == 1:
-                for helix in self.helices:
-                    if helix['location'][0][0] == single_strand['location'][-1]+1:
-                        l = helix['location'][0][0]*self.__residue_occupancy
-                        if l > 2*self.__junction_diameter:
-                            l = 2*self.__junction_diameter
-                        single_strand['coords'] = [[helix['coords'][0][0]-l, helix['coords'][0][1]], [helix['coords'][0][0], helix['coords'][0][1]]]
-                        break
+                if helices_by_start.has_key(single_strand['location'][-1]+1):
+                    helix = self.helices[helices_by_start[single_strand['location'][-1]+1][0]]
+                    l = helix['location'][0][0]*self.__residue_occupancy
+                    if l > 2*self.__junction_diameter:
+                        l = 2*self.__junction_diameter
+                    single_strand['coords'] = [[helix['coords'][0][0]-l, helix['coords'][0][1]], [helix['coords'][0][0], helix['coords'][0][1]]]
             elif single_strand['location'][-1] == len(self.rna):
-                for helix in self.helices:
-                    if helix['location'][-1][-1] == single_strand['location'][0]-1:
-                        l =  (len(self.rna)-helix['location'][-1][-1]+1)*self.__residue_occupancy
-                        if l > 2*self.__junction_diameter:
-                            l = 2*self.__junction_diameter
-                        single_strand['coords'] = [[helix['coords'][0][0], helix['coords'][0][1]], [helix['coords'][0][0]+l, helix['coords'][0][1]]]
-                        break
+                if helices_by_end.has_key(single_strand['location'][0]-1):
+                    helix = self.helices[helices_by_end[single_strand['location'][0]-1][0]]
+                    l =  (len(self.rna)-helix['location'][-1][-1]+1)*self.__residue_occupancy
+                    if l > 2*self.__junction_diameter:
+                        l = 2*self.__junction_diameter
+                    single_strand['coords'] = [[helix['coords'][0][0], helix['coords'][0][1]], [helix['coords'][0][0]+l, helix['coords'][0][1]]]
             else:
-                first_helix = None
-                second_helix = None
-                for helix in self.helices:
-                    if helix['location'][-1][-1] == single_strand['location'][0]-1:
-                        first_helix =  helix
-                    if helix['location'][0][0] == single_strand['location'][-1]+1:
-                        second_helix = helix
-                    if first_helix and second_helix:
-                        single_strand['coords'] = [[first_helix['coords'][0][0], first_helix['coords'][0][1]], [second_helix['coords'][0][0], second_helix['coords'][0][1]]]
-                        break
+                first_helices = helices_by_end.get(single_strand['location'][0]-1)
+                second_helices = helices_by_start.get(single_strand['location'][-1]+1)
+                if first_helices and second_helices:
+                    #the helices are those found when the helices are scanned until both sides are found
+                    last_index = max(first_helices[0], second_helices[0])
+                    first_helix = self.helices[first_helices[bisect_right(first_helices, last_index)-1]]
+                    second_helix = self.helices[second_helices[bisect_right(second_helices, last_index)-1]]
+                    single_strand['coords'] = [[first_helix['coords'][0][0], first_helix['coords'][0][1]], [second_helix['coords'][0][0], second_helix['coords'][0][1]]]
 
     def draw_as_d3(self, stroke_width = 2, verbose = False):
         from pyrna import utils
@@ -454,6 +1039,7 @@ class SecondaryStructure:
             all_y.append(single_strand['coords'][0][1])
             all_x.append(single_strand['coords'][1][0])
             all_y.append(single_strand['coords'][1][1])
+        helices_by_start = {}
         for helix in self.helices:
             if helix.has_key('quantitative_value'):
                 quantitative_values.append(helix['quantitative_value'])
@@ -461,6 +1047,7 @@ class SecondaryStructure:
             all_y.append(helix['coords'][0][1])
             all_x.append(helix['coords'][1][0])
             all_y.append(helix['coords'][1][1])
+            helices_by_start.setdefault(helix['location'][0][0], []).append(helix)
         for junction in self.junctions:
             if junction.has_key('quantitative_value'):
                 quantitative_values.append(junction['quantitative_value'])
@@ -480,38 +1067,40 @@ class SecondaryStructure:
         all_x = [x-min_x+self.__junction_diameter for x in all_x]
         all_y = [y-min_y+self.__junction_diameter for y in all_y]
 
+        #the D3 description is written in a list of strings joined once at the end
+        d3_description = []
+
         colors_d3 = """"""
         if quantitative_values:
             colors_d3 = """var colors = d3.scale.linear().domain(["""+str(min(quantitative_values))+""","""+str(mean(quantitative_values))+""","""+str(max(quantitative_values))+"""]).range(["#4daf4a",  "#377eb8", "#e41a1c"]);"""
 
-        helices_d3 = """"""
+        helices_d3 = []
         helix_color = '"steelblue"'
         if helix.has_key('quantitative_value'):
             helix_color = "colors("+str(helix['quantitative_value'])+")"
         for helix in self.helices:
-            helices_d3 += """svg.append("line")
+            helices_d3.append("""svg.append("line")
                             .style("stroke", """+helix_color+""")
                             .style("stroke-width", """+str(stroke_width)+""")
                             .attr("x1", """+str(helix['coords'][0][0])+""")
                             .attr("y1", """+str(helix['coords'][0][1])+""")
                             .attr("x2", """+str(helix['coords'][1][0])+""")
                             .attr("y2", """+str(helix['coords'][1][1])+""");
-                    """
+                    """)
 
-        junctions_d3 = """"""
+        junctions_d3 = []
         for junction in self.junctions:
             if len(junction['location']) >= 3:
                 junction_location = sorted(junction['location'])
                 for i in range(len(junction_location)-1):
-                    for h in self.helices: #next helices in junction
-                        if h['location'][0][0] == junction_location[i][-1]:
-                            if h['coords'][0][1] != junction['coords'][0][1]: #to avoid to redraw a vertical line
-                                new_points = utils.get_points(h['coords'][0][0], h['coords'][0][1], junction['coords'][0][0], junction['coords'][0][1], distance = (self.__junction_diameter+10)/2)
-                                if len(new_points) == 2:
-                                    helix_color = '"steelblue"'
-                                    if h.has_key('quantitative_value'):
-                                        helix_color = "colors("+str(h['quantitative_value'])+")"
-                                    junctions_d3 += """svg.append("line")
+                    for h in helices_by_start.get(junction_location[i][-1], []): #next helices in junction
+                        if h['coords'][0][1] != junction['coords'][0][1]: #to avoid to redraw a vertical line
+                            new_points = utils.get_points(h['coords'][0][0], h['coords'][0][1], junction['coords'][0][0], junction['coords'][0][1], distance = (self.__junction_diameter+10)/2)
+                            if len(new_points) == 2:
+                                helix_color = '"steelblue"'
+                                if h.has_key('quantitative_value'):
+                                    helix_color = "colors("+str(h['quantitative_value'])+")"
+                                junctions_d3.append("""svg.append("line")
                                         .style("stroke-linecap", "round")
                                         .style("stroke", """+helix_color+""")
                                         .style("stroke-width", """+str(stroke_width)+""")
@@ -519,40 +1108,36 @@ class SecondaryStructure:
                                         .attr("y1", """+str(h['coords'][0][1])+""")
                                         .attr("x2", """+str(new_points[1][0])+""")
                                         .attr("y2", """+str(new_points[1][1])+""");
-                                    """
+                                    """)
 
             junction_color = '"steelblue"'
             if junction.has_key('quantitative_value'):
                 junction_color = "colors("+str(junction['quantitative_value'])+")"
 
-            junctions_d3 += """svg.append("circle")
+            junctions_d3.append("""svg.append("circle")
                             .style("fill", """+junction_color+""")
                             .attr("cx", """+str(junction['coords'][0][0])+""")
                             .attr("cy", """+str(junction['coords'][0][1])+""")
                             .attr("r", """+str(self.__junction_diameter/2)+""");
-                    """
+                    """)
 
-            junction_color = '"steelblue"'
-            if junction.has_key('quantitative_value'):
-                junction_color = "colors("+str(junction['quantitative_value'])+")"
-
-            junctions_d3 += """svg.append("circle")
+            junctions_d3.append("""svg.append("circle")
                     .style("fill", "none")
                     .style("stroke", """+junction_color+""")
                     .style("stroke-width", """+str(stroke_width)+""")
                     .attr("cx", """+str(junction['coords'][0][0])+""")
                     .attr("cy", """+str(junction['coords'][0][1])+""")
                     .attr("r", """+str((1.5*self.__junction_diameter)/2)+""");
-            """
+            """)
 
-        single_strands_d3 = """"""
+        single_strands_d3 = []
         for single_strand in single_strands_not_in_junctions:
 
             single_strand_color = '"steelblue"'
             if single_strand.has_key('quantitative_value'):
                 single_strand_color = "colors("+str(single_strand['quantitative_value'])+")"
 
-            single_strands_d3 += """svg.append("line")
+            single_strands_d3.append("""svg.append("line")
                                     .style("stroke-linecap", "round")
                                     .style("stroke", """+single_strand_color+""")
                                     .style("stroke-width", """+str(stroke_width)+""")
@@ -560,22 +1145,22 @@ class SecondaryStructure:
                                     .attr("y1", """+str(single_strand['coords'][0][1])+""")
                                     .attr("x2", """+str(single_strand['coords'][1][0])+""")
                                     .attr("y2", """+str(single_strand['coords'][1][1])+""");
-                                """
+                                """)
 
         #we end with the helices directly linked at the basis of the drawing
-        directly_linked_helices_d3 = """"""
+        directly_linked_helices_d3 = []
         previous_helix = self.helices[0]
         currentPos = previous_helix['location'][-1][-1]
         while currentPos <= len(self.rna):
             currentPos +=1
             if verbose:
                 print "currentPos", currentPos
-            for helix in self.helices:
-                if currentPos == helix['location'][0][0]:
-                    if previous_helix['location'][-1][-1] +1 == helix['location'][0][0]:
-                        if verbose:
-                            print "directly linked helices", previous_helix['location'] , helix['location']
-                        directly_linked_helices_d3 += """svg.append("line")
+            if helices_by_start.has_key(currentPos):
+                helix = helices_by_start[currentPos][0]
+                if previous_helix['location'][-1][-1] +1 == helix['location'][0][0]:
+                    if verbose:
+                        print "directly linked helices", previous_helix['location'] , helix['location']
+                    directly_linked_helices_d3.append("""svg.append("line")
                                         .style("stroke-linecap", "round")
                                         .style("stroke", "grey")
                                         .style("stroke-width", """+str(stroke_width)+""")
@@ -583,12 +1168,11 @@ class SecondaryStructure:
                                         .attr("y1", """+str(previous_helix['coords'][0][1])+""")
                                         .attr("x2", """+str(helix['coords'][0][0])+""")
                                         .attr("y2", """+str(helix['coords'][0][1])+""");
-                                    """
-                    currentPos = helix['location'][-1][-1]
-                    previous_helix = helix
-                    break
+                                    """)
+                currentPos = helix['location'][-1][-1]
+                previous_helix = helix
 
-        d3_description = """
+        d3_description.append("""
 
             <div id="viz"></div>
             <script type="text/javascript">
@@ -597,246 +1181,483 @@ class SecondaryStructure:
                 .append("svg")
                 .attr("width", """+str(max(all_x)+self.__junction_diameter)+""")
                 .attr("height", """+str(max(all_y)+self.__junction_diameter)+""");
-                """+colors_d3+"""
-                """+junctions_d3+"""
-                """+helices_d3+"""
-                """+single_strands_d3+"""
-                """+directly_linked_helices_d3+"""
-                </script>"""
-
-        return d3_description
+                """)
+        d3_description.append(colors_d3)
+        d3_description.append("""
+                """)
+        d3_description += junctions_d3
+        d3_description.append("""
+                """)
+        d3_description += helices_d3
+        d3_description.append("""
+                """)
+        d3_description += single_strands_d3
+        d3_description.append("""
+                """)
+        d3_description += directly_linked_helices_d3
+        d3_description.append("""
+                </script>""")
+
+        return ''.join(d3_description)
 
     def get_junctions(self):
         return DataFrame(self.junctions)
 
+    def get_structure_tree(self):
+        """
+        Returns:
+        ------
+        the StructureTree of the helices and loops. It is built at the first call, then updated by each new helix, single-strand or tertiary interaction.
+        """
+        if self._structure_tree is None:
+            tree = StructureTree(len(self.rna))
+            #the inner helices are inserted first. This way, an helix only visits the unpaired residues of its own loop.
+            for helix in sorted(self.helices, key=lambda helix: helix['location'][0][0], reverse = True):
+                tree.add_helix(helix)
+            for single_strand in self.single_strands:
+                tree.add_single_strand(single_strand)
+            for tertiary_interaction in self.tertiary_interactions:
+                tree.add_tertiary_interaction(tertiary_interaction)
+            self._structure_tree = tree
+        return self._structure_tree
+
+    def fingerprint(self):
+        """
+        Returns:
+        ------
+        a canonical digest (a String) of the sequence and of all the base pairs (those of the helices and the tertiary interactions). Two secondary structures with the same sequence and the same base pairs have the same fingerprint, whatever the order of construction. It is the same as the one computed by fingerprint_base_pairs() for the base pairs used to build this secondary structure.
+        """
+        pair_table = self._pair_table
+        pairs = [(pos, pair_table[pos]) for pos in xrange(1, len(pair_table)) if pair_table[pos] > pos]
+        pairs += [(tertiary_interaction['location'][0][0], tertiary_interaction['location'][-1][-1]) for tertiary_interaction in self.tertiary_interactions]
+        return make_fingerprint(self.rna.sequence, pairs)
+
+    def pair_table(self):
+        """
+        Returns:
+        ------
+        the pair table of the helices as an array of integers of size len(rna)+1. The value at the index i is the position paired with the residue i, or -1 if this residue is not paired in a helix. The index 0 is not used.
+        """
+        return self._pair_table
+
     def get_paired_residue(self, pos):
-        for helix in self.helices:
-            if pos >= helix['location'][0][0] and pos <= helix['location'][0][0] + helix['length']-1:
-                return helix['location'][-1][-1] - (pos-helix['location'][0][0])
-            elif pos <= helix['location'][-1][-1] and pos >= helix['location'][-1][-1] - helix['length']+1:
-                return helix['location'][0][0]+ helix['location'][-1][-1] - pos
+        if pos >= 1 and pos < len(self._pair_table):
+            return self._pair_table[pos]
         return -1
 
+    def __index_helix(self, helix):
+        start = helix['location'][0][0]
+        end = helix['location'][-1][-1]
+        if end >= len(self._pair_table):
+            self._pair_table.extend([-1]*(end-len(self._pair_table)+1))
+        for i in xrange(0, helix['length']):
+            self._pair_table[start+i] = end-i
+            self._pair_table[end-i] = start+i
+            self._helices_by_position[start+i] = helix
+
     def find_single_strands(self):
         full_location = Location(start = 1, end = len(self.rna))
-        for helix in self.helices:
-            full_location =  full_location.remove_location(Location(start = helix['location'][0][0], end = helix['location'][0][-1]))
-            full_location =  full_location.remove_location(Location(start = helix['location'][-1][0], end = helix['location'][-1][-1]))
-        single_positions = full_location.get_single_positions()
-        single_positions.sort()
+        helices_location = Location(nested_lists = sum([helix['location'] for helix in self.helices], []))
+        full_location = full_location.remove_location(helices_location)
 
-        start = None
-        length = 0
+        #each block left is a single-strand
         single_strand_count = 1
-        for index, current_pos in enumerate(single_positions):
-            if index == 0 or current_pos == single_positions[index-1]+1:
-                length += 1
-                if index == 0:
-                    start = current_pos
-            else:
-                self.add_single_strand("SS_%i"%single_strand_count, start, length)
-                single_strand_count +=1
-                length = 1
-                start = current_pos
-        #the last
-        self.add_single_strand("SS_%i"%single_strand_count, start, length)
+        for block in full_location.blocks:
+            self.add_single_strand("SS_%i"%single_strand_count, block.start, block.end-block.start+1)
+            single_strand_count +=1
 
-    def find_junctions(self):
-        self.junctions = []
-        for single_strand in self.single_strands:
-            if single_strand['location'][0] == 1 or single_strand['location'][-1] == len(self.rna) or len(filter(lambda junction: single_strand in junction['single_strands'], self.junctions)):
-                continue
-            strands = [single_strand]
-            descr = self.rna[single_strand['location'][0]-1:single_strand['location'][-1]]+" "
-            current_pos =  self.get_paired_residue(single_strand['location'][-1]+1)+1
-            location = [[single_strand['location'][0]-1, single_strand['location'][-1]+1]]
-            next_single_strand = None
-
-            while current_pos >= 1 and current_pos <= len(self.rna):
-                next_single_strand = filter(lambda single_strand : single_strand['location'][0] == current_pos, self.single_strands)
-                if next_single_strand and next_single_strand[0] == single_strand:
-                    break
-                elif next_single_strand:
-                    strands.append(next_single_strand[0])
-                    location.append([next_single_strand[0]['location'][0]-1, next_single_strand[0]['location'][-1]+1])
-                    descr += self.rna[next_single_strand[0]['location'][0]-1:next_single_strand[0]['location'][-1]]+" "
-                    current_pos = self.get_paired_residue(next_single_strand[0]['location'][-1]+1)+1
-                    continue
-                next_helix = filter(lambda helix: current_pos == helix['location'][0][0] or current_pos == helix['location'][-1][-1]-helix['length']+1, self.helices)
-                if next_helix:
-                    descr += '- '
-                    location.append([current_pos-1, current_pos])
-                    current_pos = self.get_paired_residue(current_pos)+1
-
-            if next_single_strand and next_single_strand[0] == single_strand:
-                self.junctions.append({
-                    'single_strands': strands,
-                    'description': descr.strip(),
-                    'location': location
-                })
+    def __get_loop_gaps(self, tree, loop):
+        """
+        Returns:
+        ------
+        the gaps between the helices linked to a loop of the structure tree, from the 5'-end of the loop. Each gap is described by the positions of the paired residues around it.
+        """
+        children = tree.get_children(loop)
+        return [[gap_start, gap_end] for gap_start, gap_end in zip([tree.starts[loop]]+[tree.ends[child] for child in children], [tree.starts[child] for child in children]+[tree.ends[loop]])]
 
-        #now we search for junctions with only directly linked helices
-        for helix in self.helices:
-            if helix['location'][0][0] == 1 or helix['location'][-1][-1] == len(self.rna) or len(filter(lambda junction: helix['location'][0][0] in sum(junction['location'],[]) or helix['location'][-1][-1] in sum(junction['location'],[]), self.junctions)):
-                continue
-            descr = ""
-            location = []
-            next_helix = None
-            current_pos = helix['location'][-1][-1]+1
-
-            while current_pos >= 1 and current_pos <= len(self.rna):
-                next_helix = filter(lambda helix: current_pos == helix['location'][0][0] or current_pos == helix['location'][1][0], self.helices)
-                if next_helix and next_helix[0] == helix:
-                    descr += '- '
-                    location.append([current_pos-1, current_pos])
-                    break
-                elif next_helix:
-                    descr += '- '
-                    location.append([current_pos-1, current_pos])
-                    current_pos = self.get_paired_residue(current_pos)+1
-                else:
+    def __describe_loop(self, tree, loop, memo):
+        """
+        Returns:
+        ------
+        a tuple containing the gaps of a loop (see __get_loop_gaps()), their single-strands (None for an empty gap) and the kind of the loop: 1 if its non-empty gaps are all single-strands (one gap at least being non-empty), 0 if it has only directly linked helices, None otherwise
+        """
+        descriptions, finders = memo
+        if not descriptions.has_key(loop):
+            gaps = self.__get_loop_gaps(tree, loop)
+            strands = [self._single_strands_by_start.get(gap_start+1) if gap_end > gap_start+1 else None for gap_start, gap_end in gaps]
+            if any(gap_end > gap_start+1 and (not strand or strand['location'][-1] != gap_end-1) for strand, (gap_start, gap_end) in zip(strands, gaps)):
+                kind = None #a gap is not a single-strand
+            else:
+                kind = 1 if any(strands) else 0
+            descriptions[loop] = (gaps, strands, kind)
+        return descriptions[loop]
+
+    def __is_skipped(self, tree, node, memo):
+        #a helix having an end in a junction found before it, when the junctions with only directly linked helices are searched from the helices sorted according to their start
+        helix = tree.get_helix(node)
+        outer_loop, inner_loop = tree.get_parent(node), tree.get_children(node)[0]
+        if helix['location'][0][0] == 1 or helix['location'][-1][-1] == len(self.rna):
+            return True
+        if helix['length'] == 1 and self.__describe_loop(tree, inner_loop, memo)[2] == 1:
+            return True
+        if not outer_loop:
+            return False
+        kind = self.__describe_loop(tree, outer_loop, memo)[2]
+        if kind == 1:
+            return True
+        if kind == 0:
+            finder = self.__find_direct_junction(tree, outer_loop, memo)
+            return finder is not None and finder[0] != node and (finder[1] == 0 or tree.starts[finder[0]] < tree.starts[node])
+        return False
+
+    def __find_direct_junction(self, tree, loop, memo):
+        """
+        Returns:
+        ------
+        for a loop with only directly linked helices, the helix from which its junction is found (its closing helix or the first helix after which the search is not skipped) and the first gap of the junction. None if the junction is never found.
+        """
+        descriptions, finders = memo
+        if not finders.has_key(loop):
+            finder = None
+            closing_helix = tree.get_parent(loop)
+            if not self.__is_skipped(tree, closing_helix, memo):
+                finder = (closing_helix, 0)
+            else:
+                for i, child in enumerate(tree.get_children(loop)):
+                    if not (tree.get_helix(child)['length'] == 1 and self.__describe_loop(tree, tree.get_children(child)[0], memo)[2] == 1):
+                        finder = (child, i+1)
+                        break
+            finders[loop] = finder
+        return finders[loop]
+
+    def __make_junction(self, tree, loop, memo):
+        #the junction of a loop closed by a helix (None if this loop is not a junction)
+        gaps, strands, kind = self.__describe_loop(tree, loop, memo)
+        if kind == 1: #the junction starts with its single-strand listed first in self.single_strands
+            gap_indices = dict((id(strand), i) for i, strand in enumerate(strands) if strand)
+            first_gap = min(gap_indices.values())
+            for single_strand in tree.get_single_strands(loop):
+                if gap_indices.has_key(id(single_strand)):
+                    first_gap = gap_indices[id(single_strand)]
                     break
+        elif kind == 0:
+            finder = self.__find_direct_junction(tree, loop, memo)
+            if finder is None:
+                return None
+            first_gap = finder[1]
+        else:
+            return None
+        gaps, strands = gaps[first_gap:]+gaps[:first_gap], strands[first_gap:]+strands[:first_gap]
+        return {
+            'single_strands': [strand for strand in strands if strand],
+            'description': ' '.join(map(str, [self.rna[strand['location'][0]-1:strand['location'][-1]] if strand else '-' for strand in strands])).strip(),
+            'location': gaps
+        }
+
+    def __update_junctions(self):
+        """
+        Update the junctions of the loops changed since the last update. The first update computes the junctions of all the loops.
+        """
+        tree = self.get_structure_tree()
+        memo = ({}, {})
+        if self.__loop_junctions is None:
+            self.__loop_junctions = {} #the (key, junction) of each loop of the tree being a junction
+            self.__junctions, self.__junction_keys = [], []
+            self.__helix_stem_loops = {} #the (key, stem-loop) of each helix of the tree starting a stem-loop
+            self.__stem_loops, self.__stem_loop_keys = [], []
+            self.__dirty_loops = set(tree.get_loops())
+            self.__dirty_helices = set(node for node in xrange(len(tree)) if tree.is_helix(node))
+            loops = self.__dirty_loops
+            ascending = False
+        else:
+            #the loops whose junction depends on the changed loops: the loop where their closing helix branches and, through the loops with only directly linked helices, the loops below them
+            loops = set(self.__dirty_loops)
+            for loop in self.__dirty_loops:
+                if loop:
+                    outer_loop = tree.get_parent(tree.get_parent(loop))
+                    if outer_loop and self.__describe_loop(tree, outer_loop, memo)[2] == 0:
+                        loops.add(outer_loop)
+            stack = list(loops)
+            while stack:
+                for child in tree.get_children(stack.pop()):
+                    inner_loop = tree.get_children(child)[0]
+                    if not inner_loop in loops and self.__describe_loop(tree, inner_loop, memo)[2] == 0:
+                        loops.add(inner_loop)
+                        stack.append(inner_loop)
+            ascending = True
+        self.__dirty_loops = set()
+
+        for loop in loops:
+            if not loop: #the external loop is not a junction
+                continue
+            if self.__loop_junctions.has_key(loop):
+                key, junction = self.__loop_junctions.pop(loop)
+                _remove_sorted(self.__junctions, self.__junction_keys, key, junction)
+            junction = self.__make_junction(tree, loop, memo)
+            if junction:
+                key = junction['location'][0][0]
+                self.__loop_junctions[loop] = (key, junction)
+                _insert_sorted(self.__junctions, self.__junction_keys, key, junction)
+
+        if ascending:
+            #the stem-loops depending on the changed junctions: those starting with the helices linked to these junctions and those enclosing them, up to a junction of degree >= 3
+            ascended = set()
+            for loop in loops:
+                self.__dirty_helices.update(tree.get_children(loop))
+                while loop and not loop in ascended:
+                    ascended.add(loop)
+                    closing_helix = tree.get_parent(loop)
+                    self.__dirty_helices.add(closing_helix)
+                    loop = tree.get_parent(closing_helix)
+                    if self.__loop_junctions.has_key(loop) and tree.get_loop_degree(loop) >= 3:
+                        break
 
-            if next_helix and next_helix[0] == helix:
-                self.junctions.append({
-                    'single_strands': [],
-                    'description': descr.strip(),
-                    'location': location
-                })
+    def __make_stem_loop(self, tree, node):
+        #the stem-loop starting with a helix (None if no stem-loop starts with it)
+        helix = tree.get_helix(node)
+        #if the helix is linked to a junction of degree >= 3 or not linked to any junction, the stem-loop can start with it.
+        if self.__loop_junctions.has_key(tree.get_parent(node)) and tree.get_loop_degree(tree.get_parent(node)) < 3:
+            return None
+        #the junctions enclosed are found by walking down the tree. A helix of a single base pair doesn't enclose its own loop.
+        apical_loops = []
+        inner_loops = []
+        helices = []
+        excluded_loop = tree.get_children(node)[0] if helix['length'] == 1 else None
+        nodes = [node]
+        while nodes:
+            _node = nodes.pop()
+            if tree.is_helix(_node):
+                helices.append(tree.get_helix(_node))
+            elif _node != excluded_loop and self.__loop_junctions.has_key(_node):
+                degree = tree.get_loop_degree(_node)
+                if degree == 1:
+                    apical_loops.append(self.__loop_junctions[_node][1])
+                    if len(apical_loops) > 1:
+                        return None
+                elif degree == 2:
+                    inner_loops.append(self.__loop_junctions[_node][1])
+                else: #no need to go further, this helix doesn't start a stem-loop
+                    return None
+            nodes.extend(tree.get_children(_node))
+        if len(apical_loops) != 1:
+            return None
+        return {
+            'location': [[helix['location'][0][0], helix['location'][-1][-1]]],
+            'apical_loop': apical_loops[0],
+            'inner_loops': sorted(inner_loops, key=lambda junction: junction['location'][0][0]),
+            'helices': sorted(helices, key=lambda helix: helix['location'][0][0])
+        }
 
-            #the other side
-            descr = ""
-            location = []
-            next_helix = None
-            current_pos = helix['location'][0][1]+1
-
-            while current_pos >= 1 and current_pos <= len(self.rna):
-                next_helix = filter(lambda helix: current_pos == helix['location'][0][0] or current_pos == helix['location'][1][0], self.helices)
-                if next_helix and next_helix[0] == helix:
-                    descr += '- '
-                    location.append([current_pos-1, current_pos])
-                    break
-                elif next_helix:
-                    descr += '- '
-                    location.append([current_pos-1, current_pos])
-                    current_pos = self.get_paired_residue(current_pos)+1
-                else:
-                    break
+    def find_junctions(self):
+        """
+        Search for all the junctions (apical loops, inner loops and multiple-branch loops). The junctions are the loops of the structure tree (see get_structure_tree()) whose gaps between helices are all single-strands or empty.
 
-            if next_helix and next_helix[0] == helix:
-                self.junctions.append({
-                    'single_strands': [],
-                    'description': descr.strip(),
-                    'location': location
-                })
+        The location of a junction lists its gaps, from the same gap as if the junction was found by walking around it: its single-strand listed first in self.single_strands, or for the junctions without single-strand, from a side of the first helix (in self.helices) having no end in a junction already found.
 
-        self.junctions = sorted(self.junctions, key=lambda x: x['location'][0][0])
+        The junctions are kept for each loop of the tree. Once computed, only the loops changed by the new helices and single-strands (and the loops depending on them) are searched again.
+        """
+        self.__update_junctions()
+        self.junctions = list(self.__junctions)
 
     def find_stem_loops(self):
-        if not self.junctions:
+        """
+        Search for all the stem-loops. A stem loop is a set of contigous helices linked with inner loops and with an apical loop at one end.
+
+        The stem-loops are kept for each helix of the structure tree starting them. Once computed, only the stem-loops depending on the junctions changed since the last search are searched again (see find_junctions()).
+        """
+        if not self.junctions or self.__loop_junctions is None or self.__dirty_loops:
             self.find_junctions()
-        #we search for all the stem-loops. A stem loop is a set of contigous helices linked with inner loops and with an apical loop at one end.
-        self.stem_loops = []
-        ranges = []
-        for helix in self.helices:
-            #print "helix",helix['location']
-            start = helix['location'][0][0]
-            end = helix['location'][-1][-1]
-            #if the helix ends are linked to a junction of degree >= 3 or not linked to any junction, this is a range to keep.
-            linked_to_a_junction = False
-            for junction in self.junctions:
-                for i in range(0, len(junction['location'])-1):
-                    if start == junction['location'][i][-1] and end == junction['location'][i+1][0]:
-                        if len(junction['location']) >= 3:
-                            ranges.append([start, end])
-                        linked_to_a_junction = True
-                if start == junction['location'][-1][-1] and end == junction['location'][0][0]: #we test the last two ends of the location (first and last values of the matrix)
-                    if len(junction['location']) >= 3:
-                        ranges.append([start, end])
-                    linked_to_a_junction = True
-            if not linked_to_a_junction:
-                ranges.append([start, end])
-        #print ranges
-
-        for _range in ranges:
-            start = _range[0]
-            end = _range[1]
-            #print '\n\n', "search between: ", start,"-", end, '\n\n'
-            enclosed_apical_loops = []
-            enclosed_junctions = []
-            enclosed_inner_loops = []
-            enclosed_helices = []
-            for _junction in self.junctions:
-                _start = min(_junction['location'])[0] #the lowest end
-                _end = max(_junction['location'])[-1] #the highest end
-                if _start > start and _end < end:
-                    if len(_junction['location']) == 1:
-                        enclosed_apical_loops.append(_junction)
-                        #print "found apical loop at ", _start, _end
-                    elif len(_junction['location']) == 2:
-                        enclosed_inner_loops.append(_junction)
-                        #print "found inner loop at ", _start, _end
-                        #print _junction['location']
-                    elif len(_junction['location']) >= 3:
-                        enclosed_junctions.append(_junction)
-                        #print "found enclosed junction at ", _start, _end
-                        #print _junction['location']
-            for helix in self.helices:
-                _start = helix['location'][0][0]
-                _end = helix['location'][-1][-1]
-                if _start >= start and _end <= end:
-                    enclosed_helices.append(helix)
-            #print "enclosed apical loops", len(enclosed_apical_loops)
-            #print "enclosed junctions", len(enclosed_junctions)
-            if len(enclosed_apical_loops) == 1 and not enclosed_junctions:
-                stem_loop = {'location': [[start, end]]}
-                stem_loop['apical_loop'] = enclosed_apical_loops[0]
-                stem_loop['inner_loops'] = enclosed_inner_loops
-                stem_loop['helices'] = enclosed_helices
-                self.stem_loops.append(stem_loop)
-
-        self.stem_loops = sorted(self.stem_loops, key=lambda x: x['apical_loop']['location'][0])
+        tree = self.get_structure_tree()
+        for node in self.__dirty_helices:
+            if self.__helix_stem_loops.has_key(node):
+                key, stem_loop = self.__helix_stem_loops.pop(node)
+                _remove_sorted(self.__stem_loops, self.__stem_loop_keys, key, stem_loop)
+            stem_loop = self.__make_stem_loop(tree, node)
+            if stem_loop:
+                key = (stem_loop['apical_loop']['location'][0], tree.starts[node])
+                self.__helix_stem_loops[node] = (key, stem_loop)
+                _insert_sorted(self.__stem_loops, self.__stem_loop_keys, key, stem_loop)
+        self.__dirty_helices = set()
+        self.stem_loops = list(self.__stem_loops)
+
+    def __index_modules(self, modules):
+        """
+        Index the blocks of the locations of modules (stem-loops, junctions) in elementary segments: the segment k covers the positions from boundaries[k] to boundaries[k+1]-1 and lists the indices of the modules containing them.
+
+        Returns:
+        ------
+        a tuple containing the boundaries, the modules of each segment (sorted according to their index) and the (start, end) of each module (the start of its first block and the end of its last block)
+        """
+        boundaries = set()
+        blocks = []
+        extents = []
+        for index, module in enumerate(modules):
+            _blocks = [(min(nested_list), max(nested_list)) for nested_list in module['location']]
+            for start, end in _blocks:
+                blocks.append((start, end, index))
+                boundaries.update([start, end+1])
+            extents.append((_blocks[0][0], _blocks[-1][1]) if _blocks else None) #as listed, the first block of a junction is not always the lowest one
+        boundaries = sorted(boundaries)
+        segments = [[] for boundary in boundaries]
+        for start, end, index in blocks: #the blocks are listed according to the index of their module
+            for k in xrange(bisect_left(boundaries, start), bisect_left(boundaries, end+1)):
+                if not segments[k] or segments[k][-1] != index:
+                    segments[k].append(index)
+        return boundaries, segments, extents
+
+    def __get_modules_at(self, module_index, position):
+        boundaries, segments, extents = module_index
+        k = bisect_right(boundaries, position)-1
+        return segments[k] if k >= 0 else []
 
     def find_connected_modules(self):
+        """
+        Search for the couples of modules (stem-loop/stem-loop or stem-loop/junction of degree >= 3) linked by a tertiary interaction. The stem-loops and junctions containing each end of an interaction are found by a binary search in an index of their locations.
+        """
         self.connected_modules = []
         if not self.junctions:
             self.find_junctions()
         if not self.stem_loops:
             self.find_stem_loops()
 
-        tertiary_interactions = self.tertiary_interactions
+        junctions = [junction for junction in self.junctions if len(junction['location']) >= 3]
+        stem_loop_index = self.__index_modules(self.stem_loops)
+        junction_index = self.__index_modules(junctions)
+        stem_loop_extents = stem_loop_index[2]
+        junction_extents = junction_index[2]
 
         for tertiary_interaction in self.tertiary_interactions:
             start = tertiary_interaction['location'][0][0]
             end = tertiary_interaction['location'][-1][-1]
-            #print "Tertiary Interaction",start, end
-            for stem_loop_1 in self.stem_loops:
-                location_1 = Location(nested_lists = stem_loop_1['location'])
-                if location_1.has_position(start):
-                    for junction in self.junctions:
-                        if len(junction['location']) >=3 :
-                            location_2 = Location(nested_lists = junction['location'])
-                            if location_2.has_position(end):
-                                if location_2.end() < location_1.start() or location_2.start() > location_1.end():
-                                    self.connected_modules.append((stem_loop_1, junction))
-                                    #print location_1.start(),location_1.end()
-                                    #print location_2.start(),location_2.end()
-                    for stem_loop_2 in self.stem_loops:
-                        location_2 = Location(nested_lists = stem_loop_2['location'])
-                        if location_2.has_position(end) and stem_loop_2 != stem_loop_1:
-                            if location_2.end() < location_1.start() or location_2.start() > location_1.end():
-                                self.connected_modules.append((stem_loop_1, stem_loop_2))
-                                #print location_1.start(),location_1.end()
-                                #print location_2.start(),location_2.end()
-                if location_1.has_position(end):
-                    for junction in self.junctions:
-                        if len(junction['location']) >=3 :
-                            location_2 = Location(nested_lists = junction['location'])
-                            if location_2.has_position(start):
-                                if location_2.end() < location_1.start() or location_2.start() > location_1.end():
-                                    self.connected_modules.append((stem_loop_1, junction))
-                                    #print location_1.start(),location_1.end()
-                                    #print location_2.start(),location_2.end()
+            stem_loops_at_start = self.__get_modules_at(stem_loop_index, start)
+            stem_loops_at_end = self.__get_modules_at(stem_loop_index, end)
+            junctions_at_start = self.__get_modules_at(junction_index, start)
+            junctions_at_end = self.__get_modules_at(junction_index, end)
+            for index_1 in sorted(set(stem_loops_at_start) | set(stem_loops_at_end)):
+                stem_loop_1 = self.stem_loops[index_1]
+                start_1, end_1 = stem_loop_extents[index_1]
+                if index_1 in stem_loops_at_start:
+                    for index_2 in junctions_at_end:
+                        if junction_extents[index_2][1] < start_1 or junction_extents[index_2][0] > end_1:
+                            self.connected_modules.append((stem_loop_1, junctions[index_2]))
+                    for index_2 in stem_loops_at_end:
+                        stem_loop_2 = self.stem_loops[index_2]
+                        if stem_loop_2 != stem_loop_1 and (stem_loop_extents[index_2][1] < start_1 or stem_loop_extents[index_2][0] > end_1):
+                            self.connected_modules.append((stem_loop_1, stem_loop_2))
+                if index_1 in stem_loops_at_end:
+                    for index_2 in junctions_at_start:
+                        if junction_extents[index_2][1] < start_1 or junction_extents[index_2][0] > end_1:
+                            self.connected_modules.append((stem_loop_1, junctions[index_2]))
+
+    @classmethod
+    def from_pairs(cls, rna, pos1, pos2, orientation = None, edge1 = None, edge2 = None):
+        """
+        Build a secondary structure from base pairs described as vectors, in a single pass over the base pairs sorted according to their first position.
+
+        Parameters:
+        ---------
+        - rna: an RNA object
+        - pos1: the first paired positions (a list or a numpy array of integers)
+        - pos2: the second paired positions
+        - orientation (default: None): the orientations of the base pairs. If None, all the base pairs are 'c'.
+        - edge1 (default: None): the first edges of the base pairs. If None, all the first edges are '('.
+        - edge2 (default: None): the second edges of the base pairs. If None, all the second edges are ')'.
+
+        Returns:
+        ------
+        a SecondaryStructure object. The stacked base pairs make the helices, the non-canonical base pairs being stored as interactions of their helix. The isolated base pairs and those making a pseudoknot are stored as tertiary interactions.
+        """
+        import numpy as np
+        from pyrna.utils import get_canonical_mask
+        ss = cls(rna)
+        count = len(pos1)
+        orientation = ['c']*count if orientation is None else orientation
+        edge1 = ['(']*count if edge1 is None else edge1
+        edge2 = [')']*count if edge2 is None else edge2
+
+        if not count:
+            ss.add_single_strand("SS1", 1, len(rna))
+            return ss
+
+        #the base pairs are sorted according to the first position
+        positions1 = np.asarray(pos1).astype(np.int64)
+        positions2 = np.asarray(pos2).astype(np.int64)
+        order = np.argsort(positions1, kind = 'mergesort')
+        positions1, positions2 = positions1[order], positions2[order]
+        order = order.tolist()
+        base_pairs = zip(positions1.tolist(), positions2.tolist(), [orientation[i] for i in order], [edge1[i] for i in order], [edge2[i] for i in order])
+
+        #the runs of stacked base pairs
+        stacked = (positions1[1:] == positions1[:-1]+1) & (positions2[1:] == positions2[:-1]-1)
+        run_starts = [0]+(np.nonzero(~stacked)[0]+1).tolist()
+        run_ends = run_starts[1:]+[count]
+        in_helix = np.zeros(count, dtype = np.bool_) #the base pairs of the runs longer than 1
+        in_helix[:-1] |= stacked
+        in_helix[1:] |= stacked
+        canonical = np.ones(count, dtype = np.bool_)
+        indices = np.nonzero(in_helix)[0]
+        if len(indices):
+            residues = np.frombuffer(str(rna.sequence), dtype = np.uint8)
+            canonical[indices] = get_canonical_mask(residues[positions1[indices]-1], residues[positions2[indices]-1], [base_pairs[i][2] for i in indices.tolist()], [base_pairs[i][3] for i in indices.tolist()], [base_pairs[i][4] for i in indices.tolist()])
+        runs = [base_pairs[run_start:run_end] for run_start, run_end in zip(run_starts, run_ends)]
+
+        helix_count = 1
+        non_canonical_secondary_interactions = []
+        opened_helices = [] #a heap of the (end, start) of the helices whose end is after the current position
+        for run_start, run in zip(run_starts, runs):
+            if len(run) == 1: #an isolated base pair
+                _pos1, _pos2, _orientation, _edge1, _edge2 = run[0]
+                ss.add_tertiary_interaction(_orientation, _edge1, _edge2, _pos1, _pos2)
+                continue
+            start, end, length = run[0][0], run[0][1], len(run)
+            for bp, _canonical in zip(run, canonical[run_start:run_start+length].tolist()):
+                if not _canonical:
+                    non_canonical_secondary_interactions.append(bp)
+            #no pseudoknot allowed. Only the helices ending after the start of this one can be crossed.
+            while opened_helices and opened_helices[0][0] < start:
+                heappop(opened_helices)
+            pseudoknot = False
+            for _end, _start, _length in opened_helices:
+                if start >= _start+_length-1 and start <= _end-_length+1 and end >= _end or start <= _start and end >= _start+_length-1 and end <= _end-_length+1:
+                    pseudoknot = True
+                    break
+            if pseudoknot:
+                for i in range(0, length):
+                    ss.add_tertiary_interaction('C', '(', ')', start+i, end-i)
+            else:
+                helix = {
+                    'name': "H"+str(helix_count),
+                    'location': [[start,start+length-1],[end-length+1,end]],
+                    'length': length,
+                    'interactions': []
+                }
+                ss.helices.append(helix) #the runs being sorted, the helices are sorted according to their start position
+                ss.__index_helix(helix)
+                heappush(opened_helices, (end, start, length))
+            helix_count += 1
+
+        #now we add the non-canonical interactions to their helices
+        for _pos1, _pos2, _orientation, _edge1, _edge2 in non_canonical_secondary_interactions:
+            helix = ss._helices_by_position.get(_pos1)
+            if helix and ss._pair_table[_pos1] == _pos2:
+                helix['interactions'].append({
+                    'orientation': _orientation,
+                    'edge1': _edge1,
+                    'edge2': _edge2,
+                    'location': [[_pos1, _pos1], [_pos2, _pos2]]
+                })
+            else: #the helix was a pseudoknot
+                ss.add_tertiary_interaction(_orientation, _edge1, _edge2, _pos1, _pos2)
+
+        #we construct the single-strands from the runs of unpaired positions in the pair table
+        unpaired = np.frombuffer(ss._pair_table, dtype = np.int32)[1:len(rna)+1] == -1
+        changes = np.diff(np.concatenate(([0], unpaired.view(np.int8), [0])))
+        ss_starts = np.nonzero(changes == 1)[0]
+        ss_lengths = np.nonzero(changes == -1)[0]-ss_starts
+        for ss_count, (ss_start, ss_length) in enumerate(zip((ss_starts+1).tolist(), ss_lengths.tolist())):
+            ss.add_single_strand("SS"+str(ss_count+1), ss_start, ss_length)
+
+        return ss
 
     def add_helix(self, name, start, end, length):
         _ends = [start, start+length-1, end-length+1, end]
@@ -854,7 +1675,13 @@ class SecondaryStructure:
             'interactions': []
             }
         self.helices.append(helix)
-        self.helices = sorted(self.helices, key=lambda helix: helix['location'][0][0]) #the helices are sorted according to the start position
+        if len(self.helices) > 1 and start < self.helices[-2]['location'][0][0]:
+            self.helices = sorted(self.helices, key=lambda helix: helix['location'][0][0]) #the helices are sorted according to the start position
+        self.__index_helix(helix)
+        if self._structure_tree is not None:
+            node = self._structure_tree.add_helix(helix) #as when the tree is built, a helix that can't be nested is skipped
+            if node is not None and self.__loop_junctions is not None:
+                self.__dirty_loops.update([self._structure_tree.get_parent(node), self._structure_tree.get_children(node)[0]])
         return helix
 
     def add_single_strand(self, name, start, length):
@@ -863,59 +1690,296 @@ class SecondaryStructure:
             'location': [start,start+length-1]
         };
         self.single_strands.append(single_strand)
+        self._single_strands_by_start.setdefault(start, single_strand)
+        if self._structure_tree is not None:
+            node = self._structure_tree.add_single_strand(single_strand)
+            if node is not None and self.__loop_junctions is not None:
+                self.__dirty_loops.add(node)
         return single_strand
 
     def add_tertiary_interaction(self, orientation, edge1, edge2, pos1, pos2):
-        location = [[pos1, pos1], [pos2, pos2]]
-        for tertiary_interaction in self.tertiary_interactions:
-            if tertiary_interaction['location'] == location:
-                self.tertiary_interactions.remove(tertiary_interaction)
-                break
-        self.tertiary_interactions.append({
-                            'orientation': orientation,
-                            'edge1': edge1,
-                            'edge2': edge2,
-                            'location': [[pos1, pos1], [pos2, pos2]]
-                        })
+        tertiary_interaction = self._tertiary_interactions_by_location.get((pos1, pos2))
+        if tertiary_interaction: #this interaction is replaced
+            tertiary_interaction['orientation'] = orientation
+            tertiary_interaction['edge1'] = edge1
+            tertiary_interaction['edge2'] = edge2
+        else:
+            tertiary_interaction = {
+                'orientation': orientation,
+                'edge1': edge1,
+                'edge2': edge2,
+                'location': [[pos1, pos1], [pos2, pos2]]
+            }
+            self.tertiary_interactions.append(tertiary_interaction)
+            self._tertiary_interactions_by_location[(pos1, pos2)] = tertiary_interaction
+            if self._structure_tree is not None:
+                self._structure_tree.add_tertiary_interaction(tertiary_interaction)
 
     def add_base_pair(self, orientation, edge1, edge2, pos1, pos2):
-        is_secondary_interaction = False
         location = [[pos1, pos1], [pos2, pos2]]
-        for helix in self.helices:
-            start = helix['location'][0][0]
-            end = helix['location'][-1][-1]
-            length =  helix['length']
-
-            if pos1 >= start and pos1 <= start+length-1:
-                diff = pos1 -start
-                if end - pos2 == diff:
-                    #if not canonical (not AU, GC or GU, neither cWWW, we add it to the helix as a non-canonical secondary interaction
-                    if not (self.rna.sequence[pos1-1] == 'A' and self.rna.sequence[pos2-1] == 'U' or \
-                            self.rna.sequence[pos1-1] == 'U' and self.rna.sequence[pos2-1] == 'A' or \
-                            self.rna.sequence[pos1-1] == 'G' and self.rna.sequence[pos2-1] == 'C' or \
-                            self.rna.sequence[pos1-1] == 'C' and self.rna.sequence[pos2-1] == 'G' or \
-                            self.rna.sequence[pos1-1] == 'G' and self.rna.sequence[pos2-1] == 'U' or \
-                            self.rna.sequence[pos1-1] == 'U' and self.rna.sequence[pos2-1] == 'G') or \
-                          orientation != 'C' or edge1 != '(' or edge2 != ')': #we have a non-canonical secondary-interaction
-
-                        for secondary_interaction in helix['interactions']:
-                            if secondary_interaction['location'] == location:
-                                helix['interactions'].remove(secondary_interaction)
-                                break
-
-                        helix['interactions'].append({
-                            'orientation': orientation,
-                            'edge1': edge1,
-                            'edge2': edge2,
-                            'location': location
-                        })
-                    is_secondary_interaction = True
-                    break
+        helix = self._helices_by_position.get(pos1)
+
+        if helix and self.get_paired_residue(pos1) == pos2:
+            #if not canonical (not AU, GC or GU, neither cWWW, we add it to the helix as a non-canonical secondary interaction
+            if not (self.rna.sequence[pos1-1] == 'A' and self.rna.sequence[pos2-1] == 'U' or \
+                    self.rna.sequence[pos1-1] == 'U' and self.rna.sequence[pos2-1] == 'A' or \
+                    self.rna.sequence[pos1-1] == 'G' and self.rna.sequence[pos2-1] == 'C' or \
+                    self.rna.sequence[pos1-1] == 'C' and self.rna.sequence[pos2-1] == 'G' or \
+                    self.rna.sequence[pos1-1] == 'G' and self.rna.sequence[pos2-1] == 'U' or \
+                    self.rna.sequence[pos1-1] == 'U' and self.rna.sequence[pos2-1] == 'G') or \
+                  orientation != 'C' or edge1 != '(' or edge2 != ')': #we have a non-canonical secondary-interaction
+
+                for secondary_interaction in helix['interactions']:
+                    if secondary_interaction['location'] == location:
+                        helix['interactions'].remove(secondary_interaction)
+                        break
 
-        if not is_secondary_interaction:
+                helix['interactions'].append({
+                    'orientation': orientation,
+                    'edge1': edge1,
+                    'edge2': edge2,
+                    'location': location
+                })
+        else:
             #if we reach this point, its a tertiary interaction
             self.add_tertiary_interaction(orientation, edge1, edge2, pos1, pos2)
 
+def make_fingerprint(sequence, pairs):
+    """
+    Compute the canonical digest of a sequence and of base pairs (see SecondaryStructure.fingerprint()).
+
+    Parameters:
+    ---------
+    - sequence: the sequence as a String
+    - pairs: the base pairs as tuples (pos1, pos2), in any order. Each base pair is counted once, whatever the order of its positions.
+
+    Returns:
+    ------
+    the digest as a String
+    """
+    import hashlib
+    pairs = sorted(set((min(pos1, pos2), max(pos1, pos2)) for pos1, pos2 in pairs))
+    digest = hashlib.sha1(str(sequence))
+    digest.update('\n')
+    digest.update(' '.join('%i-%i'%pair for pair in pairs))
+    return digest.hexdigest()
+
+def fingerprint_base_pairs(base_pairs, rna):
+    """
+    Parameters:
+    ---------
+    - base_pairs: the base pairs listed in a pandas Dataframe
+    - rna: the RNA object folded with these base pairs
+
+    Returns:
+    ------
+    the canonical digest of the sequence and the base pairs (see SecondaryStructure.fingerprint()). It can be compared to the fingerprint of a SecondaryStructure without building it.
+    """
+    if not len(base_pairs):
+        return make_fingerprint(rna.sequence, [])
+    return make_fingerprint(rna.sequence, zip(base_pairs['pos1'].tolist(), base_pairs['pos2'].tolist()))
+
+class StructureSet(object):
+    """
+    A set of secondary structures without duplicates: two secondary structures are the same if they have the same fingerprint (see SecondaryStructure.fingerprint()). The secondary structures are iterated in the order of their insertion.
+    """
+
+    def __init__(self, secondary_structures = None):
+        self.__secondary_structures = {}
+        self.__fingerprints = []
+        for secondary_structure in secondary_structures or []:
+            self.add(secondary_structure)
+
+    def add(self, secondary_structure, fingerprint = None):
+        """
+        Parameters:
+        ---------
+        - secondary_structure: a SecondaryStructure object
+        - fingerprint (default: None): the fingerprint of the secondary structure, if already computed
+
+        Returns:
+        ------
+        True if the secondary structure was added, False if the set already contained the same one
+        """
+        fingerprint = fingerprint or secondary_structure.fingerprint()
+        if self.__secondary_structures.has_key(fingerprint):
+            return False
+        self.__secondary_structures[fingerprint] = secondary_structure
+        self.__fingerprints.append(fingerprint)
+        return True
+
+    def get(self, fingerprint):
+        """
+        Returns:
+        ------
+        the secondary structure with this fingerprint, or None
+        """
+        return self.__secondary_structures.get(fingerprint)
+
+    def fingerprints(self):
+        return self.__fingerprints[:]
+
+    def __contains__(self, item):
+        """
+        item can be a SecondaryStructure object or a fingerprint
+        """
+        if isinstance(item, basestring):
+            return self.__secondary_structures.has_key(item)
+        return self.__secondary_structures.has_key(item.fingerprint())
+
+    def __len__(self):
+        return len(self.__fingerprints)
+
+    def __iter__(self):
+        for fingerprint in self.__fingerprints:
+            yield self.__secondary_structures[fingerprint]
+
+class AlignmentMatrix(object):
+    """
+    Aligned sequences stored in a 2D numpy array of uint8 (one row per sequence, one column per position in the alignment), with:
+    - the mask of the gaps ('-' or '.')
+    - the cumulative count of residues along each row, to convert alignment positions into sequence positions
+
+    Slicing an AlignmentMatrix (matrix[rows, columns]) produces a new AlignmentMatrix sharing the same array.
+    """
+
+    def __init__(self, sequences, names = None):
+        """
+        Parameters:
+        ---------
+        - sequences: the aligned sequences as a list of Strings of the same length, or a 2D numpy array of uint8. The non-ASCII characters of unicode sequences are replaced with '?'.
+        - names (default: None): the names of the sequences
+        """
+        import numpy as np
+        if isinstance(sequences, np.ndarray):
+            self.matrix = sequences
+        else:
+            sequences = [sequence.encode('ascii', 'replace') if isinstance(sequence, unicode) else str(sequence) for sequence in sequences]
+            length = len(sequences[0]) if sequences else 0
+            for sequence in sequences:
+                if len(sequence) != length:
+                    raise Exception("The aligned sequences have different lengths")
+            self.matrix = np.frombuffer(''.join(sequences), dtype = np.uint8).reshape(len(sequences), length)
+        self.names = list(names) if names is not None else [None]*self.matrix.shape[0]
+        self.__gaps = None
+        self.__residue_counts = None
+
+    @staticmethod
+    def from_molecules(molecules):
+        """
+        Parameters:
+        ---------
+        - molecules: a list of aligned Molecule objects
+
+        Returns:
+        ------
+        an AlignmentMatrix object
+        """
+        return AlignmentMatrix([molecule.sequence for molecule in molecules], [molecule.name for molecule in molecules])
+
+    @property
+    def shape(self):
+        return self.matrix.shape
+
+    def __len__(self):
+        return self.matrix.shape[0]
+
+    def __getitem__(self, key):
+        import numpy as np
+        rows = key[0] if isinstance(key, tuple) else key
+        if isinstance(rows, int):
+            return self.matrix[key]
+        matrix = self.matrix[key]
+        if matrix.ndim != 2:
+            return matrix
+        names = np.empty(len(self.names), dtype = object)
+        names[:] = self.names
+        return AlignmentMatrix(matrix, names[rows].tolist()) #the rows are selected like those of the matrix (slice, indices or boolean mask)
+
+    @property
+    def gaps(self):
+        """
+        the mask of the gaps as a 2D numpy array of booleans
+        """
+        if self.__gaps is None:
+            self.__gaps = (self.matrix == ord('-')) | (self.matrix == ord('.'))
+        return self.__gaps
+
+    @property
+    def residue_counts(self):
+        """
+        the count of residues in each row up to each column (included) as a 2D numpy array. For a residue, it is its position in the ungapped sequence.
+        """
+        import numpy as np
+        if self.__residue_counts is None:
+            self.__residue_counts = np.cumsum(~self.gaps, axis = 1, dtype = np.int32)
+        return self.__residue_counts
+
+    def get_sequence(self, row):
+        return self.matrix[row].tostring()
+
+    def get_ungapped_sequence(self, row, start = 0, end = None):
+        """
+        Returns:
+        ------
+        the residues of a row between the columns start (included) and end (excluded) as a String
+        """
+        return self.matrix[row, start:end][~self.gaps[row, start:end]].tostring()
+
+    def get_ungapped_lengths(self, start = 0, end = None):
+        """
+        Returns:
+        ------
+        the number of residues of each row between the columns start (included) and end (excluded) as a numpy array
+        """
+        import numpy as np
+        start, end, step = slice(start, end).indices(self.matrix.shape[1])
+        if end <= start:
+            return np.zeros(self.matrix.shape[0], dtype = np.int32)
+        counts = self.residue_counts
+        return counts[:, end-1]-(counts[:, start-1] if start else 0)
+
+    def get_gaps_positions(self, row):
+        """
+        Returns:
+        ------
+        the columns (0-based) of the gaps of a row, like Molecule.get_gaps_positions()
+        """
+        import numpy as np
+        return np.nonzero(self.gaps[row])[0].tolist()
+
+    def get_gap_columns(self):
+        """
+        Returns:
+        ------
+        the columns (0-based) filled with gaps as a numpy array
+        """
+        import numpy as np
+        return np.nonzero(self.gaps.all(axis = 0))[0]
+
+    def get_column_frequencies(self, residues = 'ACGU-'):
+        """
+        Parameters:
+        ---------
+        - residues (default: 'ACGU-'): the residues to count
+
+        Returns:
+        ------
+        the frequencies of the residues in each column as a pandas DataFrame (one row per residue, one column per alignment position)
+        """
+        import numpy as np
+        if not len(self):
+            return DataFrame(np.zeros((len(residues), self.matrix.shape[1])), index = list(residues))
+        return DataFrame(np.array([(self.matrix == ord(residue)).mean(axis = 0) for residue in residues]), index = list(residues))
+
+    def to_molecules(self, type = 'RNA'):
+        """
+        Returns:
+        ------
+        the rows as a list of CompactMolecule objects sharing a single buffer (see make_compact_molecules())
+        """
+        return make_compact_molecules(self.names, [self.get_sequence(row) for row in xrange(len(self))], type)
+
 class StructuralAlignment:
 
     def __init__(self, json_data):
@@ -930,6 +1994,14 @@ class StructuralAlignment:
             rnas.append({'name':rna['name'], 'sequence':rna['sequence']})
         return DataFrame(rnas)
 
+    def get_alignment_matrix(self):
+        """
+        Returns:
+        ------
+        the aligned sequences as an AlignmentMatrix object
+        """
+        return AlignmentMatrix([rna['sequence'] for rna in self.json_data['sequences']], [rna['name'] for rna in self.json_data['sequences']])
+
     def get_consensus_2d(self):
         for interaction in self.json_data['consensus2D']:
             interaction['pos1'] = int(interaction['location']['ends'][0][0]);
@@ -938,15 +2010,267 @@ class StructuralAlignment:
         return DataFrame(self.json_data['consensus2D'])
 
 
-class TertiaryStructure:
+class SpatialIndex(object):
+    """
+    A uniform grid over 3D points (the atoms of a TertiaryStructure for example). Each point is stored in a cell of the grid and a query only computes the distances to the points stored in the cells it overlaps.
+    """
+
+    def __init__(self, coordinates, cell_size = 5.0):
+        """
+        Parameters:
+        ---------
+        - coordinates: the coordinates of the points as an array of shape (points count, 3)
+        - cell_size (default: 5.0): the size of the cells of the grid (in Angstroms)
+        """
+        import numpy as np
+        self.coordinates = np.asarray(coordinates, dtype = np.float64).reshape(-1, 3)
+        self.cell_size = float(cell_size)
+        self.origin = self.coordinates.min(axis = 0) if len(self.coordinates) else np.zeros(3)
+        self.cells = np.floor((self.coordinates-self.origin)/self.cell_size).astype(np.int64)
+        self.shape = self.cells.max(axis = 0)+1 if len(self.coordinates) else np.ones(3, dtype = np.int64)
+        keys = self.__get_keys(self.cells)
+        self.order = np.argsort(keys, kind = 'mergesort')
+        self.sorted_keys = keys[self.order]
+
+    def __len__(self):
+        return len(self.coordinates)
+
+    def __get_keys(self, cells):
+        return (cells[:,0]*self.shape[1]+cells[:,1])*self.shape[2]+cells[:,2]
+
+    def __get_points(self, keys):
+        #the indices of the points stored in the cells, cell after cell
+        import numpy as np
+        starts = np.searchsorted(self.sorted_keys, keys, side = 'left')
+        lengths = np.searchsorted(self.sorted_keys, keys, side = 'right')-starts
+        return self.order[np.repeat(starts-np.cumsum(lengths)+lengths, lengths)+np.arange(lengths.sum())], lengths
+
+    def query_radius(self, point, radius):
+        """
+        Parameters:
+        ---------
+        - point: the coordinates of the query point
+        - radius: the radius of the query (in Angstroms)
+
+        Returns:
+        ------
+        the sorted indices of the points at a distance lower or equal to radius as a numpy array
+        """
+        import numpy as np
+        point = np.asarray(point, dtype = np.float64)
+        low = np.maximum(np.floor((point-radius-self.origin)/self.cell_size).astype(np.int64), 0)
+        high = np.minimum(np.floor((point+radius-self.origin)/self.cell_size).astype(np.int64), self.shape-1)
+        if not len(self.coordinates) or (low > high).any():
+            return np.array([], dtype = np.int64)
+        cells = np.mgrid[low[0]:high[0]+1, low[1]:high[1]+1, low[2]:high[2]+1].reshape(3, -1).T
+        candidates, lengths = self.__get_points(self.__get_keys(cells))
+        distances = np.sqrt(((self.coordinates[candidates]-point)**2).sum(axis = 1))
+        return np.sort(candidates[distances <= radius])
+
+    def query_pairs(self, radius):
+        """
+        Parameters:
+        ---------
+        - radius: the maximal distance between two points (in Angstroms)
+
+        Returns:
+        ------
+        the pairs of points at a distance lower or equal to radius as two numpy arrays of indices (i, j), with i < j. The pairs are sorted.
+        """
+        import numpy as np
+        from itertools import product
+        reach = int(np.ceil(radius/self.cell_size))
+        points = np.arange(len(self.coordinates))
+        all_i, all_j = [np.array([], dtype = np.int64)], [np.array([], dtype = np.int64)]
+        for offset in product(range(-reach, reach+1), repeat = 3):
+            if offset < (0, 0, 0): #the symmetric offset gives the same pairs
+                continue
+            neighbour_cells = self.cells+offset
+            valid = ((neighbour_cells >= 0) & (neighbour_cells < self.shape)).all(axis = 1)
+            j, lengths = self.__get_points(self.__get_keys(neighbour_cells[valid]))
+            i = np.repeat(points[valid], lengths)
+            if offset == (0, 0, 0):
+                i, j = i[i < j], j[i < j]
+            close = ((self.coordinates[i]-self.coordinates[j])**2).sum(axis = 1) <= radius*radius
+            all_i.append(np.minimum(i[close], j[close]))
+            all_j.append(np.maximum(i[close], j[close]))
+        i, j = np.concatenate(all_i), np.concatenate(all_j)
+        order = np.lexsort((j, i))
+        return i[order], j[order]
+
+    def query_nearest(self, points):
+        """
+        Parameters:
+        ---------
+        - points: the coordinates of the query points as an array of shape (points count, 3)
+
+        Returns:
+        ------
+        two numpy arrays: the indices of the nearest point for each query point and the corresponding distances
+        """
+        import numpy as np
+        points = np.asarray(points, dtype = np.float64).reshape(-1, 3)
+        indices = np.zeros(len(points), dtype = np.int64)
+        distances = np.zeros(len(points))
+        if not len(self.coordinates):
+            raise ValueError("the spatial index is empty")
+        for p, point in enumerate(points):
+            radius = self.cell_size
+            while True: #the radius is doubled until a point is found. All the points within the radius are found, so the nearest one is the nearest of the whole index.
+                candidates = self.query_radius(point, radius)
+                if len(candidates):
+                    candidate_distances = np.sqrt(((self.coordinates[candidates]-point)**2).sum(axis = 1))
+                    indices[p] = candidates[candidate_distances.argmin()]
+                    distances[p] = candidate_distances.min()
+                    break
+                radius *= 2
+        return indices, distances
+
+class TertiaryStructure(object):
+    """
+    The atoms are stored in contiguous arrays (one item per atom, the atoms of a residue being contiguous once the arrays are built):
+    - the coordinates as a float32 array of shape (atoms count, 3)
+    - the codes of the atom names (see atom_names)
+    - the absolute positions of the residues and the offsets of their first atom
+    - the labels of the residues according to the numbering system
+
+    The columnar arrays are cached once built. The coordinates can be edited in place or assigned as a whole, the edits being kept when atoms are added.
+
+    The attribute residues is a compatibility view (a dict whose keys are the absolute positions of the residues) built when accessed. This dict can be edited. It is synchronized back into the columnar arrays once, on the next access to these arrays or the next added atom. From then on, the former dict is detached from the structure.
+    """
 
     def __init__(self, rna):
         self.source = 'N.A.:N.A.:N.A.'
         self.rna = rna
         self.name = "N.A."
-        self.residues = {} #the keys are the absolute position of residues
         self.numbering_system = {}
         self._id = str(ObjectId())
+        self._residues = None
+        self._atom_coords = array('f')
+        self._atom_codes = array('H')
+        self._atom_positions = array('i')
+        self._columns = None
+        self._version = 0 #incremented each time the atoms change (see get_spatial_index())
+        self._spatial_index = None
+
+    @property
+    def residues(self):
+        if self._residues is None:
+            residues = {}
+            coordinates, atom_codes, residue_positions, residue_offsets = self.__get_columns()
+            for i, absolute_position in enumerate(residue_positions.tolist()):
+                residues[absolute_position] = {
+                    'atoms': [{
+                        'name': atom_names[code],
+                        'coords': coords
+                    } for code, coords in zip(atom_codes[residue_offsets[i]:residue_offsets[i+1]].tolist(), coordinates[residue_offsets[i]:residue_offsets[i+1]].tolist())]
+                }
+            self.residues = residues
+        return self._residues
+
+    @residues.setter
+    def residues(self, residues):
+        self._residues = residues
+        self._atom_coords = array('f')
+        self._atom_codes = array('H')
+        self._atom_positions = array('i')
+        self._columns = None
+        self._version += 1
+
+    @property
+    def coordinates(self):
+        """
+        the coordinates of the atoms as a float32 numpy array of shape (atoms count, 3)
+        """
+        return self.__get_columns()[0]
+
+    @coordinates.setter
+    def coordinates(self, coordinates):
+        self.__get_columns()[0][:] = coordinates
+        self._version += 1
+
+    @property
+    def atom_codes(self):
+        """
+        the codes of the atom names (see atom_names) as a numpy array
+        """
+        return self.__get_columns()[1]
+
+    @property
+    def residue_positions(self):
+        """
+        the absolute positions of the residues as a sorted numpy array
+        """
+        return self.__get_columns()[2]
+
+    @property
+    def residue_offsets(self):
+        """
+        the offsets of the first atom of each residue as a numpy array. Its last item is the atoms count.
+        """
+        return self.__get_columns()[3]
+
+    @property
+    def residue_labels(self):
+        """
+        the labels of the residues according to the numbering system, as a numpy array
+        """
+        import numpy as np
+        return np.array([self.get_residue_label(absolute_position) for absolute_position in self.residue_positions.tolist()], dtype = object)
+
+    def get_atom_names(self):
+        """
+        Returns:
+        ------
+        the names of the atoms as a numpy array
+        """
+        import numpy as np
+        atom_codes = self.atom_codes #may register new atom names
+        return np.array(atom_names, dtype = object)[atom_codes]
+
+    def __sync_residues(self):
+        #the compatibility view is synchronized back into the columnar arrays and detached from the structure
+        import numpy as np
+        coords, codes, positions = [], array('H'), array('i')
+        for absolute_position in sorted(self._residues):
+            for atom in self._residues[absolute_position]['atoms']:
+                coords.append(atom['coords'])
+                codes.append(get_atom_code(atom['name']))
+                positions.append(absolute_position)
+        self._atom_coords = array('f', np.array(coords, dtype = np.float32).tostring())
+        self._atom_codes = codes
+        self._atom_positions = positions
+        self._residues = None
+        self._columns = None
+        self._version += 1
+
+    def __get_columns(self):
+        import numpy as np
+        if self._residues is not None:
+            self.__sync_residues()
+        if self._columns is None:
+            coordinates = np.frombuffer(self._atom_coords, dtype = np.float32).reshape(-1, 3).copy()
+            atom_codes = np.frombuffer(self._atom_codes, dtype = np.uint16).copy()
+            atom_positions = np.frombuffer(self._atom_positions, dtype = np.int32).copy()
+            if len(atom_positions) and (np.diff(atom_positions) < 0).any(): #the atoms of a residue have to be contiguous
+                order = np.argsort(atom_positions, kind = 'mergesort')
+                coordinates, atom_codes, atom_positions = coordinates[order], atom_codes[order], atom_positions[order]
+            residue_positions, residue_starts = np.unique(atom_positions, return_index = True)
+            residue_offsets = np.append(residue_starts, len(atom_positions))
+            self._columns = (coordinates, atom_codes, residue_positions, residue_offsets)
+        return self._columns
+
+    def __store_columns(self):
+        #the cached columnar arrays (whose coordinates may have been edited) become the arrays the new atoms are appended to
+        import numpy as np
+        if self._residues is not None:
+            self.__sync_residues()
+        elif self._columns is not None:
+            coordinates, atom_codes, residue_positions, residue_offsets = self._columns
+            self._atom_coords = array('f', coordinates.tostring())
+            self._atom_codes = array('H', atom_codes.tostring())
+            self._atom_positions = array('i', np.repeat(residue_positions, np.diff(residue_offsets)).astype(np.int32).tostring())
+            self._columns = None
 
     def get_atoms(self):
         """
@@ -962,49 +2286,111 @@ class TertiaryStructure:
         - y (float)
         - z (float)
         """
-        _atoms = []
-        keys =[]
-        for k in self.residues:
-            keys.append(k)
-
-        keys.sort() #the absolute position are sorted
-
-        for key in keys:
-            atoms = self.residues[key]['atoms']
-            for atom in atoms:
-                _atoms.append({
-                    'name': atom['name'],
-                    'absolute position': key,
-                    'position label': self.get_residue_label(key),
-                    'residue name': self.rna.sequence[key-1],
-                    'chain name': self.rna.name,
-                    'x': atom['coords'][0],
-                    'y': atom['coords'][1],
-                    'z': atom['coords'][2]
-                })
-
-        return DataFrame(_atoms)
+        import numpy as np
+        coordinates, atom_codes, residue_positions, residue_offsets = self.__get_columns()
+        if not len(coordinates):
+            return DataFrame()
+        residue_indices = np.repeat(np.arange(len(residue_positions)), np.diff(residue_offsets))
+        absolute_positions = residue_positions[residue_indices].astype(int)
+        return DataFrame({
+            'name': np.array(atom_names, dtype = object)[atom_codes],
+            'absolute position': absolute_positions,
+            'position label': self.residue_labels[residue_indices],
+            'residue name': np.array(list(self.rna.sequence), dtype = object)[absolute_positions-1],
+            'chain name': self.rna.name,
+            'x': coordinates[:,0].astype(float),
+            'y': coordinates[:,1].astype(float),
+            'z': coordinates[:,2].astype(float)
+        }, columns = ['absolute position', 'chain name', 'name', 'position label', 'residue name', 'x', 'y', 'z'])
 
     def add_atom(self, atom_name, absolute_position, coords):
-        atom_name = re.sub("\*", "'", atom_name)
-        if atom_name == 'OP1':
-            atom_name = 'O1P'
-        elif atom_name == 'OP2':
-            atom_name = 'O2P'
-        elif atom_name == 'OP3':
-            atom_name = 'O3P'
-        if self.residues.has_key(absolute_position):
-            self.residues[absolute_position]['atoms'].append({
-                    'name': atom_name,
-                    'coords': coords
-                })
-        else:
-             self.residues[absolute_position] = {
-                'atoms': [{
-                    'name': atom_name,
-                    'coords': coords
-                }]
-             }
+        atom_name = atom_name.replace('*', "'")
+        atom_name = atom_name_substitutions.get(atom_name, atom_name)
+        self.__store_columns()
+        self._atom_coords.extend(coords)
+        self._atom_codes.append(get_atom_code(atom_name))
+        self._atom_positions.append(absolute_position)
+        self._version += 1
+
+    def add_atoms(self, atom_names, absolute_positions, coordinates):
+        """
+        Add several atoms at once (see add_atom()).
+
+        Parameters:
+        ---------
+        - atom_names: the names of the atoms
+        - absolute_positions: the absolute positions of their residues
+        - coordinates: their coordinates as a numpy array of shape (atoms count, 3)
+        """
+        import numpy as np
+        self.__store_columns()
+        codes = {}
+        for atom_name in set(atom_names):
+            name = atom_name.replace('*', "'")
+            codes[atom_name] = get_atom_code(atom_name_substitutions.get(name, name))
+        self._atom_coords.fromstring(np.asarray(coordinates, dtype = np.float32).tostring())
+        self._atom_codes.extend([codes[atom_name] for atom_name in atom_names])
+        self._atom_positions.extend(absolute_positions)
+        self._version += 1
+
+    def get_spatial_index(self):
+        """
+        Returns:
+        ------
+        the SpatialIndex of the atoms. It is built when needed and rebuilt once the atoms have changed (added atoms, new residues or coordinates assigned through the coordinates attribute). After an in-place edit of the coordinates array, assign it back to the coordinates attribute to get an up-to-date index.
+        """
+        coordinates = self.__get_columns()[0]
+        if self._spatial_index is None or self._spatial_index[0] != self._version:
+            self._spatial_index = (self._version, SpatialIndex(coordinates))
+        return self._spatial_index[1]
+
+    def get_atoms_around(self, point, radius):
+        """
+        Parameters:
+        ---------
+        - point: the coordinates of the query point
+        - radius: the radius of the query (in Angstroms)
+
+        Returns:
+        ------
+        the indices of the atoms (in the columnar arrays, see coordinates) at a distance lower or equal to radius as a numpy array
+        """
+        return self.get_spatial_index().query_radius(point, radius)
+
+    def get_nearest_atoms(self, points):
+        """
+        Parameters:
+        ---------
+        - points: the coordinates of the query points as an array of shape (points count, 3)
+
+        Returns:
+        ------
+        two numpy arrays: the indices of the nearest atom for each query point (in the columnar arrays, see coordinates) and the corresponding distances
+        """
+        return self.get_spatial_index().query_nearest(points)
+
+    def get_contact_map(self, radius = 4.0):
+        """
+        Two residues are in contact if at least two of their atoms are at a distance lower or equal to radius.
+
+        Parameters:
+        ---------
+        - radius (default: 4.0): the maximal distance between two atoms in contact (in Angstroms)
+
+        Returns:
+        ------
+        the contact map as a pandas DataFrame of booleans whose index and columns are the absolute positions of the residues. A residue is not in contact with itself.
+        """
+        import numpy as np
+        residue_positions, residue_offsets = self.residue_positions, self.residue_offsets
+        residue_indices = np.repeat(np.arange(len(residue_positions)), np.diff(residue_offsets))
+        i, j = self.get_spatial_index().query_pairs(radius)
+        i, j = residue_indices[i], residue_indices[j]
+        contacts = np.zeros((len(residue_positions), len(residue_positions)), dtype = bool)
+        contacts[i, j] = True
+        contacts[j, i] = True
+        contacts[np.arange(len(residue_positions)), np.arange(len(residue_positions))] = False
+        return DataFrame(contacts, index = residue_positions, columns = residue_positions)
 
     def get_residue_label(self, absolute_position):
         if self.numbering_system.has_key(str(absolute_position)):
@@ -1012,6 +2398,27 @@ class TertiaryStructure:
         else:
             return str(absolute_position)
 
+atom_name_substitutions = {
+    'OP1': 'O1P',
+    'OP2': 'O2P',
+    'OP3': 'O3P'
+}
+
+atom_names = [] #the atom names stored in the TertiaryStructure objects, their codes being their indices
+atom_name_codes = {}
+
+def get_atom_code(atom_name):
+    """
+    Returns:
+    ------
+    the code of an atom name (see atom_names)
+    """
+    code = atom_name_codes.get(atom_name)
+    if code is None:
+        code = atom_name_codes[atom_name] = len(atom_names)
+        atom_names.append(atom_name)
+    return code
+
 modified_aminoacids = {
     "ALA": "A",
     "ARG": "R",
@@ -1467,3 +2874,92 @@ modified_ribonucleotides = {
     "P5P": "A",
     "FMU": "U"
 }
+
+def make_normalization(modified_residues, gap_symbols = ''):
+    """
+    Prepare the normalization of whole sequences (see normalize_sequence()).
+
+    Parameters:
+    ---------
+    - modified_residues: a dict of modified residues (keys) and their unmodified counterparts (values). Only the residues described with a single character can be found in a sequence.
+    - gap_symbols (default: ''): the characters to be replaced with the gap symbol '-'
+
+    Returns:
+    ------
+    a tuple containing a translation table for str objects, a translation table for unicode objects and the regular expression matching the modified residues (None if no one)
+    """
+    substitutions = dict((residue, modified_residues[residue]) for residue in modified_residues if len(residue) == 1)
+    for gap_symbol in gap_symbols:
+        substitutions[gap_symbol] = '-'
+    table = list(map(chr, range(256)))
+    for residue, substitution in substitutions.items():
+        table[ord(residue)] = substitution
+    single_residues = sorted(residue for residue in modified_residues if len(residue) == 1)
+    pattern = re.compile('[%s]'%re.escape(''.join(single_residues))) if single_residues else None
+    return ''.join(table), dict((ord(residue), unicode(substitution)) for residue, substitution in substitutions.items()), pattern
+
+def normalize_sequence(sequence, normalization):
+    """
+    Normalize a whole sequence in a single pass: the modified residues are replaced with their unmodified counterparts and the gap symbols with '-'.
+
+    Parameters:
+    ---------
+    - sequence: the sequence as a String or a SequenceView
+    - normalization: the tables produced by make_normalization()
+
+    Returns:
+    ------
+    a tuple containing the normalized sequence and the list of modified residues found as tuples (residue, position)
+    """
+    table, unicode_table, pattern = normalization
+    if isinstance(sequence, SequenceView):
+        sequence = str(sequence)
+    modified_residues = [(match.group(), match.start()+1) for match in pattern.finditer(sequence)] if pattern else []
+    if isinstance(sequence, unicode):
+        return sequence.translate(unicode_table), modified_residues
+    return str(sequence).translate(table), modified_residues
+
+ribonucleotides_normalization = make_normalization(modified_ribonucleotides, gap_symbols = '._')
+aminoacids_normalization = make_normalization(modified_aminoacids)
+
+def make_complement_table(base_complements):
+    """
+    Prepare the complementation of whole sequences (see complement_sequence()).
+
+    Parameters:
+    ---------
+    - base_complements: a dict of bases (keys) and their complements (values). The other residues are kept as they are.
+
+    Returns:
+    ------
+    a tuple containing a translation table for str objects, a translation table for unicode objects and a unicode translation table removing the bases
+    """
+    table = list(map(chr, range(256)))
+    for base, complement in base_complements.items():
+        table[ord(base)] = complement
+    return ''.join(table), dict((ord(base), unicode(complement)) for base, complement in base_complements.items()), dict((ord(base), None) for base in base_complements)
+
+def complement_sequence(sequence, complement_table):
+    """
+    Complement a sequence in a single pass.
+
+    Parameters:
+    ---------
+    - sequence: the sequence as a String
+    - complement_table: the tables produced by make_complement_table()
+
+    Returns:
+    ------
+    the complement sequence as a String. For a unicode sequence, it is a str if all its residues are complemented, unicode otherwise (the type of the characters joined by the former get_complement()).
+    """
+    table, unicode_table, bases_removal = complement_table
+    if isinstance(sequence, unicode):
+        if not sequence.translate(bases_removal):
+            return str(sequence.translate(unicode_table))
+        return sequence.translate(unicode_table)
+    return str(sequence).translate(table)
+
+dna_complement_table = make_complement_table({'A': 'T', 'C': 'G', 'G': 'C', 'T': 'A'})
+rna_complement_table = make_complement_table({'A': 'U', 'C': 'G', 'G': 'C', 'U': 'A'})
+CompactDNA._complement_table = dna_complement_table
+CompactRNA._complement_table = rna_complement_table
@@ -1,6 +1,6 @@
 import re
 from pandas import DataFrame
-from pyrna.features import RNA, DNA, Protein, TertiaryStructure, SecondaryStructure
+from pyrna.features import RNA, DNA, Protein, TertiaryStructure, SecondaryStructure, AlignmentMatrix, make_compact_molecules, make_complement_table, complement_sequence, dna_complement_table
 from pyrna import utils
 
 def consensus2d_to_base_pairs(aligned_rna, consensus_2d):
@@ -14,24 +14,58 @@ def consensus2d_to_base_pairs(aligned_rna, consensus_2d):
     ------
     the secondary structure as a list of base-pairs in a pandas DataFrame
     """
+    return consensus2d_to_aligned_base_pairs([aligned_rna], consensus_2d)[0]
 
-    aligned_sequence = aligned_rna.sequence
-    rna = RNA(name = aligned_rna.name, sequence = aligned_sequence.replace('-',''))
-    new_base_pairs = []
-
-    for index, bp in consensus_2d.iterrows():
-        if aligned_sequence[bp['pos1']-1] != '-' and aligned_sequence[bp['pos2']-1] != '-':
-            new_pos1 = bp['pos1']-aligned_sequence[0:bp['pos1']].count('-')
-            new_pos2 = bp['pos2']-aligned_sequence[0:bp['pos2']].count('-')
-            new_base_pairs.append({
-                'pos1': new_pos1,
-                'pos2': new_pos2,
-                'orientation': bp['orientation'],
-                'edge1': bp['edge1'],
-                'edge2': bp['edge2']
-                })
+def consensus2d_to_aligned_base_pairs(alignment, consensus_2d, as_arrays = False):
+    """
+    Projects a consensus secondary structure on all the sequences of an alignment at once. A base-pair is kept for a sequence if none of its positions is a gap. Its positions are converted with the cumulative counts of residues of the AlignmentMatrix (see pyrna.features), so the cost is linear with the size of the alignment.
+
+    Parameters:
+    ---------
+    - alignment: an AlignmentMatrix object or a list of aligned RNA objects (see pyrna.features)
+    - consensus_2d: the consensus secondary structure and described as a list of base_pairs in a pandas Dataframe
+    - as_arrays (default: False): if True, the base-pairs of each sequence are returned as a tuple of numpy arrays (indices of the base-pairs kept in consensus_2d, pos1, pos2)
+
+    Returns:
+    ------
+    a list (one item per sequence, in the order of the alignment) of secondary structures as lists of base-pairs in pandas DataFrames (or as tuples of numpy arrays)
+    """
+    import numpy as np
+    if not isinstance(alignment, AlignmentMatrix):
+        alignment = AlignmentMatrix.from_molecules(alignment)
+
+    if not len(consensus_2d):
+        empty = np.zeros(0, dtype = np.int64)
+        return [(empty, empty, empty) if as_arrays else DataFrame() for i in xrange(len(alignment))]
+
+    columns1 = consensus_2d['pos1'].values.astype(np.int64)-1
+    columns2 = consensus_2d['pos2'].values.astype(np.int64)-1
+    kept = ~(alignment.gaps[:, columns1] | alignment.gaps[:, columns2])
+    new_positions1 = alignment.residue_counts[:, columns1].astype(np.int64)
+    new_positions2 = alignment.residue_counts[:, columns2].astype(np.int64)
+
+    if not as_arrays:
+        orientations = consensus_2d['orientation'].values
+        edges1 = consensus_2d['edge1'].values
+        edges2 = consensus_2d['edge2'].values
+
+    all_base_pairs = []
+    for row in xrange(len(alignment)):
+        indices = np.nonzero(kept[row])[0]
+        if as_arrays:
+            all_base_pairs.append((indices, new_positions1[row, indices], new_positions2[row, indices]))
+        elif not len(indices):
+            all_base_pairs.append(DataFrame())
+        else:
+            all_base_pairs.append(DataFrame({
+                'edge1': edges1[indices],
+                'edge2': edges2[indices],
+                'orientation': orientations[indices],
+                'pos1': new_positions1[row, indices],
+                'pos2': new_positions2[row, indices]
+                }, columns = ['edge1', 'edge2', 'orientation', 'pos1', 'pos2']))
 
-    return DataFrame(new_base_pairs)
+    return all_base_pairs
 
 def secondary_structure_to_base_pairs(secondary_structure, keep_tertiaries = False):
     """
@@ -98,97 +132,10 @@ def base_pairs_to_secondary_structure(rna, base_pairs):
     a SecondaryStructure object (see pyrna.features)
     """
 
-    ss = SecondaryStructure(rna)
-
     if not len(base_pairs):
-        ss.add_single_strand("SS1", 1, len(rna))
-        return ss
-
-    new_helix = False
-    helix_start = -1
-    helix_end = -1
-    helix_length = -1
-    base_pairs = base_pairs.sort_values(by='pos1') #the base pairs are sorted according to the first position
-    base_pairs = base_pairs.as_matrix()
-    helix_count = 1
-
-    next_pos1 = -1
-    next_edge1 = None
-    next_pos2 = -1
-    next_edge2 = None
-    next_orientation = None
-
-    non_canonical_secondary_interactions = []
-
-    for i in range(0, len(base_pairs)-1):
-        bp = base_pairs[i]
-        pos1 = bp[3]
-        edge1 = bp[1]
-        pos2 = bp[4]
-        edge2 = bp[2]
-        orientation = bp[0]
-
-        next_bp = base_pairs[i+1]
-        next_pos1 = next_bp[3]
-        next_edge1 = next_bp[1]
-        next_pos2 = next_bp[4]
-        next_edge2 = next_bp[2]
-        next_orientation = next_bp[0]
-
-        if pos1+1 == next_pos1 and pos2-1 == next_pos2:
-            if new_helix:
-                helix_length += 1
-                if not utils.is_canonical(rna[next_pos1-1], rna[next_pos2-1], next_orientation, next_edge1, next_edge2):
-                    non_canonical_secondary_interactions.append((next_orientation, next_edge1, next_edge2, next_pos1, next_pos2))
-            else:
-                new_helix = True
-                helix_length = 2
-                helix_start = pos1
-                helix_end = pos2
-                if not utils.is_canonical(rna[pos1-1], rna[pos2-1], orientation, edge1, edge2):
-                    non_canonical_secondary_interactions.append((orientation, edge1, edge2, pos1, pos2))
-                if not utils.is_canonical(rna[next_pos1-1], rna[next_pos2-1], next_orientation, next_edge1, next_edge2):
-                    non_canonical_secondary_interactions.append((next_orientation, next_edge1, next_edge2, next_pos1, next_pos2))
-
-        else:
-            if new_helix:
-                ss.add_helix("H"+str(helix_count), helix_start, helix_end, helix_length)
-                helix_count += 1
-            else:
-                ss.add_tertiary_interaction(orientation, edge1, edge2, pos1, pos2)
-            new_helix = False
+        return SecondaryStructure.from_pairs(rna, [], [])
 
-    #the last helix
-    if new_helix:
-        ss.add_helix("H"+str(helix_count), helix_start, helix_end, helix_length)
-        helix_count+=1
-    else:
-        ss.add_tertiary_interaction(next_orientation, next_edge1, next_edge2, next_pos1, next_pos2)
-
-    #now we add the non-canonical interactions to their helices
-    for non_canonical_secondary_interaction in non_canonical_secondary_interactions:
-        ss.add_base_pair( non_canonical_secondary_interaction[0], non_canonical_secondary_interaction[1], non_canonical_secondary_interaction[2], non_canonical_secondary_interaction[3], non_canonical_secondary_interaction[4] )
-
-    #we construct the single-strands
-    ss_count = 1
-    ss_start = -1
-    ss_length = 0
-    for i in range(1, len(rna)+1):
-        paired_residue = ss.get_paired_residue(i)
-        if paired_residue != -1 and ss_length > 0:
-            ss.add_single_strand("SS"+str(ss_count), ss_start, ss_length)
-            ss_length = 0
-            ss_count += 1
-        elif paired_residue == -1:
-            if ss_length == 0:
-                ss_start = i
-            ss_length += 1
-
-    #the last single-strand
-    if ss_length > 0:
-        ss.add_single_strand("SS"+str(ss_count), ss_start, ss_length)
-
-    return ss
+    return SecondaryStructure.from_pairs(rna, base_pairs['pos1'].tolist(), base_pairs['pos2'].tolist(), base_pairs['orientation'].tolist(), base_pairs['edge1'].tolist(), base_pairs['edge2'].tolist())
 
 def consensus2d_to_booquet(structural_alignment, junction_diameter = 20):
     """
@@ -204,56 +151,43 @@ def consensus2d_to_booquet(structural_alignment, junction_diameter = 20):
     ss_object = None
     ss_json = {}
     base_pairs_dataframe = None
-    aligned_rnas = None
+    alignment_matrix = None
 
     print structural_alignment
 
-    aligned_rnas, base_pairs_dataframe = parse_clustalw(structural_alignment)
-    print aligned_rnas, base_pairs_dataframe
-    ss_object = base_pairs_to_secondary_structure(aligned_rnas[0], base_pairs_dataframe)
+    alignment_matrix, base_pairs_dataframe = parse_clustalw(structural_alignment, alignment_matrix = True)
+    print alignment_matrix.names, base_pairs_dataframe
+    ss_object = base_pairs_to_secondary_structure(RNA(name = alignment_matrix.names[0], sequence = alignment_matrix.get_sequence(0)), base_pairs_dataframe)
 
     if ss_object:
         ss_object.find_junctions()
 
+        #the strands are sliced from the alignment matrix and their sizes computed for all the rows at once
+        def describe(row, locations):
+            return [alignment_matrix.get_ungapped_sequence(row, start, end) for start, end in locations]
+
         for helix in ss_object.helices:
             print helix['location']
-            sizes = []
-            descriptions = []
-            for aligned_rna in aligned_rnas:
-                strand1 = aligned_rna.sequence[helix['location'][0][0]-1:helix['location'][0][-1]].replace('-','')
-                sizes.append(len(strand1))
-                strand2 = aligned_rna.sequence[helix['location'][-1][0]-1:helix['location'][-1][-1]].replace('-','')
-                sizes.append(len(strand2))
-                descriptions.append([aligned_rna.name, strand1, strand2])
+            locations = [(helix['location'][0][0]-1, helix['location'][0][-1]), (helix['location'][-1][0]-1, helix['location'][-1][-1])]
+            sizes = np.column_stack([alignment_matrix.get_ungapped_lengths(start, end) for start, end in locations]).ravel()
+            descriptions = [[name]+describe(row, locations) for row, name in enumerate(alignment_matrix.names)]
             if len(sizes) > 2:
                 helix['quantitative_value'] = np.std(sizes)
             helix['descriptions'] = descriptions
 
         for single_strand in ss_object.single_strands:
-            sizes = []
-            descriptions = []
-            for aligned_rna in aligned_rnas:
-                strand = aligned_rna.sequence[single_strand['location'][0]-1:single_strand['location'][-1]].replace('-','')
-                sizes.append(len(strand))
-                descriptions.append([aligned_rna.name, strand])
+            locations = [(single_strand['location'][0]-1, single_strand['location'][-1])]
+            sizes = alignment_matrix.get_ungapped_lengths(*locations[0])
+            descriptions = [[name]+describe(row, locations) for row, name in enumerate(alignment_matrix.names)]
             if len(sizes) > 1:
                 single_strand['quantitative_value'] = np.std(sizes)
             single_strand['descriptions'] = descriptions
 
         for junction in ss_object.junctions:
             junction['location'].sort() #we need to be sure that the locations are sorted (so the display will be from the 5' to the 3' ends)
-            sizes = []
-            descriptions = []
-            for aligned_rna in aligned_rnas:
-                size = 0
-                strands = []
-                for single_strand in junction['location']:
-                    strand = aligned_rna.sequence[single_strand[0]:single_strand[-1]-1].replace('-','')
-                    size += len(strand)
-                    strands.append(strand)
-                sizes.append(size)
-                strands.insert(0, aligned_rna.name)
-                descriptions.append(strands)
+            locations = [(single_strand[0], single_strand[-1]-1) for single_strand in junction['location']]
+            sizes = sum([alignment_matrix.get_ungapped_lengths(start, end) for start, end in locations])
+            descriptions = [[name]+describe(row, locations) for row, name in enumerate(alignment_matrix.names)]
             if len(sizes) > 1:
                 junction['quantitative_value'] = np.std(sizes)
             junction['descriptions'] = descriptions
@@ -372,21 +306,19 @@ def to_pdb(tertiary_structure, location = None, export_numbering_system = False)
     """
     lines= []
     i = 1
-    keys = []
-
-    for k in tertiary_structure.residues:
-        if location and location.has_position(k) or not location:
-            keys.append(k)
-
-    keys.sort() #the absolute position are sorted
-
-    for key in keys:
-        atoms = tertiary_structure.residues[key]['atoms']
-        for atom in atoms:
+    coordinates = tertiary_structure.coordinates.tolist()
+    atom_names = tertiary_structure.get_atom_names()
+    residue_offsets = tertiary_structure.residue_offsets
+
+    for index, key in enumerate(tertiary_structure.residue_positions.tolist()): #the absolute position are sorted
+        if location and not location.has_position(key):
+            continue
+        for atom in xrange(residue_offsets[index], residue_offsets[index+1]):
+            coords = coordinates[atom]
             if export_numbering_system:
-                lines.append("%-6s%5u  %-4s%3s %s%4s    %8.3f%8.3f%8.3f"%("ATOM", i, atom['name'], tertiary_structure.rna.sequence[key-1], tertiary_structure.rna.name[0], tertiary_structure.get_residue_label(key), atom['coords'][0], atom['coords'][1], atom['coords'][2]))
+                lines.append("%-6s%5u  %-4s%3s %s%4s    %8.3f%8.3f%8.3f"%("ATOM", i, atom_names[atom], tertiary_structure.rna.sequence[key-1], tertiary_structure.rna.name[0], tertiary_structure.get_residue_label(key), coords[0], coords[1], coords[2]))
             else:
-                lines.append("%-6s%5u  %-4s%3s %s%4u    %8.3f%8.3f%8.3f"%("ATOM", i, atom['name'], tertiary_structure.rna.sequence[key-1], tertiary_structure.rna.name[0], key, atom['coords'][0], atom['coords'][1], atom['coords'][2]))
+                lines.append("%-6s%5u  %-4s%3s %s%4u    %8.3f%8.3f%8.3f"%("ATOM", i, atom_names[atom], tertiary_structure.rna.sequence[key-1], tertiary_structure.rna.name[0], key, coords[0], coords[1], coords[2]))
             i += 1
 
     lines.append("END")
@@ -406,17 +338,33 @@ def to_ct(base_pairs, rna):
     ------
     the CT data as a String
     """
+    import numpy as np
+    length = len(rna)
     lines=["ENERGY"]
-    base_pairs = base_pairs.sort_index(by='pos1') #the base pairs are sorted according to the first position
-    for molecular_pos in range (1, len(rna)+1):
-        if len(base_pairs[base_pairs.pos1 == molecular_pos]):
-            for index, bps in base_pairs[base_pairs.pos1 == molecular_pos].iterrows():
-                lines.append("%i\t%s\t%i\t%i\t%i\t%i"%(molecular_pos, rna.sequence[molecular_pos-1], molecular_pos-1, molecular_pos+1, bps['pos2'], molecular_pos))
-        elif len(base_pairs[base_pairs.pos2 == molecular_pos]):
-            for index, bps in base_pairs[base_pairs.pos2 == molecular_pos].iterrows():
-                lines.append("%i\t%s\t%i\t%i\t%i\t%i"%(molecular_pos, rna.sequence[molecular_pos-1], molecular_pos-1, molecular_pos+1, bps['pos1'], molecular_pos))
-        else:
-            lines.append("%i\t%s\t%i\t%i\t0\t%i"%(molecular_pos, rna.sequence[molecular_pos-1], molecular_pos-1, molecular_pos+1, molecular_pos))
+    if len(base_pairs):
+        order = np.argsort(base_pairs['pos1'].values, kind = 'mergesort') #the base pairs are sorted according to the first position
+        positions1 = base_pairs['pos1'].values[order].astype(np.int64)
+        positions2 = base_pairs['pos2'].values[order].astype(np.int64)
+    else:
+        positions1 = positions2 = np.zeros(0, dtype = np.int64)
+    in_sequence1 = (positions1 >= 1) & (positions1 <= length)
+    in_sequence2 = (positions2 >= 1) & (positions2 <= length)
+    first_positions = np.zeros(length+1, dtype = np.bool_)
+    first_positions[positions1[in_sequence1]] = True
+    second_positions = np.zeros(length+1, dtype = np.bool_)
+    second_positions[positions2[in_sequence2]] = True
+    from_pos2 = in_sequence2 & ~first_positions[np.where(in_sequence2, positions2, 0)] #a residue is described with its base pairs as pos2 only if it has none as pos1
+    unpaired_positions = np.nonzero(~(first_positions | second_positions))[0][1:]
+
+    #one line per base pair (in the order of the sorted base pairs) or per unpaired residue
+    positions = np.concatenate((positions1[in_sequence1], positions2[from_pos2], unpaired_positions))
+    partners = np.concatenate((positions2[in_sequence1], positions1[from_pos2], np.zeros(len(unpaired_positions), dtype = np.int64)))
+    ranks = np.concatenate((np.nonzero(in_sequence1)[0], np.nonzero(from_pos2)[0], np.zeros(len(unpaired_positions), dtype = np.int64)))
+    order = np.lexsort((ranks, positions))
+
+    sequence = rna.sequence
+    for molecular_pos, partner in zip(positions[order].tolist(), partners[order].tolist()):
+        lines.append("%i\t%s\t%i\t%i\t%i\t%i"%(molecular_pos, sequence[molecular_pos-1], molecular_pos-1, molecular_pos+1, partner, molecular_pos))
 
     return '\n'.join(lines)
 
@@ -438,6 +386,89 @@ def to_fasta(molecules, single_line=False):
         outputs.append(molecule.to_fasta(single_line))
     return '\n'.join(outputs)
 
+two_bit_signature = 0x1A412743
+
+def to_2bit(molecules, two_bit_file):
+    """
+    Save DNA molecules in the UCSC 2bit format: 2 bits per base (T, C, A, G), plus the runs of unknown residues (N) and the runs of soft-masked (lower-case) residues. The file can be read with a TwoBitFile object.
+
+    Parameters:
+    ---------
+    - molecules: a list (or a generator, see iter_fasta()) of DNA objects (see pyrna.features). Their names have to be unique and shorter than 256 characters.
+    - two_bit_file: the path of the file to write
+    """
+    import struct, tempfile, shutil
+    names = []
+    record_sizes = []
+    records = tempfile.TemporaryFile() #the offsets of the records are known only when all the molecules have been packed
+    try:
+        for molecule in molecules:
+            if len(molecule.name) > 255:
+                raise Exception("The name %s is too long for the 2bit format"%molecule.name)
+            record = _pack_2bit_record(str(molecule.sequence))
+            names.append(molecule.name)
+            record_sizes.append(len(record))
+            records.write(record)
+
+        with open(two_bit_file, 'wb') as h:
+            h.write(struct.pack('<IIII', two_bit_signature, 0, len(names), 0))
+            offset = 16+sum(1+len(name)+4 for name in names)
+            for name, record_size in zip(names, record_sizes):
+                h.write(struct.pack('<B', len(name))+name+struct.pack('<I', offset))
+                offset += record_size
+            records.seek(0)
+            shutil.copyfileobj(records, h)
+    finally:
+        records.close()
+
+def fasta_to_2bit(fasta_file, two_bit_file):
+    """
+    Convert a Fasta file into a 2bit file without loading the whole genome in memory. The soft-masked residues are kept and each sequence is named with the first word of its header (like in a FastaIndex).
+
+    Parameters:
+    ---------
+    - fasta_file: the path of the Fasta file (compressed with gzip or bzip2 if its name ends with .gz or .bz2)
+    - two_bit_file: the path of the file to write
+    """
+    to_2bit((DNA(sequence = sequence, name = name.split()[0] if name.split() else '') for name, sequence in _iter_fasta_records(fasta_file, upper_case = False)), two_bit_file)
+
+def _get_runs(mask):
+    """
+    Returns:
+    ------
+    the starts (0-based) and the sizes of the runs of True values of a numpy array of booleans
+    """
+    import numpy as np
+    changes = np.diff(np.concatenate(([0], mask.view(np.int8), [0])))
+    starts = np.nonzero(changes == 1)[0]
+    return starts, np.nonzero(changes == -1)[0]-starts
+
+def _pack_2bit_record(sequence):
+    import numpy as np, struct
+    residues = np.frombuffer(sequence, dtype = np.uint8)
+    codes = np.zeros(256, dtype = np.uint8)
+    known = np.zeros(256, dtype = np.bool_)
+    for code, bases in enumerate(['TtUu', 'Cc', 'Aa', 'Gg']):
+        for base in bases:
+            codes[ord(base)] = code
+            known[ord(base)] = True
+    n_starts, n_sizes = _get_runs(~known[residues])
+    mask_starts, mask_sizes = _get_runs((residues >= ord('a')) & (residues <= ord('z')))
+    packed = np.zeros(((len(residues)+3)/4)*4, dtype = np.uint8)
+    packed[:len(residues)] = codes[residues]
+    packed = packed.reshape(-1, 4)
+    packed = (packed[:, 0] << 6) | (packed[:, 1] << 4) | (packed[:, 2] << 2) | packed[:, 3]
+    return ''.join([
+        struct.pack('<II', len(residues), len(n_starts)),
+        n_starts.astype('<u4').tostring(),
+        n_sizes.astype('<u4').tostring(),
+        struct.pack('<I', len(mask_starts)),
+        mask_starts.astype('<u4').tostring(),
+        mask_sizes.astype('<u4').tostring(),
+        struct.pack('<I', 0),
+        packed.tostring()
+    ])
+
 def to_vienna(base_pairs, molecules, single_line=False):
     """
     Convert lists of base pairs and Molecule objects into Vienna data.
@@ -555,52 +586,35 @@ def to_clustalw(base_pairs, molecules, curate = False):
     the clustalw data as a String. The name of the molecules will be non-redundant and will not contain any spaces characters.
     """
 
+    import numpy as np
     sequence_lines = []
     bn = to_bn(base_pairs, len(molecules[0]))
+    labels = []
+    name_counts = {}
+    for molecule in molecules:
+        name = molecule.name.replace(' ', '_') #molecule name without any space
+        labels.append('%s.%i'%(name, name_counts[name]) if name_counts.get(name) else name) #and non-redundant (if already non-redundant, not .0 as suffix)
+        name_counts[name] = name_counts.get(name, 0)+1
+
+    if curate:
+        alignment_matrix = AlignmentMatrix.from_molecules(molecules)
+        gap_columns = (alignment_matrix.matrix == ord('-')).all(axis = 0) #as for Molecule.get_gaps_positions(), only the '-' are gaps
+        curated_matrix = alignment_matrix[:, ~gap_columns]
+        sequences = [curated_matrix.get_sequence(row) for row in xrange(len(curated_matrix))]
+        length = curated_matrix.shape[1]
+    else:
+        sequences = molecules
+        length = len(molecules[0])
+
     c = 0
-    gaps_positions = None
-    while c < len(molecules[0]):
-        names = []
-        for molecule in molecules:
-            if gaps_positions == None: #and not "if not gaps_positions:". The intersection of gap positions could lead to an empty set (no columns to remove in the alignment). And then, such condition would become true and we will restart with a list of positions corresponding to those of the next molecule processed!!
-                gaps_positions = set(molecule.get_gaps_positions())
-            else: #we search the same gap positions
-                gaps_positions = gaps_positions.intersection(molecule.get_gaps_positions())
-            d = min(len(molecule), c + 60)
-            name = molecule.name.replace(' ', '_') #molecule name without any space
-            if names.count(name): #and non-redundant
-                sequence_lines.append('%s.%i'%(name,names.count(name))+"\t"+molecule[c:d]+'\n')
-            else:
-                sequence_lines.append(name+"\t"+molecule[c:d]+'\n')#if already non-redundant, not .0 as suffix
-            names.append(name)
+    while c < length:
+        for label, sequence in zip(labels, sequences):
+            sequence_lines.append(label+"\t"+sequence[c:min(len(sequence), c + 60)]+'\n')
         sequence_lines.append('\n')
         c += 60
 
     if curate:
-        sequence_lines = []
-        chars = list(molecules[0].sequence)
-        for pos in gaps_positions:
-            chars[pos]=""
-        curated_sequence = ''.join(chars)
-
-        c = 0
-        while c < len(curated_sequence):
-            names = []
-            for molecule in molecules:
-                chars = list(molecule.sequence)
-                for pos in gaps_positions:
-                    chars[pos]=""
-                curated_sequence = ''.join(chars)
-                d = min(len(curated_sequence), c + 60)
-                name = molecule.name.replace(' ', '_') #molecule name without any space
-                if names.count(name): #and non-redundant
-                    sequence_lines.append('%s.%i'%(name,names.count(name))+"\t"+curated_sequence[c:d]+'\n')
-                else:
-                    sequence_lines.append(name+"\t"+curated_sequence[c:d]+'\n') #if already non-redundant, not .0 as suffix
-                names.append(name)
-            sequence_lines.append('\n')
-            c += 60
-
+        gaps_positions = set(np.nonzero(gap_columns)[0].tolist())
         chars = list(bn)
 
         i = 0
@@ -638,20 +652,18 @@ def to_bn(base_pairs, length):
     ------
     the bracket notation as a String
     """
-    bn = []
-    if not len(base_pairs): #its a pure single_strand fold
-        for pos in range(1, length+1):
-            bn.append('.')
-    else:
-        for pos in range(1, length+1):
-            if len(base_pairs.pos1[base_pairs.pos1 == pos]) != 0:
-                bn.append(base_pairs[base_pairs.pos1 == pos].edge1.values[0])
-            elif len(base_pairs.pos2[base_pairs.pos2 == pos]) != 0:
-                bn.append(base_pairs[base_pairs.pos2 == pos].edge2.values[0])
-            else:
-                bn.append('.')
-
-    return ''.join(bn)
+    import numpy as np
+    bn = np.empty(length, dtype = object)
+    bn.fill('.')
+    if len(base_pairs): #otherwise its a pure single_strand fold
+        #the edge of the first base pair found for each position, a position described as pos1 taking precedence over a position described as pos2
+        for positions, edges in [(base_pairs['pos2'].values, base_pairs['edge2'].values), (base_pairs['pos1'].values, base_pairs['edge1'].values)]:
+            positions = positions.astype(np.int64)
+            in_sequence = (positions >= 1) & (positions <= length)
+            unique_positions, first_indices = np.unique(positions[in_sequence], return_index = True)
+            bn[unique_positions-1] = edges[in_sequence][first_indices]
+
+    return ''.join(bn.tolist())
 
 def read_counts_to_tsv(file_name, sam_file, chromosome_name, start, end, step = 1, restrict_to_plus_strand = False, restrict_to_minus_strand = False):
     from pyrna.computations import Samtools
@@ -713,7 +725,7 @@ def parse_genbank(genbank_data):
                     if feature['genomicStrand'] == '+':
                         feature['sequence'] = dna.sequence[feature['genomicPositions'][0]-1:feature['genomicPositions'][-1]]
                     else:
-                        feature['sequence'] = DNA(name = dna.name, sequence = dna.sequence[feature['genomicPositions'][0]-1:feature['genomicPositions'][-1]]).get_complement()[::-1]
+                        feature['sequence'] = dna.reverse_complement(feature['genomicPositions'][0]-1, feature['genomicPositions'][-1])
             
             dnas.append((dna,DataFrame(features)))
             
@@ -1161,7 +1173,7 @@ def parse_embl(embl_data):
             if feature['genomicStrand'] == '+':
                 feature['sequence'] = dna.sequence[feature['genomicPositions'][0]-1:feature['genomicPositions'][-1]]
             else:
-                feature['sequence'] = DNA(name = dna.name, sequence = dna.sequence[feature['genomicPositions'][0]-1:feature['genomicPositions'][-1]]).get_complement()[::-1]
+                feature['sequence'] = dna.reverse_complement(feature['genomicPositions'][0]-1, feature['genomicPositions'][-1])
 
     return dna, DataFrame(features)
 
@@ -1266,7 +1278,7 @@ def parse_rnaml(rnaml_data, canonical_only = False):
     return secondary_structures
 
 
-def parse_fasta(fasta_data, type='RNA'):
+def parse_fasta(fasta_data, type='RNA', compact = False):
     """
     Parse FASTA data
 
@@ -1274,42 +1286,343 @@ def parse_fasta(fasta_data, type='RNA'):
     ---------
     - fasta_data: the Fasta data as a String
     - type (default: 'RNA'): can be equal to 'DNA' or 'RNA'
+    - compact (default: False): if True, the molecules will be CompactMolecule objects sharing a single sequence buffer (see pyrna.features)
 
     Returns:
     ------
     a list of RNA, DNA or Protein objects (according to the value of the parameter type) (see pyrna.features)
     """
-    molecules = []
-    pieces = []
-    molecule_name = None
-    for line in fasta_data.split('\n'):
-        if re.match('>',line):
-            if molecule_name and len(pieces) > 0:
-                if type == 'RNA':
-                    m = RNA(sequence = ''.join(pieces), name = molecule_name.strip())
-                elif type == 'DNA':
-                    m = DNA(sequence = ''.join(pieces), name = molecule_name.strip())
-                elif type == 'Protein':
-                    m = Protein(sequence = ''.join(pieces), name = molecule_name.strip())
-                    if ''.join(pieces) != m.sequence:
-                        sys.exit()
-                if m != None:
-                    molecules.append(m)
-            molecule_name = line[1:]
-            pieces = []
-        else:
-            pieces.append(line.strip().upper())
-    #last molecule
-    if molecule_name and len(pieces) > 0:
+    if compact:
+        names = []
+        sequences = []
+        for name, sequence in _iter_fasta_records(_iter_lines(fasta_data)):
+            names.append(name)
+            sequences.append(sequence)
+        return make_compact_molecules(names, sequences, type)
+
+    return list(iter_fasta(_iter_lines(fasta_data), type))
+
+def iter_fasta(path_or_handle, type='DNA'):
+    """
+    Parse FASTA data one molecule at a time. Only the lines of the current molecule are kept in memory.
+
+    Parameters:
+    ---------
+    - path_or_handle: the path of a Fasta file (compressed with gzip or bzip2 if its name ends with .gz or .bz2) or a file-like object
+    - type (default: 'DNA'): can be equal to 'DNA', 'RNA' or 'Protein'
+
+    Returns:
+    ------
+    a generator of RNA, DNA or Protein objects (according to the value of the parameter type) (see pyrna.features)
+    """
+    for name, sequence in _iter_fasta_records(path_or_handle):
+        m = None
         if type == 'RNA':
-            m = RNA(sequence = ''.join(pieces), name = molecule_name.strip())
+            m = RNA(sequence = sequence, name = name)
         elif type == 'DNA':
-            m = DNA(sequence = ''.join(pieces), name = molecule_name.strip())
+            m = DNA(sequence = sequence, name = name)
         elif type == 'Protein':
-            m = Protein(sequence = ''.join(pieces), name = molecule_name.strip())
+            m = Protein(sequence = sequence, name = name)
+            if sequence != m.sequence:
+                sys.exit()
         if m != None:
-            molecules.append(m)
-    return molecules
+            yield m
+
+def _iter_lines(data):
+    """
+    Returns:
+    ------
+    a generator of the lines of a String (str or unicode) ending with their '\n', like the lines of a file. Unlike splitlines(), only '\n' ends a line.
+    """
+    lines = data.split('\n')
+    for line in lines[:-1]:
+        yield line+'\n'
+    if len(lines[-1]):
+        yield lines[-1]
+
+def _open_file(path_or_handle):
+    """
+    Returns:
+    ------
+    a tuple containing a buffered file-like object and a boolean telling if it has been opened here (and then has to be closed by the caller)
+    """
+    if not isinstance(path_or_handle, basestring):
+        return path_or_handle, False
+    if path_or_handle.endswith('.gz'):
+        import gzip, io
+        return io.BufferedReader(gzip.open(path_or_handle, 'rb')), True
+    if path_or_handle.endswith('.bz2'):
+        import bz2
+        return bz2.BZ2File(path_or_handle, 'rb'), True
+    return open(path_or_handle, 'rb'), True
+
+def _iter_fasta_records(path_or_handle, upper_case = True):
+    """
+    Returns:
+    ------
+    a generator of tuples (name, sequence). A molecule is skipped if no line follows its header. If upper_case is False, the soft-masked (lower-case) residues are kept.
+    """
+    handle, opened = _open_file(path_or_handle)
+    try:
+        molecule_name = None
+        pieces = []
+        line = ''
+        for line in handle:
+            if line.startswith('>'):
+                if molecule_name and len(pieces) > 0:
+                    yield molecule_name.strip(), ''.join(pieces)
+                molecule_name = line[1:].rstrip('\n')
+                pieces = []
+            else:
+                pieces.append(line.strip().upper() if upper_case else line.strip())
+        #last molecule (a final newline counts as an empty sequence line)
+        if molecule_name and (len(pieces) > 0 or line.endswith('\n')):
+            yield molecule_name.strip(), ''.join(pieces)
+    finally:
+        if opened:
+            handle.close()
+
+class FastaIndex(object):
+    """
+    Random access to the sequences of a Fasta file through a faidx-compatible index (.fai). The file is memory-mapped and only the residues requested are read.
+    """
+
+    def __init__(self, fasta_file, index_file = None):
+        """
+        Parameters:
+        ---------
+        - fasta_file: the path of an uncompressed Fasta file. All the sequence lines of an entry must have the same length (except the last one).
+        - index_file (default: None): the path of the .fai file. If None, fasta_file+'.fai' is used. If this file doesn't exist, the index is computed and saved (if possible).
+        """
+        import os, mmap
+        self.fasta_file = fasta_file
+        self.index_file = index_file if index_file else fasta_file+'.fai'
+        self.entries = {}
+        self.names = []
+        if os.path.exists(self.index_file):
+            self.__read_index()
+        else:
+            self.__build_index()
+            try:
+                self.__write_index()
+            except IOError:
+                pass
+        self.__handle = open(fasta_file, 'rb')
+        if os.path.getsize(fasta_file):
+            self.__data = mmap.mmap(self.__handle.fileno(), 0, access = mmap.ACCESS_READ)
+        else:
+            self.__data = ''
+
+    def __read_index(self):
+        with open(self.index_file) as h:
+            for line in h:
+                tokens = line.rstrip('\r\n').split('\t')
+                if len(tokens) >= 5:
+                    self.names.append(tokens[0])
+                    self.entries[tokens[0]] = tuple(int(token) for token in tokens[1:5])
+
+    def __write_index(self):
+        with open(self.index_file, 'w') as h:
+            for name in self.names:
+                h.write('%s\t%i\t%i\t%i\t%i\n'%((name,)+self.entries[name]))
+
+    def __build_index(self):
+        """
+        Computes for each entry its length, the offset of its first residue, the number of residues per line and the number of bytes per line
+        """
+        entry = None
+        offset = 0
+        with open(self.fasta_file, 'rb') as h:
+            for line in h:
+                if line.startswith('>'):
+                    if entry:
+                        self.__add_entry(*entry[:5])
+                    entry = [line[1:].split()[0] if line[1:].split() else '', 0, offset+len(line), 0, 0, False] #name, length, offset, line bases, line width, last line seen
+                elif entry:
+                    bases = len(line.rstrip('\r\n'))
+                    if bases:
+                        if entry[5]:
+                            raise Exception("The sequence lines of %s don't have the same length"%entry[0])
+                        if not entry[3]:
+                            entry[3], entry[4] = bases, len(line)
+                        elif bases > entry[3] or len(line)-bases != entry[4]-entry[3]:
+                            raise Exception("The sequence lines of %s don't have the same length"%entry[0])
+                        entry[5] = bases < entry[3]
+                        entry[1] += bases
+                    else:
+                        entry[5] = True #only empty lines can follow
+                offset += len(line)
+        if entry:
+            self.__add_entry(*entry[:5])
+
+    def __add_entry(self, name, length, offset, line_bases, line_width):
+        if self.entries.has_key(name):
+            raise Exception("The name %s is used several times"%name)
+        self.names.append(name)
+        self.entries[name] = (length, offset, line_bases, line_width)
+
+    def __contains__(self, name):
+        return self.entries.has_key(name)
+
+    def __len__(self):
+        return len(self.names)
+
+    def get_length(self, name):
+        return self.entries[name][0]
+
+    def fetch(self, name, start = 1, end = None, strand = '+', type = None):
+        """
+        Parameters:
+        ---------
+        - name: the name of the sequence (the first word of its header)
+        - start (default: 1): the first position (1-based)
+        - end (default: None): the last position (included). If None, the end of the sequence.
+        - strand (default: '+'): if '-', the reverse complement is returned
+        - type (default: None): can be equal to 'DNA' or 'RNA' to get a DNA or RNA object (see pyrna.features). If None, the sequence is returned as a String.
+
+        Returns:
+        ------
+        the sequence (upper-cased) between start and end
+        """
+        if not self.entries.has_key(name):
+            raise Exception("No sequence named %s in %s"%(name, self.fasta_file))
+        length, offset, line_bases, line_width = self.entries[name]
+        start = max(start, 1)
+        end = length if end is None else min(end, length)
+        sequence = ''
+        if end >= start:
+            first_byte = offset+(start-1)/line_bases*line_width+(start-1)%line_bases
+            last_byte = offset+(end-1)/line_bases*line_width+(end-1)%line_bases
+            sequence = self.__data[first_byte:last_byte+1].translate(None, '\r\n').upper()
+        if strand == '-':
+            sequence = complement_sequence(sequence, dna_complement_table)[::-1]
+        if type == 'DNA':
+            return DNA(sequence = sequence, name = name)
+        elif type == 'RNA':
+            return RNA(sequence = sequence, name = name)
+        return sequence
+
+    def close(self):
+        if not isinstance(self.__data, str):
+            self.__data.close()
+        self.__handle.close()
+
+class TwoBitFile(object):
+    """
+    Random access to the sequences of a UCSC 2bit file (see to_2bit()). The file is memory-mapped and only the bytes of the residues requested are unpacked.
+    """
+
+    def __init__(self, two_bit_file):
+        """
+        Parameters:
+        ---------
+        - two_bit_file: the path of the 2bit file
+        """
+        import os, mmap, struct
+        import numpy as np
+        self.two_bit_file = two_bit_file
+        self.__handle = open(two_bit_file, 'rb')
+        self.__data = mmap.mmap(self.__handle.fileno(), 0, access = mmap.ACCESS_READ) if os.path.getsize(two_bit_file) else ''
+        if len(self.__data) >= 16 and struct.unpack('<I', self.__data[:4])[0] == two_bit_signature:
+            self.__byte_order = '<'
+        elif len(self.__data) >= 16 and struct.unpack('>I', self.__data[:4])[0] == two_bit_signature:
+            self.__byte_order = '>'
+        else:
+            self.close()
+            raise Exception("%s is not a 2bit file"%two_bit_file)
+        version, count, reserved = struct.unpack(self.__byte_order+'III', self.__data[4:16])
+
+        self.names = []
+        self.offsets = {}
+        position = 16
+        for i in xrange(count):
+            size = ord(self.__data[position])
+            name = self.__data[position+1:position+1+size]
+            self.names.append(name)
+            self.offsets[name] = struct.unpack(self.__byte_order+'I', self.__data[position+1+size:position+5+size])[0]
+            position += 5+size
+        self.__records = {}
+
+        #the 4 residues coded by each byte
+        self.__residues = np.array([[ord('TCAG'[(byte >> shift) & 3]) for shift in (6, 4, 2, 0)] for byte in xrange(256)], dtype = np.uint8)
+
+    def __get_record(self, name):
+        """
+        Returns:
+        ------
+        a tuple containing the length of the sequence, the starts and ends of the runs of Ns, the starts and ends of the soft-masked runs and the offset of the packed residues
+        """
+        import numpy as np
+        if not self.offsets.has_key(name):
+            raise Exception("No sequence named %s in %s"%(name, self.two_bit_file))
+        if not self.__records.has_key(name):
+            integers = np.dtype(self.__byte_order+'u4')
+            offset = self.offsets[name]
+            length, n_count = np.frombuffer(self.__data, dtype = integers, count = 2, offset = offset)
+            n_blocks = np.frombuffer(self.__data, dtype = integers, count = 2*n_count, offset = offset+8).astype(np.int64)
+            offset += 8+8*n_count
+            mask_count = np.frombuffer(self.__data, dtype = integers, count = 1, offset = offset)[0]
+            mask_blocks = np.frombuffer(self.__data, dtype = integers, count = 2*mask_count, offset = offset+4).astype(np.int64)
+            offset += 4+8*mask_count+4
+            self.__records[name] = (int(length), n_blocks[:n_count], n_blocks[:n_count]+n_blocks[n_count:], mask_blocks[:mask_count], mask_blocks[:mask_count]+mask_blocks[mask_count:], offset)
+        return self.__records[name]
+
+    def __contains__(self, name):
+        return self.offsets.has_key(name)
+
+    def __len__(self):
+        return len(self.names)
+
+    def get_length(self, name):
+        return self.__get_record(name)[0]
+
+    def fetch(self, name, start = 1, end = None, strand = '+', type = None, soft_masking = False):
+        """
+        Parameters:
+        ---------
+        - name: the name of the sequence
+        - start (default: 1): the first position (1-based)
+        - end (default: None): the last position (included). If None, the end of the sequence.
+        - strand (default: '+'): if '-', the reverse complement is returned
+        - type (default: None): can be equal to 'DNA' or 'RNA' to get a DNA or RNA object (see pyrna.features). If None, the sequence is returned as a String.
+        - soft_masking (default: False): if True, the soft-masked residues are in lower-case
+
+        Returns:
+        ------
+        the sequence between start and end
+        """
+        import numpy as np
+        length, n_starts, n_ends, mask_starts, mask_ends, offset = self.__get_record(name)
+        start = max(start, 1)-1
+        end = length if end is None else min(end, length)
+        sequence = ''
+        if end > start:
+            packed = np.frombuffer(self.__data, dtype = np.uint8, count = (end-1)/4-start/4+1, offset = offset+start/4)
+            residues = self.__residues[packed].ravel()[start%4:start%4+end-start]
+            for i in xrange(np.searchsorted(n_ends, start, side = 'right'), len(n_starts)):
+                if n_starts[i] >= end:
+                    break
+                residues[max(n_starts[i], start)-start:min(n_ends[i], end)-start] = ord('N')
+            if soft_masking:
+                for i in xrange(np.searchsorted(mask_ends, start, side = 'right'), len(mask_starts)):
+                    if mask_starts[i] >= end:
+                        break
+                    residues[max(mask_starts[i], start)-start:min(mask_ends[i], end)-start] |= 0x20 #lower-case
+            sequence = residues.tostring()
+        if strand == '-':
+            sequence = complement_sequence(sequence, soft_masked_dna_complement_table)[::-1]
+        if type == 'DNA':
+            return DNA(sequence = sequence, name = name)
+        elif type == 'RNA':
+            return RNA(sequence = sequence, name = name)
+        return sequence
+
+    def close(self):
+        if not isinstance(self.__data, str):
+            self.__data.close()
+        self.__handle.close()
+
+soft_masked_dna_complement_table = make_complement_table({'A': 'T', 'C': 'G', 'G': 'C', 'T': 'A', 'a': 't', 'c': 'g', 'g': 'c', 't': 'a'})
 
 def parse_vienna(vienna_data):
     """
@@ -1361,37 +1674,106 @@ def parse_bn(bn):
     ------
     a pandas Dataframe listing the base pairs. Returns an empty Dataframe if no base-pairs are found.
     """
+    import numpy as np
+    pos1, pos2, edges1, edges2 = parse_bn_arrays(bn)
+
+    if len(pos1):
+        return DataFrame({
+            'orientation': 'c',
+            'edge1': edges1.view('S1').astype(object),
+            'edge2': edges2.view('S1').astype(object),
+            'pos1': pos1.astype(np.int64),
+            'pos2': pos2.astype(np.int64)
+        }, columns=['orientation', 'edge1', 'edge2', 'pos1', 'pos2'])
+    else:
+        return DataFrame()
 
-    i = 0
-    lastPairedPos = []
-    lastPairedSymbol = []
-    basePairs = []
+def parse_bn_arrays(bn):
+    """
+    Parse a bracket notation without creating a pandas Dataframe (see parse_bn()).
 
-    for s in list(bn):
-        i+=1
-        if s in ['(','{','[']:
-            lastPairedPos.append(i)
-            lastPairedSymbol.append(s)
-        elif s in [')','}',']']:
-            basePairs.append(['c', lastPairedSymbol.pop(), s, lastPairedPos.pop(), i])
+    Parameters:
+    ---------
+     - bn: the bracket notation as a String
 
-    if len(basePairs):
-        return DataFrame(basePairs, columns=['orientation', 'edge1', 'edge2', 'pos1', 'pos2'])
-    else:
-        return DataFrame()
+    Returns:
+    ------
+    a tuple of numpy arrays listing the base pairs in the order of their closing brackets:
+    - pos1 and pos2 (int32)
+    - the codes of the opening and closing brackets (uint8, chr() gives the symbols)
+    """
+    import numpy as np
+    codes = _get_bn_codes([bn])
+    rows, pos1, pos2 = _pair_brackets(codes)
+    return (pos1+1).astype(np.int32), (pos2+1).astype(np.int32), codes[0, pos1], codes[0, pos2]
+
+def parse_bn_many(bns):
+    """
+    Parse several bracket notations of the same length (like suboptimal or sampled structures) at once.
+
+    Parameters:
+    ---------
+     - bns: the bracket notations as a list of Strings
+
+    Returns:
+    ------
+    a pair table as an int32 numpy array of shape (structures count, length): the item [i, pos-1] is the position paired with pos in the structure i (0 if pos is unpaired)
+    """
+    import numpy as np
+    codes = _get_bn_codes(bns)
+    rows, pos1, pos2 = _pair_brackets(codes)
+    pair_table = np.zeros(codes.shape, dtype = np.int32)
+    pair_table[rows, pos1] = pos2+1
+    pair_table[rows, pos2] = pos1+1
+    return pair_table
+
+def _get_bn_codes(bns):
+    import numpy as np
+    bns = [bn.encode('ascii', 'replace') if isinstance(bn, unicode) else bn for bn in bns]
+    length = len(bns[0]) if bns else 0
+    for bn in bns:
+        if len(bn) != length:
+            raise Exception("The bracket notations have different lengths")
+    return np.frombuffer(''.join(bns), dtype = np.uint8).reshape(len(bns), length)
+
+def _pair_brackets(codes):
+    """
+    Pair the brackets of each row of a 2D numpy array of characters codes. Like in a single stack shared by all the bracket types, a closing bracket is paired with the last unpaired opening bracket.
 
-def parse_clustalw(clustalw_data):
+    Returns:
+    ------
+    the rows, the opening and the closing positions (0-based) of the base pairs as numpy arrays, sorted by row and closing position
+    """
+    import numpy as np
+    opening = (codes == ord('(')) | (codes == ord('[')) | (codes == ord('{'))
+    closing = (codes == ord(')')) | (codes == ord(']')) | (codes == ord('}'))
+    rows, positions = np.nonzero(opening | closing)
+    steps = np.where(opening[rows, positions], 1, -1)
+    #the depth reached after each bracket: an opening bracket and its closing bracket are at the same level and follow each other at this level
+    depths = np.cumsum(opening.astype(np.int32)-closing, axis = 1)[rows, positions]
+    levels = depths+(steps < 0)
+    if (levels < 1).any():
+        raise Exception("Unbalanced bracket notation")
+    order = np.lexsort((positions, levels, rows))
+    sorted_steps = steps[order]
+    pairs = np.nonzero((sorted_steps[:-1] > 0) & (sorted_steps[1:] < 0))[0]
+    rows, pos1, pos2 = rows[order[pairs]], positions[order[pairs]], positions[order[pairs+1]]
+    order = np.lexsort((pos2, rows))
+    return rows[order], pos1[order], pos2[order]
+
+def parse_clustalw(clustalw_data, alignment_matrix = False):
     """
     Parse Clustalw data
 
     Parameters:
     ---------
      - clustalw_data: the Clustalw data as a String
+     - alignment_matrix (default: False): if True, the aligned molecules are returned as an AlignmentMatrix object (see pyrna.features)
 
     Returns:
     ------
     a tuple containing:
-    - a list of gapped or ungapped RNA objects
+    - a list of gapped or ungapped RNA objects (or an AlignmentMatrix object)
     - a pandas Dataframe listing the paired positions of consensus secondary structure)
     """
 
@@ -1408,56 +1790,123 @@ def parse_clustalw(clustalw_data):
 
     rnas = []
 
+    if alignment_matrix:
+        keys = alignedSequences.keys()
+        rnas = make_compact_molecules(keys, [alignedSequences[key] for key in keys]) #the sequences are normalized like those of the RNA objects
+        return AlignmentMatrix.from_molecules(rnas), parse_bn(bn)
+
     for key in alignedSequences:
         rna = RNA(name=key, sequence=alignedSequences[key])
         rnas.append(rna)
 
     return rnas, parse_bn(bn)
 
-def parse_stockholm(stockholm_data):
+def parse_stockholm(stockholm_data, compact = False, alignment_matrix = False):
     """
     Parse Stokholm data
 
     Parameters:
     ---------
      - stockholm_data: the Stockholm data as a String
+     - compact (default: False): if True, the aligned molecules will be CompactRNA objects sharing a single sequence buffer (see pyrna.features)
+     - alignment_matrix (default: False): if True, the aligned molecules are returned as an AlignmentMatrix object (see pyrna.features)
 
     Returns:
     ------
     a tuple containing:
+    - a list of gapped or ungapped RNA objects (or an AlignmentMatrix object)
+    - a dict of organism names (keys)  and accession numbers/start-end (values)
+    - a pandas Dataframe listing the paired positions of the consensus secondary structure)
+    """
+    for family in _iter_stockholm_families(stockholm_data.strip().split('\n'), split_families = False):
+        return _make_stockholm_family(*family, compact = compact, alignment_matrix = alignment_matrix)[1:]
+
+def iter_stockholm(path_or_handle, compact = False):
+    """
+    Parse Stockholm data describing several families (like the files Rfam.seed or Rfam.full) in a single pass, one family at a time.
+
+    Parameters:
+    ---------
+     - path_or_handle: the path of a Stockholm file (compressed with gzip or bzip2 if its name ends with .gz or .bz2) or a file-like object
+     - compact (default: False): if True, the aligned molecules of a family will be CompactRNA objects sharing a single sequence buffer (see pyrna.features)
+
+    Returns:
+    ------
+    a generator of tuples (one per family) containing:
+    - the accession number of the family (None if there is no #=GF AC line)
     - a list of gapped or ungapped RNA objects
     - a dict of organism names (keys)  and accession numbers/start-end (values)
     - a pandas Dataframe listing the paired positions of the consensus secondary structure)
     """
-    alignedSequences = {}
-    organisms={}
-    aligned2D = ""
+    handle, opened = _open_file(path_or_handle)
+    try:
+        for family in _iter_stockholm_families(handle):
+            yield _make_stockholm_family(*family, compact = compact)
+    finally:
+        if opened:
+            handle.close()
+
+def _iter_stockholm_families(lines, split_families = True):
+    """
+    Returns:
+    ------
+    a generator of tuples (accession number, dict of aligned sequences, dict of organisms, consensus 2D in bracket notation), one per family. The pieces of the aligned sequences are accumulated in lists. If split_families is False, all the lines describe a single family.
+    """
+    aligned_sequences = {}
+    organisms = {}
+    aligned2D = []
     rfam_id = None
-    lines = stockholm_data.strip().split('\n')
     for line in lines:
-        tokens = re.split('\s+', line)
-        if len(line) != 0 and not re.match('^#', line) and len(tokens) == 2:
-            if alignedSequences.has_key(tokens[0]):
-                alignedSequences[tokens[0]] = alignedSequences[tokens[0]]+tokens[1]
-            else:
-                alignedSequences[tokens[0]] = tokens[1]
-        elif len(line) != 0 and re.match('^#=GC SS_cons', line):
-            aligned2D += re.sub('>', ')', re.sub('<', '(', tokens[2]))
-        elif len(line) != 0 and re.match('^#=GF AC', line):
-            rfam_id = tokens[2].strip()
-        elif len(line) != 0 and re.match('^#=GS', line):
-            organisms[tokens[1]] = tokens[-1]
+        if not len(line):
+            continue
+        elif line.startswith('#'):
+            if line.startswith('#=GC SS_cons'):
+                aligned2D.append(line.split()[2])
+            elif line.startswith('#=GF AC'):
+                rfam_id = line.split()[2].strip()
+            elif line.startswith('#=GS'):
+                tokens = line.split()
+                organisms[tokens[1]] = tokens[-1]
+        elif split_families and line.startswith('//'):
+            yield rfam_id, aligned_sequences, organisms, ''.join(aligned2D)
+            aligned_sequences = {}
+            organisms = {}
+            aligned2D = []
+            rfam_id = None
+        else:
+            tokens = line.split()
+            if len(tokens) == 2:
+                pieces = aligned_sequences.get(tokens[0])
+                if pieces is None:
+                    aligned_sequences[tokens[0]] = [tokens[1]]
+                else:
+                    pieces.append(tokens[1])
+    if not split_families or aligned_sequences or organisms or aligned2D or rfam_id:
+        yield rfam_id, aligned_sequences, organisms, ''.join(aligned2D)
 
-    rnas = []
+def _make_stockholm_family(rfam_id, aligned_sequences, organisms, aligned2D, compact = False, alignment_matrix = False):
+    """
+    Returns:
+    ------
+    a tuple (accession number, RNA objects or AlignmentMatrix object, organisms, consensus 2D as a pandas Dataframe)
+    """
+    consensus2D = parse_bn(aligned2D.replace('<', '(').replace('>', ')'))
+    keys = aligned_sequences.keys()
+    sequences = [''.join(aligned_sequences[key]) for key in keys]
+    if compact or alignment_matrix:
+        compact_rnas = make_compact_molecules(keys, sequences)
+    if alignment_matrix:
+        return (rfam_id, AlignmentMatrix.from_molecules(compact_rnas), organisms, consensus2D)
 
-    for key in alignedSequences:
-        rna = RNA(name=key, sequence=alignedSequences[key])
+    rnas = []
+    for i, key in enumerate(keys):
+        rna = compact_rnas[i] if compact else RNA(name=key, sequence=sequences[i])
         if rfam_id:
             rna.source = 'db:rfam:'+rfam_id
         if not key.split('/') == 2:
             rna.organism = key
         rnas.append(rna)
-    return (rnas, organisms, parse_bn(aligned2D))
+    return (rfam_id, rnas, organisms, consensus2D)
 
 def parse_pdb(pdb_data):
     """
@@ -1471,79 +1920,151 @@ def parse_pdb(pdb_data):
     ------
     a list of TertiaryStructure objects (see pyrna.features). if the PDB data describes a tertiary structure made with several molecular chains, this method will return one TertiaryStructure object per chain.
     """
-    molecules = []
-    chains = []
-    tertiary_structures = []
-    current_chain = None
-    current_residue = None
-    current_residue_pos = None
-    absolute_position = -1
-    current_molecule = None
-    residues = []
-    current_3D = None
-    title = "N.A."
-
-    for line in pdb_data.split('\n'):
-        header = line[0:6].strip()
-        atom_name = line[12:16].strip()
-        residue_name = line[17:20].strip().upper()
-        chain_name = line[21:22].strip()
-        residue_pos = line[22:27].strip()
-
-        if (header == "ATOM" or header == "HETATM") and not residue_name in ["FMN","PRF","HOH","MG","OHX","MN","ZN", "SO4", "CA", "UNK", "AMO"] and not atom_name in ["MG","K", "NA", "SR", "CL", "CD", "ACA"] and len(chain_name):
-            if chain_name != current_chain: #new chain
-                current_residue = residue_name
-                current_residue_pos = residue_pos
-                current_chain = chain_name
-                absolute_position = 1
+    return list(iter_pdb(_iter_lines(pdb_data)))
+
+excluded_pdb_residues = set(["FMN","PRF","HOH","MG","OHX","MN","ZN", "SO4", "CA", "UNK", "AMO"])
+excluded_pdb_atoms = set(["MG","K", "NA", "SR", "CL", "CD", "ACA"])
+
+def iter_pdb(path_or_handle, chains = None, models = None):
+    """
+    Parse PDB data one tertiary structure at a time. The lines are read one by one and the coordinates of the atoms of a structure are converted at once into a numpy array when the structure is complete.
+
+    Parameters:
+    ---------
+     - path_or_handle: the path of a PDB file (compressed with gzip or bzip2 if its name ends with .gz or .bz2) or a file-like object
+     - chains (default: None): the names of the chains to parse. If None, all the chains are parsed.
+     - models (default: None): the numbers of the models to parse (data without MODEL records contain the model 1). If None, all the models are parsed.
+
+    Returns:
+    ------
+    a generator of TertiaryStructure objects (see pyrna.features), one per chain and per model
+    """
+    import numpy as np
+    handle, opened = _open_file(path_or_handle)
+
+    def complete(tertiary_structure, molecule, atoms_names, absolute_positions, coordinates):
+        #returns the tertiary structure if it describes an RNA or a protein
+        if molecule is None:
+            return None
+        text = ''.join(coordinates)
+        if isinstance(text, unicode): #the coordinates are ASCII (any other character can't be converted into a float anyway)
+            text = text.encode('ascii', 'replace')
+        if len(text) != 24*len(coordinates): #short lines
+            text = ''.join([c.ljust(24) for c in coordinates])
+        tertiary_structure.add_atoms(atoms_names, absolute_positions, np.frombuffer(text, dtype = 'S8').astype(np.float64).reshape(-1, 3))
+        return tertiary_structure
+
+    try:
+        model = 1
+        model_parsed = models is None or 1 in models
+        current_chain = None
+        current_residue = None
+        current_residue_pos = None
+        absolute_position = -1
+        current_molecule = None
+        residues = []
+        current_3D = None
+        atoms_names, absolute_positions, coordinates = [], [], []
+        title = "N.A."
+
+        for line in handle:
+            header = line[0:6].strip()
+
+            if header == "ATOM" or header == "HETATM":
+                if not model_parsed:
+                    continue
+                atom_name = line[12:16].strip()
+                residue_name = line[17:20].strip().upper()
+                chain_name = line[21:22].strip()
+                if residue_name in excluded_pdb_residues or atom_name in excluded_pdb_atoms or not len(chain_name):
+                    continue
+                if chains is not None and not chain_name in chains:
+                    if current_chain is not None and chain_name != current_chain: #the current chain is interrupted
+                        tertiary_structure = complete(current_3D, current_molecule, atoms_names, absolute_positions, coordinates)
+                        if tertiary_structure:
+                            yield tertiary_structure
+                        current_chain = None
+                    continue
+                residue_pos = line[22:27].strip()
+
+                if chain_name != current_chain: #new chain
+                    if current_chain is not None:
+                        tertiary_structure = complete(current_3D, current_molecule, atoms_names, absolute_positions, coordinates)
+                        if tertiary_structure:
+                            yield tertiary_structure
+                    current_residue = residue_name
+                    current_residue_pos = residue_pos
+                    current_chain = chain_name
+                    absolute_position = 1
+                    residues = []
+                    current_molecule = None
+                    residues.append(current_residue)
+                    current_3D = TertiaryStructure(current_molecule)
+                    current_3D.title = re.sub(' +', ' ', title)
+                    current_3D.numbering_system[str(absolute_position)] = current_residue_pos
+                    atoms_names, absolute_positions, coordinates = [], [], []
+
+                elif current_residue_pos != residue_pos: # new residue
+                    current_residue = residue_name
+                    current_residue_pos = residue_pos
+                    if current_molecule:
+                        current_molecule.add_residue(current_residue)
+                    else:
+                        residues.append(current_residue)
+                    absolute_position += 1
+                    current_3D.numbering_system[str(absolute_position)] = current_residue_pos
+
+                atoms_names.append(atom_name)
+                absolute_positions.append(absolute_position)
+                coordinates.append(line[30:54])
+
+                if current_molecule is None and (atom_name == "O4'" or atom_name == "O4*"):
+                    current_molecule = RNA(sequence="", name = current_chain)
+                    current_3D.rna = current_molecule
+                    for residue in residues:
+                        current_molecule.add_residue(current_residue)
+
+                elif current_molecule is None and atom_name == "CA":
+                    current_molecule = Protein(sequence="", name = current_chain)
+                    current_3D.rna = current_molecule
+                    for residue in residues:
+                        current_molecule.add_residue(current_residue)
+
+            elif header == 'TITLE':
+                title += line[10:].rstrip('\n')
+
+            elif header == "TER" or header == "ENDMDL":
+                if current_chain is not None:
+                    tertiary_structure = complete(current_3D, current_molecule, atoms_names, absolute_positions, coordinates)
+                    if tertiary_structure:
+                        yield tertiary_structure
+                current_chain = None
+                current_residue_pos = None
+                current_molecule = None
                 residues = []
+
+            elif header == "MODEL":
+                if current_chain is not None: #no ENDMDL record
+                    tertiary_structure = complete(current_3D, current_molecule, atoms_names, absolute_positions, coordinates)
+                    if tertiary_structure:
+                        yield tertiary_structure
+                current_chain = None
+                current_residue_pos = None
                 current_molecule = None
-                residues.append(current_residue)
-                current_3D = TertiaryStructure(current_molecule)
-                current_3D.title = re.sub(' +', ' ', title)
-                current_3D.numbering_system[str(absolute_position)] = current_residue_pos
-
-            elif current_residue_pos != residue_pos: # new residue
-                current_residue = residue_name
-                current_residue_pos = residue_pos
-                if current_molecule:
-                    current_molecule.add_residue(current_residue)
-                else:
-                    residues.append(current_residue)
-                absolute_position += 1
-                current_3D.numbering_system[str(absolute_position)] = current_residue_pos
-
-            x = float(line[30:38].strip())
-            y = float(line[38:46].strip())
-            z = float(line[46:54].strip())
-            current_3D.add_atom(atom_name, absolute_position, [x,y,z])
-
-            if (atom_name == "O4'" or atom_name == "O4*") and not current_molecule in molecules:
-                current_molecule = RNA(sequence="", name = current_chain)
-                current_3D.rna = current_molecule
-                for residue in residues:
-                    current_molecule.add_residue(current_residue)
-                molecules.append(current_molecule)
-                tertiary_structures.append(current_3D)
-
-            elif (atom_name == "CA") and not current_molecule in molecules:
-                current_molecule = Protein(sequence="", name = current_chain)
-                current_3D.rna = current_molecule
-                for residue in residues:
-                    current_molecule.add_residue(current_residue)
-                molecules.append(current_molecule)
-                tertiary_structures.append(current_3D)
-
-        elif header == 'TITLE':
-            title += line[10:]
-
-        elif header == "TER":
-            current_chain = None
-            current_residue_pos = None
-            current_molecule = None
-            residues = []
-
-    return tertiary_structures
+                residues = []
+                try:
+                    model = int(line[10:14])
+                except ValueError:
+                    model += 1
+                model_parsed = models is None or model in models
+
+        if current_chain is not None:
+            tertiary_structure = complete(current_3D, current_molecule, atoms_names, absolute_positions, coordinates)
+            if tertiary_structure:
+                yield tertiary_structure
+    finally:
+        if opened:
+            handle.close()
 
 def parse_sam(sam_file):
     """
@@ -1,5 +1,5 @@
 import uuid, string, random, datetime, difflib,commands
-import math, re
+import math, re, itertools
 from features import RNA, DNA
 from bson.objectid import ObjectId
 from distutils.spawn import find_executable
@@ -166,6 +166,31 @@ def is_canonical(residue_1, residue_2, orientation, edge_1, edge_2):
             residue_1.upper() == 'G' and residue_2.upper() == 'U' or residue_1.upper() == 'U' and residue_2.upper() == 'G') and\
             orientation.lower() == 'c' and edge_1.upper() == '(' and edge_2.upper() == ')'
 
+canonical_pairs_table = None
+
+def get_canonical_mask(residues_1, residues_2, orientations, edges_1, edges_2):
+    """
+    Check several base pairs at once (see is_canonical()).
+
+    Parameters:
+    ---------
+    - residues_1, residues_2: the codes of the paired residues as numpy arrays of uint8 (like numpy.frombuffer(sequence, dtype = numpy.uint8))
+    - orientations, edges_1, edges_2: the orientations and edges of the base pairs as lists of Strings
+
+    Returns:
+    ------
+    a numpy array of booleans, True for the canonical base pairs
+    """
+    import numpy as np
+    global canonical_pairs_table
+    if canonical_pairs_table is None: #the pairs of residue codes (lower or upper case) making a canonical base pair
+        canonical_pairs_table = np.zeros((256, 256), dtype = np.bool_)
+        for residue_1, residue_2 in ['AU', 'UA', 'GC', 'CG', 'GU', 'UG']:
+            for code_1 in (ord(residue_1), ord(residue_1.lower())):
+                for code_2 in (ord(residue_2), ord(residue_2.lower())):
+                    canonical_pairs_table[code_1, code_2] = True
+    return canonical_pairs_table[residues_1, residues_2] & np.array([orientation.lower() == 'c' and edge_1.upper() == '(' and edge_2.upper() == ')' for orientation, edge_1, edge_2 in zip(orientations, edges_1, edges_2)], dtype = np.bool_)
+
 def get_atoms_distance(a1,a2):
     """
     Return the distance between two atoms.
@@ -233,3 +258,136 @@ def renumber_pdb_atoms(pdb_file):
             else:
                 new_lines.append(line)
     return ''.join(new_lines)
+
+def get_atom_coordinates(tertiary_structures, atom_names = ["P", "C4'"]):
+    """
+    Stack the coordinates of the atoms selected by name in several tertiary structures (to compute RMSDs for example).
+
+    Parameters:
+    ---------
+    - tertiary_structures: a list of TertiaryStructure objects (see pyrna.features). The same number of atoms has to be selected in each one.
+    - atom_names (default: ["P", "C4'"]): the names of the atoms to select
+
+    Returns:
+    ------
+    the coordinates as a float64 numpy array of shape (structures count, atoms count, 3). The atoms are sorted according to the absolute positions of their residues.
+    """
+    import numpy as np
+    stacked_coordinates = []
+    for tertiary_structure in tertiary_structures:
+        selection = np.in1d(tertiary_structure.get_atom_names(), atom_names)
+        stacked_coordinates.append(tertiary_structure.coordinates[selection].astype(np.float64))
+        if len(stacked_coordinates[-1]) != len(stacked_coordinates[0]):
+            raise Exception("The tertiary structure %s has %i selected atoms instead of %i"%(tertiary_structure.name, len(stacked_coordinates[-1]), len(stacked_coordinates[0])))
+    if not stacked_coordinates:
+        return np.zeros((0, 0, 3))
+    return np.array(stacked_coordinates)
+
+def get_rmsd(coordinates_1, coordinates_2):
+    """
+    Compute the RMSDs after the optimal superposition (Kabsch algorithm) of pairs of coordinate sets.
+
+    Parameters:
+    ---------
+    - coordinates_1: the coordinates as an array of shape (pairs count, atoms count, 3) or (atoms count, 3)
+    - coordinates_2: the coordinates superposed on coordinates_1, with the same shape
+
+    Returns:
+    ------
+    the RMSDs as a numpy array of shape (pairs count,) (a float if a single pair was given)
+    """
+    import numpy as np
+    coordinates_1, coordinates_2 = np.asarray(coordinates_1, dtype = np.float64), np.asarray(coordinates_2, dtype = np.float64)
+    single = coordinates_1.ndim == 2
+    if single:
+        coordinates_1, coordinates_2 = coordinates_1[np.newaxis], coordinates_2[np.newaxis]
+    coordinates_1 = coordinates_1-coordinates_1.mean(axis = 1)[:,np.newaxis]
+    coordinates_2 = coordinates_2-coordinates_2.mean(axis = 1)[:,np.newaxis]
+    covariances = np.einsum('pni,pnj->pij', coordinates_2, coordinates_1)
+    rmsds = _get_kabsch_rmsds(covariances, (coordinates_1**2).sum(axis = (1, 2)), (coordinates_2**2).sum(axis = (1, 2)), coordinates_1.shape[1])
+    return rmsds[0] if single else rmsds
+
+def superpose(mobile_coordinates, reference_coordinates):
+    """
+    Superpose coordinates on reference coordinates (Kabsch algorithm).
+
+    Parameters:
+    ---------
+    - mobile_coordinates: the coordinates to move as an array of shape (atoms count, 3)
+    - reference_coordinates: the reference coordinates as an array of shape (atoms count, 3)
+
+    Returns:
+    ------
+    the superposed mobile coordinates as a numpy array
+    """
+    import numpy as np
+    mobile_coordinates, reference_coordinates = np.asarray(mobile_coordinates, dtype = np.float64), np.asarray(reference_coordinates, dtype = np.float64)
+    mobile_center, reference_center = mobile_coordinates.mean(axis = 0), reference_coordinates.mean(axis = 0)
+    u, s, vt = np.linalg.svd(np.dot((mobile_coordinates-mobile_center).T, reference_coordinates-reference_center))
+    d = np.sign(np.linalg.det(np.dot(u, vt)))
+    rotation = np.dot(u*[1, 1, d], vt)
+    return np.dot(mobile_coordinates-mobile_center, rotation)+reference_center
+
+def _get_kabsch_rmsds(covariances, squared_norms_1, squared_norms_2, atoms_count):
+    #the RMSD after the optimal rotation only depends on the singular values of the covariance matrix and on the sign of its determinant
+    import numpy as np
+    singular_values = np.linalg.svd(covariances, compute_uv = False)
+    singular_values[:,2] *= np.sign(np.linalg.det(covariances))
+    squared_rmsds = (squared_norms_1+squared_norms_2-2*singular_values.sum(axis = 1))/atoms_count
+    return np.sqrt(np.maximum(squared_rmsds, 0))
+
+rmsd_coordinates = None #the centered coordinates shared with the processes computing the blocks of an RMSD matrix
+
+def _set_rmsd_coordinates(coordinates):
+    global rmsd_coordinates
+    rmsd_coordinates = coordinates
+
+def _get_rmsd_block(block):
+    #the RMSDs between a block of rows and a block of columns of the RMSD matrix (a module function to be usable by a process pool). The block is sliced from the shared coordinates.
+    import numpy as np
+    rows, columns = block
+    coordinates_1, coordinates_2 = rmsd_coordinates[rows[0]:rows[1]], rmsd_coordinates[columns[0]:columns[1]]
+    covariances = np.einsum('ani,bnj->abij', coordinates_2, coordinates_1).reshape(-1, 3, 3)
+    squared_norms_1 = np.repeat((coordinates_1**2).sum(axis = (1, 2))[np.newaxis], len(coordinates_2), axis = 0).ravel()
+    squared_norms_2 = np.repeat((coordinates_2**2).sum(axis = (1, 2)), len(coordinates_1))
+    return block, _get_kabsch_rmsds(covariances, squared_norms_1, squared_norms_2, coordinates_1.shape[1]).reshape(len(coordinates_2), len(coordinates_1)).T
+
+def get_rmsd_matrix(coordinates, chunk_size = 256, processes = 1):
+    """
+    Compute the all-vs-all RMSDs after optimal superposition (Kabsch algorithm) of coordinate sets. The matrix is computed block by block to bound the memory used.
+
+    Parameters:
+    ---------
+    - coordinates: the coordinates as an array of shape (structures count, atoms count, 3) (see get_atom_coordinates())
+    - chunk_size (default: 256): the number of structures per block
+    - processes (default: 1): the number of processes computing the blocks
+
+    Returns:
+    ------
+    the symmetric RMSD matrix as a numpy array of shape (structures count, structures count)
+    """
+    import numpy as np
+    coordinates = np.asarray(coordinates, dtype = np.float64)
+    coordinates = coordinates-coordinates.mean(axis = 1)[:,np.newaxis]
+    bounds = [(start, min(start+chunk_size, len(coordinates))) for start in xrange(0, len(coordinates), chunk_size)]
+    blocks = ((rows, columns) for i, rows in enumerate(bounds) for columns in bounds[i:]) #only the bounds of the blocks are sent to the processes
+    matrix = np.zeros((len(coordinates), len(coordinates)))
+    pool = None
+    if processes > 1:
+        from multiprocessing import Pool
+        pool = Pool(processes, _set_rmsd_coordinates, (coordinates,))
+        results = pool.imap_unordered(_get_rmsd_block, blocks)
+    else:
+        _set_rmsd_coordinates(coordinates)
+        results = itertools.imap(_get_rmsd_block, blocks)
+    try:
+        for (rows, columns), result in results:
+            matrix[rows[0]:rows[1], columns[0]:columns[1]] = result
+            matrix[columns[0]:columns[1], rows[0]:rows[1]] = result.T
+    finally:
+        _set_rmsd_coordinates(None)
+        if pool:
+            pool.close()
+            pool.join()
+    matrix[np.arange(len(coordinates)), np.arange(len(coordinates))] = 0
+    return matrix
@@ -6,6 +6,8 @@ A script to test the installation of PyRNA
 
 from pyrna.db import PDB
 from pyrna.parsers import parse_pdb, secondary_structure_to_base_pairs
+from pyrna.parsers import parse_fasta
+from pyrna.features import RNA, DNA, Protein
 from pyrna.computations import Rnafold, Rnaview
 
 def test():
@@ -29,5 +31,15 @@ def test():
         print "\nList of base-pairs computed with RNAfold (RNA Vienna Package):\n"
         print Rnafold().fold(molecule=ts.rna)
 
+def test_compact_slices():
+    print "Building molecules from slices of compact molecules...\n"
+    for molecule_class, type, sequence in [(RNA, 'RNA', 'ACGUACGU'), (DNA, 'DNA', 'ACGTACGT'), (Protein, 'Protein', 'MKVLAAGI')]:
+        compact_molecule = parse_fasta('>a\n%s\n'%sequence, type = type, compact = True)[0]
+        molecule = molecule_class(sequence = compact_molecule[0:3])
+        assert molecule.sequence == sequence[0:3] and isinstance(molecule.sequence, str)
+        print molecule.__class__.__name__, molecule.sequence
+    print "DNA complement:", DNA(sequence = parse_fasta('>a\nACGTACGT\n', type = 'DNA', compact = True)[0][2:6]).complement()
+
 if __name__ == '__main__':
+    test_compact_slices()
     test()
@@ -1,6 +1,6 @@
 #!/usr/bin/env python
 
-from pyrna.features import DNA
+from pyrna.features import DNA, StructureSet, fingerprint_base_pairs
 from pymongo import MongoClient
 from pyrna.computations import Rnafold, Rnasubopt
 from pyrna.parsers import base_pairs_to_secondary_structure
@@ -14,6 +14,7 @@ rnasubopt = Rnasubopt()
 
 for genome in db['genomes'].find():
     plus_apical_loops = []
+    known_apical_loops = set()
     minus_apical_loops = []
     molecule = DNA(name=genome['name'], sequence=genome['sequence'])
     print len(molecule.sequence)
@@ -22,23 +23,21 @@ for genome in db['genomes'].find():
     sliding_window = 150
     i = 0
     while i <= len(molecule)-sliding_window:
-        all_secondary_structures = []
+        all_secondary_structures = StructureSet() #the MFE and the suboptimal structures are often the same
         print "%i %i"%(i,i+window_size)
         dna = DNA(name = molecule.name, sequence = molecule[i:i+window_size])
-        ss = rnafold.fold(dna)
-        ss = base_pairs_to_secondary_structure(dna, ss)
-        ss.find_junctions()
-        all_secondary_structures.append(ss)
-        for ss in rnasubopt.fold(dna, random_sample = 20):
-            ss = base_pairs_to_secondary_structure(dna, ss)
-            ss.find_junctions()
-            all_secondary_structures.append(ss)
+        for base_pairs in [rnafold.fold(dna)]+rnasubopt.fold(dna, random_sample = 20):
+            fingerprint = fingerprint_base_pairs(base_pairs, dna)
+            if not fingerprint in all_secondary_structures:
+                all_secondary_structures.add(base_pairs_to_secondary_structure(dna, base_pairs), fingerprint)
         #search for apical loops
         for secondary_structure in all_secondary_structures:
+            secondary_structure.find_junctions()
             for junction in secondary_structure.junctions:
                 if len(junction['location']) == 1 and len(junction['description']) >= 15:
                     positions = [x+i for x in junction['location'][0]]
-                    if positions not in plus_apical_loops:
+                    if tuple(positions) not in known_apical_loops:
+                        known_apical_loops.add(tuple(positions))
                         plus_apical_loops.append(positions)
                         print junction['description']    
         print len(plus_apical_loops) 
@@ -50,4 +49,4 @@ for genome in db['genomes'].find():
         ss = rnafold.fold(dna)
         ss = base_pairs_to_secondary_structure(dna, ss)
         ss.find_junctions()
-        print ss.junctions
\ No newline at end of file
+        print ss.junctions
@@ -9,7 +9,7 @@ from pymongo import MongoClient
 
 from pyrna.features import RNA
 from pyrna.db import Rfam
-from pyrna.parsers import consensus2d_to_base_pairs, to_bn, base_pairs_to_secondary_structure, to_clustalw
+from pyrna.parsers import consensus2d_to_aligned_base_pairs, to_bn, base_pairs_to_secondary_structure, to_clustalw
 
 
 def search(db_host = 'localhost', db_port = 27017):
@@ -37,11 +37,11 @@ def search(db_host = 'localhost', db_port = 27017):
             (rnas, organisms, consensus_2D) = rfam.get_entry(rfam_id = "RF%05u" % id, aln_type = 'full')
             print "Search in RF%05u"% id
             interesting_rnas = []
-            for rna in rnas:
+            all_base_pairs = consensus2d_to_aligned_base_pairs(rnas, consensus_2D) #the consensus 2D is projected on all the sequences at once
+            for rna, base_pairs in zip(rnas, all_base_pairs):
                 if rna.name in ['M.mulatta.244', 'E.telfairi.194', 'S.araneus.581', 'Macaca_fascicularis_.302', 'Macaca_fascicularis_.413', 'M.mulatta.290'] or re.match('^.+sapiens.+$', rna.name):
                     interesting_rnas.append(rna)
                 i += 1
-                base_pairs = consensus2d_to_base_pairs(rna, consensus_2D)
                 non_aligned_rna = RNA(name = rna.name, sequence = rna.sequence.replace('-',''))
                 ss = base_pairs_to_secondary_structure(non_aligned_rna, base_pairs)
                 ss.find_junctions()